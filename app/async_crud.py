@@ -0,0 +1,48 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+from . import crud, models
+
+# Versions asynchrones des lectures les plus fréquentes (routes async).
+# Les requêtes sont construites par crud : sync et async exécutent exactement le même SQL.
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.scalars(crud.user_by_email_statement(email))).first()
+
+async def get_zones(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return (await db.scalars(crud.zones_statement(skip=skip, limit=limit, after_id=after_id))).all()
+
+async def get_indicator_rows(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    zone_id: Optional[int] = None,
+    type: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    after: Optional[tuple] = None
+):
+    """Comme crud.get_indicators, mais en tuples bruts (colonnes crud.INDICATOR_COLUMNS), sans objets ORM."""
+    stmt = crud.indicators_statement(
+        skip=skip, limit=limit, zone_id=zone_id, type=type,
+        from_date=from_date, to_date=to_date, after=after, columns=crud.INDICATOR_COLUMNS
+    )
+    return (await db.execute(stmt)).all()
+
+async def get_latest_indicators(db: AsyncSession, types: Optional[List[str]] = None):
+    return (await db.scalars(crud.latest_indicators_statement(types))).all()
+
+async def get_data_version(db: AsyncSession, key: str):
+    """Compteur de version d'un jeu de données (None s'il n'a jamais été modifié)."""
+    return await db.get(models.DataVersion, key)
+
+async def get_indicator_rows_since(
+    db: AsyncSession,
+    after_id: int,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    limit: int = 1000
+):
+    """Relevés postérieurs (par id) à after_id, en tuples bruts."""
+    stmt = crud.indicators_since_statement(after_id, zone_ids=zone_ids, types=types, limit=limit)
+    return (await db.execute(stmt)).all()
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+# CACHE D'AUTHENTIFICATION
+# Évite de décoder le JWT et d'interroger la table users à chaque requête authentifiée.
+# Chaque entrée associe un token déjà vérifié à l'identité de son utilisateur.
+# Elle expire au plus tôt entre l'expiration du token et PRINCIPAL_TTL_SECONDS,
+# et est supprimée explicitement dès que l'utilisateur est modifié ou supprimé.
+
+MAX_ENTRIES = 10000
+PRINCIPAL_TTL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Identité de l'utilisateur connecté, telle que vue par les routes."""
+    id: int
+    email: str
+    role: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, email=user.email, role=user.role, is_active=user.is_active)
+
+
+class AuthCache:
+    """Cache LRU borné, avec expiration, des tokens vérifiés."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = PRINCIPAL_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token -> (principal, expire à)
+        self._tokens_by_user = {}       # user id -> tokens en cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                principal, expires_at = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return principal
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, token_expires_at: float):
+        expires_at = min(token_expires_at, time.time() + self.ttl)
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        """Oublie tous les tokens d'un utilisateur (à appeler après toute modification)."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0].id]
+
+
+# Instance partagée par tout le processus
+cache = AuthCache()
@@ -0,0 +1,161 @@
+import asyncio
+from typing import Iterable, Optional
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from . import models, database, crud
+
+# DIFFUSION EN DIRECT DES NOUVEAUX RELEVÉS
+# Un seul lecteur par processus suit la table indicators (id > dernier id diffusé)
+# et répartit les nouveaux relevés entre les abonnés (GET /indicators/stream).
+# - écritures faites par ce processus (API, lot, ingestion lancée ici) : le lecteur est
+#   réveillé dès le commit (voir _after_commit) ;
+# - écritures d'un autre processus (ingest_scheduler.py, ingest_data.py) : vues au
+#   prochain passage, toutes les POLL_INTERVAL_SECONDS.
+# La base n'est donc interrogée qu'une fois par réveil, quel que soit le nombre de tableaux de bord ouverts.
+#
+# Chaque abonné a une file bornée : un client trop lent pour suivre est déconnecté
+# plutôt que de faire grossir la mémoire ; il se reconnecte avec Last-Event-ID.
+
+QUEUE_SIZE = 1000
+POLL_INTERVAL_SECONDS = 1.0
+FETCH_BATCH = 5000
+
+
+class Subscription:
+    """File d'événements d'un client, filtrée par zones et types (None = tout)."""
+
+    def __init__(self, zone_ids: Optional[Iterable[int]] = None, types: Optional[Iterable[str]] = None,
+                 maxsize: int = QUEUE_SIZE):
+        self.zone_ids = set(zone_ids) if zone_ids else None
+        self.types = set(types) if types else None
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def matches(self, record: dict) -> bool:
+        return ((self.zone_ids is None or record["zone_id"] in self.zone_ids)
+                and (self.types is None or record["type"] in self.types))
+
+    async def get(self) -> Optional[dict]:
+        """Prochain relevé, ou None si l'abonné a été déconnecté pour lenteur."""
+        return await self.queue.get()
+
+    def drop(self):
+        # On vide la file pour y déposer la sentinelle de fin
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Broker:
+    """Répartiteur en mémoire des nouveaux relevés vers les abonnés du processus."""
+
+    def __init__(self, session_factory=None, poll_interval: float = POLL_INTERVAL_SECONDS,
+                 queue_size: int = QUEUE_SIZE):
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.last_id = None
+        self.published = 0
+        self.dropped = 0
+        self._loop = None
+        self._wakeup = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def subscribe(self, zone_ids=None, types=None) -> Subscription:
+        await self._ensure_running()
+        if self.last_id is None or not self.subscribers:
+            # Premier abonné, ou lecteur resté sans abonné (il n'avance plus) : on repart du
+            # dernier relevé existant, sans rediffuser ceux insérés entre-temps
+            await self.poll(rebase=True)
+        subscription = Subscription(zone_ids, types, maxsize=self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, records: Iterable[dict]):
+        """Distribue des relevés (dictionnaires crud.INDICATOR_COLUMNS) aux abonnés concernés."""
+        records = list(records)
+        for subscription in list(self.subscribers):
+            for record in records:
+                if not subscription.matches(record):
+                    continue
+                try:
+                    subscription.queue.put_nowait(record)
+                except asyncio.QueueFull:
+                    self.unsubscribe(subscription)
+                    subscription.drop()
+                    self.dropped += 1
+                    break
+        self.published += len(records)
+
+    def notify(self):
+        """Réveille le lecteur (appelable depuis n'importe quel thread, ex: route synchrone)."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # boucle en cours d'arrêt
+
+    async def poll(self, rebase: bool = False):
+        """Lit les relevés arrivés depuis le dernier passage et les diffuse."""
+        async with self._lock, self.session_factory() as db:
+            if self.last_id is None or rebase:
+                # Point de départ : on ne diffuse que ce qui arrive à partir de maintenant
+                self.last_id = (await db.scalar(select(func.max(models.Indicator.id)))) or 0
+                return
+            while True:
+                rows = (await db.execute(crud.indicators_since_statement(self.last_id, limit=FETCH_BATCH))).all()
+                if not rows:
+                    return
+                self.last_id = rows[-1].id
+                self.publish(dict(zip(crud.INDICATOR_COLUMNS, row)) for row in rows)
+                if len(rows) < FETCH_BATCH:
+                    return
+
+    async def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        # Premier abonné (ou nouvelle boucle d'événements) : on (re)démarre le lecteur
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.last_id = None
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.subscribers:
+                continue
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Diffusion des relevés : {e}")
+
+
+# Instance partagée par tout le processus
+broker = Broker()
+
+
+# crud.bump_versions note dans session.info les jeux de données modifiés :
+# après un commit touchant les relevés, on réveille le lecteur.
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if "indicators" in session.info.pop("bumped_versions", ()):
+        broker.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("bumped_versions", None)
@@ -1,19 +1,40 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional, List
+from sqlalchemy import func, inspect, or_, select, tuple_
+from sqlalchemy.schema import CreateIndex
+from typing import Iterable, Optional, List
 from datetime import datetime
-from . import models, schemas, utils
+import logging
+import math
+import numpy as np
+from . import models, schemas, utils, auth_cache, database, rollups, downsampling, hot_window
+
+# Horodatage avec fuseau ramené en UTC naïf (convention de la base)
+naive_utc = rollups.naive_utc
+
+logger = logging.getLogger("ecotrack.crud")
 
 # --- USERS ---
 
+# Les requêtes de lecture les plus fréquentes sont construites avec select() :
+# le même énoncé sert à la version synchrone (ici) et asynchrone (async_crud).
+
+def user_by_email_statement(email: str):
+    return select(models.User).where(models.User.email == email)
+
 def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+    return db.scalars(user_by_email_statement(email)).first()
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    # Session.get passe par la carte d'identité : pas de requête si l'utilisateur
+    # a déjà été chargé dans cette session (ex: par l'authentification)
+    return db.get(models.User, user_id)
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.User).order_by(models.User.id)
+    # Pagination par curseur : on repart après le dernier id vu, sans OFFSET
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    return query.offset(skip).limit(limit).all()
 
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = utils.get_password_hash(user.password)
@@ -35,24 +56,37 @@ def update_user(db: Session, db_user: models.User, updates: schemas.UserUpdate):
         db_user.is_active = updates.is_active
     db.commit()
     db.refresh(db_user)
+    auth_cache.cache.invalidate_user(db_user.id)
     return db_user
 
 def delete_user(db: Session, db_user: models.User):
     db.delete(db_user)
     db.commit()
+    auth_cache.cache.invalidate_user(db_user.id)
 
 # --- ZONES ---
 
-def get_zones(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Zone).offset(skip).limit(limit).all()
+def zones_statement(skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    stmt = select(models.Zone).order_by(models.Zone.id)
+    # Pagination par curseur : on repart après le dernier id vu, sans OFFSET
+    if after_id is not None:
+        stmt = stmt.where(models.Zone.id > after_id)
+    return stmt.offset(skip).limit(limit)
+
+def get_zones(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return db.scalars(zones_statement(skip=skip, limit=limit, after_id=after_id)).all()
 
 def create_zone(db: Session, zone: schemas.ZoneCreate):
     db_zone = models.Zone(
         name=zone.name,
         postal_code=zone.postal_code,
-        country=zone.country
+        country=zone.country,
+        latitude=zone.latitude,
+        longitude=zone.longitude,
+        region=zone.region
     )
     db.add(db_zone)
+    bump_versions(db, ["zones"])
     db.commit()
     db.refresh(db_zone)
     return db_zone
@@ -63,6 +97,10 @@ def update_zone(db: Session, zone_id: int, updates: schemas.ZoneUpdate):
         if updates.name is not None: db_zone.name = updates.name
         if updates.postal_code is not None: db_zone.postal_code = updates.postal_code
         if updates.country is not None: db_zone.country = updates.country
+        if updates.latitude is not None: db_zone.latitude = updates.latitude
+        if updates.longitude is not None: db_zone.longitude = updates.longitude
+        if updates.region is not None: db_zone.region = updates.region
+        bump_versions(db, ["zones"])
         db.commit()
         db.refresh(db_zone)
     return db_zone
@@ -71,12 +109,118 @@ def delete_zone(db: Session, zone_id: int):
     db_zone = db.query(models.Zone).filter(models.Zone.id == zone_id).first()
     if db_zone:
         db.delete(db_zone)
+        bump_versions(db, ["zones"])
         db.commit()
         return True
     return False
 
+# --- VERSIONS (ETag des listes) ---
+
+def indicator_version_keys(zone_ids: Iterable[int], rewritten: Iterable = ()):
+    """
+    Compteurs touchés par une écriture de relevés : global et par zone.
+    rewritten : séries (zone_id, type) modifiées ou supprimées, et non simplement complétées
+    (séries de la fenêtre chaude à relire).
+    """
+    keys = ["indicators"] + [f"indicators:zone:{zone_id}" for zone_id in set(zone_ids)]
+    rewritten = set(rewritten)
+    return keys + hot_window.rewrite_keys(rewritten) if rewritten else keys
+
+def bump_versions(db: Session, keys: Iterable[str]):
+    """Incrémente les compteurs de version (INSERT ... ON CONFLICT DO UPDATE). Ne fait pas de commit."""
+    keys = list(keys)
+    now = datetime.utcnow()
+    rows = [{"key": key, "version": 1, "updated_at": now} for key in keys]
+    if not rows:
+        return
+    table = models.DataVersion.__table__
+    stmt = database.dialect_insert(db)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"version": table.c.version + 1, "updated_at": stmt.excluded["updated_at"]}
+    )
+    db.execute(stmt, rows)
+    # Retenu jusqu'au commit (ex: broker réveille les abonnés au flux des relevés)
+    db.info.setdefault("bumped_versions", set()).update(keys)
+
 # --- INDICATORS ---
 
+def _filter_indicators(
+    query,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None
+):
+    """Applique les filtres communs (zones, types, période) sur une requête d'indicateurs (Query ou select)."""
+    if zone_ids:
+        query = query.filter(models.Indicator.zone_id.in_(zone_ids))
+    if types:
+        query = query.filter(models.Indicator.type.in_(types))
+    if from_date:
+        query = query.filter(models.Indicator.timestamp >= from_date)
+    if to_date:
+        query = query.filter(models.Indicator.timestamp <= to_date)
+    return query
+
+# Colonnes d'un relevé, dans l'ordre : listes en lignes brutes, export NDJSON / CSV
+INDICATOR_COLUMNS = ("id", "zone_id", "type", "value", "unit", "timestamp")
+
+def indicators_statement(
+    skip: int = 0,
+    limit: int = 100,
+    zone_id: Optional[int] = None,
+    type: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    after: Optional[tuple] = None,
+    columns: Optional[tuple] = None
+):
+    """
+    Relevés triés par (timestamp, id).
+    after=(timestamp, id) du dernier relevé de la page précédente active la pagination
+    par curseur (keyset) : la base saute directement à la suite via l'index, sans OFFSET.
+    columns (ex: INDICATOR_COLUMNS) sélectionne des colonnes brutes au lieu d'objets ORM.
+    Les bornes et le curseur avec fuseau sont ramenés en UTC naïf, comme pour les agrégations.
+    """
+    selected = [getattr(models.Indicator, column) for column in columns] if columns else [models.Indicator]
+    stmt = _filter_indicators(
+        select(*selected),
+        zone_ids=[zone_id] if zone_id else None,
+        types=[type] if type else None,
+        from_date=naive_utc(from_date),
+        to_date=naive_utc(to_date)
+    )
+    if after is not None:
+        timestamp, last_id = after
+        stmt = stmt.where(tuple_(models.Indicator.timestamp, models.Indicator.id) > tuple_(naive_utc(timestamp), last_id))
+    stmt = stmt.order_by(models.Indicator.timestamp, models.Indicator.id)
+    return stmt.offset(skip).limit(limit)
+
+def indicators_since_statement(
+    after_id: int,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    limit: int = 1000
+):
+    """Relevés d'id supérieur à after_id, dans l'ordre d'insertion, en colonnes brutes (suivi du flux)."""
+    stmt = _filter_indicators(
+        select(*(getattr(models.Indicator, column) for column in INDICATOR_COLUMNS)),
+        zone_ids=zone_ids, types=types, from_date=None, to_date=None
+    )
+    return stmt.where(models.Indicator.id > after_id).order_by(models.Indicator.id).limit(limit)
+
+def latest_indicators_statement(types: Optional[List[str]] = None):
+    """Dernier relevé de chaque (zone, type), lu dans la table maintenue indicator_latest."""
+    latest = models.IndicatorLatest
+    stmt = select(latest)
+    if types:
+        stmt = stmt.where(latest.type.in_(types))
+    return stmt.order_by(latest.zone_id, latest.type)
+
+def get_latest_indicators(db: Session, types: Optional[List[str]] = None):
+    return db.scalars(latest_indicators_statement(types)).all()
+
 def get_indicators(
     db: Session, 
     skip: int = 0, 
@@ -84,39 +228,395 @@ def get_indicators(
     zone_id: Optional[int] = None, 
     type: Optional[str] = None,
     from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    after: Optional[tuple] = None
+):
+    stmt = indicators_statement(
+        skip=skip, limit=limit, zone_id=zone_id, type=type,
+        from_date=from_date, to_date=to_date, after=after
+    )
+    return db.scalars(stmt).all()
+
+def iter_indicators(
+    db: Session,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    batch_size: int = 1000
+):
+    """
+    Parcourt les relevés par lots de batch_size via un curseur côté serveur (yield_per),
+    sans construire d'objets ORM : la mémoire reste constante quel que soit le volume.
+    """
+    query = db.query(*(getattr(models.Indicator, column) for column in INDICATOR_COLUMNS))
+    query = _filter_indicators(query, zone_ids, types, naive_utc(from_date), naive_utc(to_date))
+    return query.order_by(models.Indicator.timestamp, models.Indicator.id).yield_per(batch_size)
+
+def _compacted_hours(
+    db: Session,
+    boundaries: dict,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None
 ):
-    query = db.query(models.Indicator)
-    
-    if zone_id:
-        query = query.filter(models.Indicator.zone_id == zone_id)
-    if type:
-        query = query.filter(models.Indicator.type == type)
+    """
+    Agrégats horaires de la période compactée (relevés bruts supprimés par la rétention).
+    Une borne tombant au milieu d'une heure inclut l'heure entière : c'est la résolution
+    qui reste une fois les relevés bruts supprimés.
+    """
+    model = models.IndicatorRollupHourly
+    query = db.query(model).filter(rollups.compacted_condition(boundaries, model.type, model.bucket))
+    if zone_ids:
+        query = query.filter(model.zone_id.in_(zone_ids))
+    if types:
+        query = query.filter(model.type.in_(types))
     if from_date:
-        query = query.filter(models.Indicator.timestamp >= from_date)
+        query = query.filter(model.bucket >= rollups.truncate(from_date, 3600))
     if to_date:
-        query = query.filter(models.Indicator.timestamp <= to_date)
-        
-    return query.offset(skip).limit(limit).all()
+        query = query.filter(model.bucket <= to_date)
+    return query
 
-def get_indicator_stats(db: Session, zone_id: int, type: str):
-    avg_value = db.query(func.avg(models.Indicator.value))\
-        .filter(models.Indicator.zone_id == zone_id, models.Indicator.type == type)\
-        .scalar()
+# Largeurs de tranches acceptées par l'agrégation (en secondes)
+BUCKET_WIDTHS = {
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Tranches servies directement par les tables d'agrégats
+ROLLUP_BUCKETS = {"1h": "hour", "1d": "day"}
+
+def get_indicator_series(
+    db: Session,
+    zone_id: int,
+    type: str,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    points: int = 500
+):
+    """
+    Série (horodatage, valeur) d'une zone et d'un type, réduite à au plus points valeurs
+    par LTTB : la taille de la réponse ne dépend plus de la densité des relevés.
+    Sur la période compactée (rétention), les relevés bruts sont remplacés par les moyennes horaires.
+    Une période couverte par la fenêtre chaude (hot_window) est lue en mémoire, sans requête SQL.
+    """
+    from_date, to_date = naive_utc(from_date), naive_utc(to_date)
+    hot = hot_window.cache.get_series(db, zone_id, type, from_date, to_date)
+    if hot is not None:
+        x_us, y, unit = hot
+        if not len(y):
+            return schemas.IndicatorSeries(zone_id=zone_id, type=type, count=0, timestamp=[], value=[])
+        keep = downsampling.lttb(x_us.astype(np.int64) / 1e6, y, points)
+        return schemas.IndicatorSeries(
+            zone_id=zone_id, type=type, unit=unit, count=len(y),
+            timestamp=x_us[keep].tolist(), value=y[keep].tolist()
+        )
+
+    boundaries = rollups.compaction_boundaries(db, [type])
+    query = _filter_indicators(
+        db.query(models.Indicator.timestamp, models.Indicator.value, models.Indicator.unit),
+        zone_ids=[zone_id], types=[type], from_date=from_date, to_date=to_date
+    ).filter(rollups.raw_condition(boundaries, models.Indicator.type, models.Indicator.timestamp))
+    rows = query.order_by(models.Indicator.timestamp, models.Indicator.id).all()
+    if boundaries:
+        # Période compactée : un point par heure (moyenne de la tranche), avant les relevés bruts
+        rows = _compacted_hours(db, boundaries, [zone_id], [type], from_date, to_date)\
+            .with_entities(
+                models.IndicatorRollupHourly.bucket,
+                models.IndicatorRollupHourly.sum / models.IndicatorRollupHourly.count,
+                models.IndicatorRollupHourly.unit
+            ).order_by(models.IndicatorRollupHourly.bucket).all() + rows
+    if not rows:
+        return schemas.IndicatorSeries(zone_id=zone_id, type=type, count=0, timestamp=[], value=[])
 
-    if avg_value is None:
+    timestamps, values, units = zip(*rows)
+    x = np.array(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+    y = np.fromiter(values, dtype=np.float64, count=len(values))
+    keep = downsampling.lttb(x, y, points)
+    return schemas.IndicatorSeries(
+        zone_id=zone_id,
+        type=type,
+        unit=units[-1],
+        count=len(rows),
+        timestamp=[timestamps[i] for i in keep],
+        value=y[keep].tolist()
+    )
+
+def get_indicator_aggregates(
+    db: Session,
+    bucket: str = "1h",
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None
+):
+    """
+    Agrège les relevés par (zone, type, tranche de temps) en une seule requête.
+    Renvoie min / max / moyenne / nombre de points pour chaque tranche.
+    Pour 1h et 1d avec des bornes alignées sur les tranches, la réponse est lue
+    dans les agrégats maintenus (rollups) ; to_date reste inclus partout : les relevés tombant
+    exactement sur to_date forment la dernière tranche, comme sur les relevés bruts.
+    Sinon, la période compactée (rétention) est lue dans les agrégats horaires.
+    Une période couverte par la fenêtre chaude (hot_window) est agrégée en mémoire, avec les mêmes bornes.
+    """
+    from_date, to_date = naive_utc(from_date), naive_utc(to_date)
+    width = BUCKET_WIDTHS[bucket]
+    granularity = ROLLUP_BUCKETS.get(bucket)
+    use_rollups = granularity and rollups.is_aligned(from_date, width) and rollups.is_aligned(to_date, width)
+    rows = hot_window.cache.get_aggregates(db, width, zone_ids, types, from_date, to_date)
+    if rows is not None:
+        return [
+            schemas.IndicatorAggregate(
+                zone_id=zone_id, type=type_, bucket=rollups.from_epoch(start),
+                count=count, min=min_value, max=max_value, avg=avg_value
+            )
+            for zone_id, type_, start, count, min_value, max_value, avg_value in rows
+        ]
+
+    if use_rollups:
+        model = rollups.GRANULARITIES[granularity][0]
+        query = db.query(model)
+        if zone_ids:
+            query = query.filter(model.zone_id.in_(zone_ids))
+        if types:
+            query = query.filter(model.type.in_(types))
+        if from_date:
+            query = query.filter(model.bucket >= from_date)
+        if to_date:
+            query = query.filter(model.bucket < to_date)
+        aggregates = [
+            schemas.IndicatorAggregate(
+                zone_id=rollup.zone_id,
+                type=rollup.type,
+                bucket=rollup.bucket,
+                count=rollup.count,
+                min=rollup.min,
+                max=rollup.max,
+                avg=rollup.sum / rollup.count
+            )
+            for rollup in query.order_by(model.zone_id, model.type, model.bucket)
+        ]
+        if to_date:
+            # Borne incluse : relevés bruts tombant exactement sur to_date (début de la tranche suivante)
+            at_end = _filter_indicators(db.query(
+                models.Indicator.zone_id,
+                models.Indicator.type,
+                func.count(models.Indicator.id),
+                func.min(models.Indicator.value),
+                func.max(models.Indicator.value),
+                func.avg(models.Indicator.value)
+            ), zone_ids, types).filter(models.Indicator.timestamp == to_date)\
+                .group_by(models.Indicator.zone_id, models.Indicator.type).all()
+            aggregates += [
+                schemas.IndicatorAggregate(
+                    zone_id=zone_id, type=type_, bucket=to_date,
+                    count=count, min=min_value, max=max_value, avg=avg_value
+                )
+                for zone_id, type_, count, min_value, max_value, avg_value in at_end
+            ]
+            aggregates.sort(key=lambda aggregate: (aggregate.zone_id, aggregate.type, aggregate.bucket))
+        return aggregates
+
+    boundaries = rollups.compaction_boundaries(db, types)
+    bucket_start = rollups.epoch_bucket(db, width).label("bucket")
+    query = db.query(
+        models.Indicator.zone_id,
+        models.Indicator.type,
+        bucket_start,
+        func.count(models.Indicator.id),
+        func.min(models.Indicator.value),
+        func.max(models.Indicator.value),
+        func.avg(models.Indicator.value)
+    )
+    query = _filter_indicators(query, zone_ids, types, from_date, to_date)\
+        .filter(rollups.raw_condition(boundaries, models.Indicator.type, models.Indicator.timestamp))
+    rows = query.group_by(models.Indicator.zone_id, models.Indicator.type, bucket_start)\
+        .order_by(models.Indicator.zone_id, models.Indicator.type, bucket_start)\
+        .all()
+
+    if boundaries:
+        # Période compactée : tranches reconstituées depuis les agrégats horaires
+        # (tranches d'au moins une heure, la résolution qui subsiste)
+        hourly = models.IndicatorRollupHourly
+        compacted_start = rollups.epoch_bucket(db, max(width, 3600), column=hourly.bucket).label("bucket")
+        compacted = _compacted_hours(db, boundaries, zone_ids, types, from_date, to_date).with_entities(
+            hourly.zone_id,
+            hourly.type,
+            compacted_start,
+            func.sum(hourly.count),
+            func.min(hourly.min),
+            func.max(hourly.max),
+            func.sum(hourly.sum) / func.sum(hourly.count)
+        ).group_by(hourly.zone_id, hourly.type, compacted_start).all()
+        rows = sorted(compacted + rows, key=lambda row: (row[0], row[1], row[2]))
+
+    return [
+        schemas.IndicatorAggregate(
+            zone_id=zone_id,
+            type=type_,
+            bucket=rollups.from_epoch(start),
+            count=count,
+            min=min_value,
+            max=max_value,
+            avg=avg_value
+        )
+        for zone_id, type_, start, count, min_value, max_value, avg_value in rows
+    ]
+
+def _rollup_stat_columns(model):
+    return (
+        model.zone_id, model.type, func.max(model.unit),
+        func.sum(model.count), func.sum(model.sum), func.sum(model.sum_sq),
+        func.min(model.min), func.max(model.max)
+    )
+
+def _stat_sources(
+    db: Session,
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    types: Optional[List[str]] = None
+):
+    """
+    Sources à agréger : liste de (table, requête) de colonnes (zone_id, type, unit, count, sum,
+    sum_sq, min, max). Les agrégats maintenus si les bornes sont alignées sur l'heure (plus les
+    relevés bruts tombant exactement sur to_date, borne incluse comme partout), sinon
+    les relevés bruts, complétés des agrégats horaires sur la période compactée (rétention).
+    """
+    value = models.Indicator.value
+    raw = db.query(
+        models.Indicator.zone_id, models.Indicator.type, func.max(models.Indicator.unit),
+        func.count(models.Indicator.id), func.sum(value), func.sum(value * value),
+        func.min(value), func.max(value)
+    )
+    model = rollups.covering_rollup(from_date, to_date)
+    if model is not None:
+        query = db.query(*_rollup_stat_columns(model))
+        if from_date:
+            query = query.filter(model.bucket >= from_date)
+        if to_date:
+            query = query.filter(model.bucket < to_date)
+            return [(model, query), (models.Indicator, raw.filter(models.Indicator.timestamp == to_date))]
+        return [(model, query)]
+
+    boundaries = rollups.compaction_boundaries(db, types)
+    query = _filter_indicators(raw, from_date=from_date, to_date=to_date)\
+        .filter(rollups.raw_condition(boundaries, models.Indicator.type, models.Indicator.timestamp))
+    sources = [(models.Indicator, query)]
+    if boundaries:
+        hourly = models.IndicatorRollupHourly
+        compacted = _compacted_hours(db, boundaries, from_date=from_date, to_date=to_date)
+        sources.append((hourly, compacted.with_entities(*_rollup_stat_columns(hourly))))
+    return sources
+
+def _percentiles(
+    db: Session,
+    percentiles: List[float],
+    zone_ids: Optional[List[int]],
+    types: Optional[List[str]],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime]
+):
+    """
+    Percentiles (méthode du rang le plus proche) de chaque (zone, type), en une requête
+    à fonctions de fenêtre qui ne renvoie que les lignes aux rangs demandés.
+    """
+    partition = (models.Indicator.zone_id, models.Indicator.type)
+    ranked = _filter_indicators(
+        db.query(
+            models.Indicator.zone_id,
+            models.Indicator.type,
+            models.Indicator.value,
+            func.row_number().over(partition_by=partition, order_by=models.Indicator.value).label("rank"),
+            func.count().over(partition_by=partition).label("total")
+        ),
+        zone_ids, types, from_date, to_date
+    ).subquery()
+
+    # Rang du percentile p sur n valeurs : le plus petit r tel que r * 100 >= p * n
+    wanted = [
+        (ranked.c.rank * 100 >= p * ranked.c.total) & ((ranked.c.rank - 1) * 100 < p * ranked.c.total)
+        for p in percentiles
+    ]
+    result = {}
+    for zone_id, type_, value, rank, total in db.query(ranked).filter(or_(*wanted)):
+        for p in percentiles:
+            if rank * 100 >= p * total and (rank - 1) * 100 < p * total:
+                result.setdefault((zone_id, type_), {})[f"p{p:g}"] = value
+    return result
+
+def get_indicator_stats_grouped(
+    db: Session,
+    zone_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    percentiles: Optional[List[float]] = None
+):
+    """
+    Statistiques (nombre, min, max, moyenne, écart-type) de chaque couple (zone, type)
+    en une seule requête GROUP BY, avec le nom de zone joint (une de plus sur la période
+    compactée par la rétention). Les percentiles demandés nécessitent les relevés bruts
+    (une requête de plus) : ils ne portent que sur les relevés encore conservés.
+    """
+    from_date, to_date = naive_utc(from_date), naive_utc(to_date)
+    # (zone, type) -> [unit, count, sum, sum_sq, min, max, zone_name], sources fusionnées
+    merged = {}
+    for source, query in _stat_sources(db, from_date, to_date, types):
+        if zone_ids:
+            query = query.filter(source.zone_id.in_(zone_ids))
+        if types:
+            query = query.filter(source.type.in_(types))
+        rows = query.add_columns(models.Zone.name)\
+            .outerjoin(models.Zone, models.Zone.id == source.zone_id)\
+            .group_by(source.zone_id, source.type, models.Zone.name)\
+            .all()
+        for zone_id, type_, unit, count, total, total_sq, min_value, max_value, zone_name in rows:
+            if not count:
+                continue
+            current = merged.get((zone_id, type_))
+            if current is None:
+                merged[(zone_id, type_)] = [unit, count, total, total_sq, min_value, max_value, zone_name]
+            else:
+                current[1:6] = [
+                    current[1] + count, current[2] + total, current[3] + total_sq,
+                    min(current[4], min_value), max(current[5], max_value)
+                ]
+                current[0] = current[0] or unit
+
+    by_pair = _percentiles(db, percentiles, zone_ids, types, from_date, to_date) if percentiles else {}
+
+    results = []
+    for (zone_id, type_), (unit, count, total, total_sq, min_value, max_value, zone_name) in sorted(merged.items()):
+        mean = total / count
+        variance = (total_sq - count * mean * mean) / (count - 1) if count > 1 else 0.0
+        results.append(schemas.IndicatorStats(
+            zone_id=zone_id,
+            zone=zone_name or f"Zone {zone_id}",
+            type=type_,
+            unit=unit or "",
+            count=count,
+            min=min_value,
+            max=max_value,
+            mean=mean,
+            stddev=math.sqrt(max(variance, 0.0)),
+            percentiles=by_pair.get((zone_id, type_), {})
+        ))
+    return results
+
+def get_indicator_stats(db: Session, zone_id: int, type: str):
+    """Moyenne d'un (zone, type), lue en une requête dans les agrégats journaliers."""
+    stats = get_indicator_stats_grouped(db, zone_ids=[zone_id], types=[type])
+    if not stats:
         return None
 
-    zone = db.query(models.Zone).filter(models.Zone.id == zone_id).first()
-    unit_entry = db.query(models.Indicator.unit)\
-        .filter(models.Indicator.zone_id == zone_id, models.Indicator.type == type)\
-        .first()
-    
     return schemas.StatResult(
-        zone=zone.name if zone else f"Zone {zone_id}",
+        zone=stats[0].zone,
         type=type,
-        average=avg_value,
-        unit=unit_entry[0] if unit_entry else ""
+        average=stats[0].mean,
+        unit=stats[0].unit
     )
 
 def create_indicator(db: Session, indicator: schemas.IndicatorCreate):
@@ -125,23 +625,208 @@ def create_indicator(db: Session, indicator: schemas.IndicatorCreate):
         value=indicator.value,
         unit=indicator.unit,
         zone_id=indicator.zone_id,
-        timestamp=indicator.timestamp or datetime.utcnow()
+        timestamp=naive_utc(indicator.timestamp or datetime.utcnow())
     )
     db.add(db_indicator)
+    db.flush()
+    # Agrégats mis à jour dans la même transaction que l'insertion
+    rollups.apply(db, [db_indicator])
+    hot_window.remember_inserted(db, [db_indicator])
+    bump_versions(db, indicator_version_keys([db_indicator.zone_id]))
     db.commit()
     db.refresh(db_indicator)
     return db_indicator
 
+def bulk_insert_indicators(db: Session, rows: List[dict]):
+    """
+    Insère un lot de relevés en une seule instruction
+    INSERT ... ON CONFLICT (zone_id, type, timestamp) DO NOTHING.
+    Les relevés déjà présents, ou antérieurs à la compaction de leur type (rétention),
+    sont ignorés ; renvoie les lignes réellement insérées,
+    déjà intégrées aux agrégats (rollups). Ne fait pas de commit : c'est à l'appelant de valider la transaction.
+    """
+    if not rows:
+        return []
+    for row in rows:
+        row["timestamp"] = naive_utc(row["timestamp"])
+    # Relevés antérieurs à la compaction de leur type : déjà comptés dans les agrégats,
+    # leur ligne brute supprimée ne suffit plus à les dédoublonner (ex: ingestion qui relit 7 jours)
+    boundaries = rollups.compaction_boundaries(db, {row["type"] for row in rows})
+    if boundaries:
+        rows = [row for row in rows if row["timestamp"] >= boundaries.get(row["type"], row["timestamp"])]
+        if not rows:
+            return []
+
+    table = models.Indicator.__table__
+    stmt = database.dialect_insert(db)(table)\
+        .on_conflict_do_nothing(index_elements=["zone_id", "type", "timestamp"])\
+        .returning(table.c.id, table.c.zone_id, table.c.type, table.c.timestamp,
+                   table.c.value, table.c.unit)
+    inserted = db.execute(stmt, rows).all()
+    # Seuls les relevés réellement insérés alimentent les agrégats
+    rollups.apply(db, inserted)
+    hot_window.remember_inserted(db, inserted)
+    if inserted:
+        bump_versions(db, indicator_version_keys(row.zone_id for row in inserted))
+    return inserted
+
+def ensure_indicator_indexes(engine):
+    """
+    Ajoute à une base existante les index déclarés sur indicators (create_all ne modifie pas une
+    table déjà créée) : CREATE INDEX IF NOT EXISTS, sans effet s'ils existent. Appelé au démarrage.
+    Avant de créer l'index unique (zone_id, type, timestamp), les doublons sont supprimés
+    (le plus petit id est conservé, voir _remove_duplicate_indicators), sans quoi sa création échouerait.
+    """
+    table = models.Indicator.__table__
+    existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    with Session(engine) as db:
+        for index in table.indexes:
+            if index.unique and index.name not in existing:
+                _remove_duplicate_indicators(db, list(index.columns))
+            db.execute(CreateIndex(index, if_not_exists=True))
+        db.commit()
+
+def _remove_duplicate_indicators(db: Session, columns: list):
+    """
+    Supprime les doublons de (zone_id, type, timestamp) en gardant le plus petit id, puis recalcule
+    les agrégats et derniers relevés touchés. Les clés contenant NULL sont ignorées : l'index
+    unique les considère comme distinctes. Ne fait pas de commit.
+    """
+    table = models.Indicator.__table__
+    complete = [column.isnot(None) for column in columns]
+    duplicated = db.execute(
+        select(*columns).where(*complete).group_by(*columns).having(func.count() > 1)
+    ).all()
+    if not duplicated:
+        return
+    keep = select(func.min(table.c.id)).where(*complete).group_by(*columns)
+    deleted = db.execute(table.delete().where(*complete, table.c.id.not_in(keep))).rowcount
+    rollups.refresh_buckets(db, [tuple(key) for key in duplicated])
+    bump_versions(db, indicator_version_keys((key[0] for key in duplicated),
+                                          rewritten=((key[0], key[1]) for key in duplicated)))
+    logger.warning("Index unique %s : %d relevés en double supprimés (%d clés), agrégats recalculés",
+                   "(" + ", ".join(column.name for column in columns) + ")", deleted, len(duplicated))
+
+def get_ingestion_watermark(db: Session, zone_id: int, source: str, type: str):
+    """Renvoie (en la créant si besoin) la ligne de suivi d'ingestion d'une zone pour une source."""
+    key = {"zone_id": zone_id, "source": source, "type": type}
+    watermark = db.get(models.IngestionWatermark, key)
+    if watermark is None:
+        watermark = models.IngestionWatermark(
+            **key, runs_total=0, rows_fetched_total=0, rows_inserted_total=0, failures_total=0
+        )
+        db.add(watermark)
+        db.flush()
+    return watermark
+
+def record_ingestion_run(db: Session, zone_id: int, source: str, type: str, fetched: int = 0,
+                         inserted: int = 0, duration_ms: float = 0.0, failed: bool = False):
+    """
+    Enregistre le bilan d'une exécution d'ingestion (dernier passage et cumuls).
+    Ne touche pas au high-water mark et ne fait pas de commit.
+    """
+    watermark = get_ingestion_watermark(db, zone_id, source, type)
+    watermark.last_run_at = datetime.utcnow()
+    watermark.last_duration_ms = duration_ms
+    watermark.runs_total = (watermark.runs_total or 0) + 1
+    if failed:
+        watermark.failures_total = (watermark.failures_total or 0) + 1
+    else:
+        watermark.last_rows_fetched = fetched
+        watermark.last_rows_inserted = inserted
+        watermark.rows_fetched_total = (watermark.rows_fetched_total or 0) + fetched
+        watermark.rows_inserted_total = (watermark.rows_inserted_total or 0) + inserted
+    return watermark
+
+def get_ingestion_totals(db: Session):
+    """Cumuls d'ingestion par source : [(source, exécutions, récupérés, insérés, échecs, dernière exécution)]."""
+    w = models.IngestionWatermark
+    return db.query(
+        w.source,
+        func.coalesce(func.sum(w.runs_total), 0),
+        func.coalesce(func.sum(w.rows_fetched_total), 0),
+        func.coalesce(func.sum(w.rows_inserted_total), 0),
+        func.coalesce(func.sum(w.failures_total), 0),
+        func.max(w.last_run_at),
+    ).group_by(w.source).order_by(w.source).all()
+
+# Taille maximale d'un lot pour POST /indicators/batch
+MAX_BATCH_SIZE = 10000
+
+def create_indicators_batch(db: Session, indicators: List[schemas.IndicatorCreate]):
+    """
+    Insère un lot de relevés en une seule transaction (un seul executemany).
+    Les zones sont validées en une requête pour tout le lot ; les relevés
+    dont la zone n'existe pas sont signalés en erreur sans bloquer les autres,
+    ceux qui existent déjà (même zone, type et horodatage) en doublon.
+    """
+    zone_ids = {indicator.zone_id for indicator in indicators}
+    known_zones = {
+        zone_id for (zone_id,) in
+        db.query(models.Zone.id).filter(models.Zone.id.in_(zone_ids)).all()
+    }
+
+    now = datetime.utcnow()
+    results = []
+    pending = []
+    rows = []
+    for index, indicator in enumerate(indicators):
+        if indicator.zone_id not in known_zones:
+            results.append(schemas.IndicatorBatchItem(
+                index=index, status="error", detail=f"Zone {indicator.zone_id} not found"
+            ))
+            continue
+        item = schemas.IndicatorBatchItem(index=index, status="duplicate")
+        results.append(item)
+        pending.append(item)
+        rows.append({
+            "type": indicator.type,
+            "value": indicator.value,
+            "unit": indicator.unit,
+            "zone_id": indicator.zone_id,
+            "timestamp": naive_utc(indicator.timestamp or now),
+        })
+
+    inserted = {
+        (row.zone_id, row.type, row.timestamp): row.id
+        for row in bulk_insert_indicators(db, rows)
+    }
+    db.commit()
+
+    # Le premier élément d'une clé (zone, type, horodatage) reçoit l'id, les suivants sont des doublons
+    for item, row in zip(pending, rows):
+        key = (row["zone_id"], row["type"], row["timestamp"])
+        if key in inserted:
+            item.status = "created"
+            item.id = inserted.pop(key)
+        else:
+            item.detail = "Indicator already exists for this zone, type and timestamp"
+
+    created = sum(1 for item in pending if item.status == "created")
+    return schemas.IndicatorBatchResult(
+        created=created,
+        duplicates=len(pending) - created,
+        errors=len(results) - len(pending),
+        items=results
+    )
+
 def update_indicator(db: Session, indicator_id: int, updates: schemas.IndicatorUpdate):
     db_indicator = db.query(models.Indicator).filter(models.Indicator.id == indicator_id).first()
     if not db_indicator:
         return None
     
+    old_key = (db_indicator.zone_id, db_indicator.type, db_indicator.timestamp)
     if updates.type is not None: db_indicator.type = updates.type
     if updates.value is not None: db_indicator.value = updates.value
     if updates.unit is not None: db_indicator.unit = updates.unit
     if updates.zone_id is not None: db_indicator.zone_id = updates.zone_id
     
+    db.flush()
+    # Un min / max ne se « retire » pas : on recalcule les tranches touchées
+    rollups.refresh_buckets(db, [old_key, (db_indicator.zone_id, db_indicator.type, db_indicator.timestamp)])
+    bump_versions(db, indicator_version_keys([old_key[0], db_indicator.zone_id],
+                                          rewritten=[old_key[:2], (db_indicator.zone_id, db_indicator.type)]))
+    hot_window.remember_rewrite(db)
     db.commit()
     db.refresh(db_indicator)
     return db_indicator
@@ -149,7 +834,12 @@ def update_indicator(db: Session, indicator_id: int, updates: schemas.IndicatorU
 def delete_indicator(db: Session, indicator_id: int):
     db_indicator = db.query(models.Indicator).filter(models.Indicator.id == indicator_id).first()
     if db_indicator:
+        key = (db_indicator.zone_id, db_indicator.type, db_indicator.timestamp)
         db.delete(db_indicator)
+        db.flush()
+        rollups.refresh_buckets(db, [key])
+        bump_versions(db, indicator_version_keys([key[0]], rewritten=[key[:2]]))
+        hot_window.remember_rewrite(db)
         db.commit()
         return True
-    return False
\ No newline at end of file
+    return False
@@ -1,42 +1,130 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import database, models, utils, crud
+from typing import Optional
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from . import database, models, utils, crud, async_crud, auth_cache
 
 # Indique à FastAPI que le token se trouve dans l'URL /auth/login
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str):
+    """Vérifie le JWT et renvoie (email, expiration) ; 401 si invalide."""
     try:
         payload = jwt.decode(token, utils.SECRET_KEY, algorithms=[utils.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-    
-    user = crud.get_user_by_email(db, email=email)
+        raise _credentials_exception()
+    return email, payload["exp"]
+
+def _remember(token: str, user, expires_at: float):
+    """Met en cache l'identité d'un utilisateur fraîchement chargé."""
     if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+    principal = auth_cache.Principal.from_user(user)
+    auth_cache.cache.put(token, principal, token_expires_at=expires_at)
+    return principal
 
-async def get_admin_user(current_user: models.User = Depends(get_current_user)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    """
+    Renvoie l'utilisateur connecté (auth_cache.Principal : id, email, role, is_active).
+    Un token déjà vérifié est servi depuis le cache, sans décodage JWT ni requête SQL.
+    La session est celle de la requête (database.get_db), partagée avec la route.
+    """
+    principal = auth_cache.cache.get(token)
+    if principal is not None:
+        return principal
+    email, expires_at = _decode_token(token)
+    return _remember(token, crud.get_user_by_email(db, email=email), expires_at)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
+    """Même chose que get_current_user, pour les routes async (session database.get_async_db)."""
+    principal = auth_cache.cache.get(token)
+    if principal is not None:
+        return principal
+    email, expires_at = _decode_token(token)
+    return _remember(token, await async_crud.get_user_by_email(db, email=email), expires_at)
+
+async def get_admin_user(current_user: auth_cache.Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(
             status_code=403, 
             detail="Operation not permitted (Admin only)"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+def get_cursor(cursor: Optional[str] = None):
+    """Décode le paramètre ?cursor= des listes paginées (None pour la première page)."""
+    if cursor is None:
+        return None
+    try:
+        return utils.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def cursor_id(after: Optional[list]):
+    """Id contenu dans un curseur de liste paginée par id (zones, utilisateurs)."""
+    if after is None:
+        return None
+    if len(after) != 1 or not isinstance(after[0], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after[0]
+
+def cursor_timestamp_id(after: Optional[list]):
+    """(timestamp, id) contenus dans un curseur de la liste des indicateurs."""
+    if after is None:
+        return None
+    try:
+        timestamp, last_id = after
+        return datetime.fromisoformat(timestamp), int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Comparaison faible (RFC 9110) d'un en-tête If-None-Match avec notre ETag."""
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+def not_modified(request: Request, response: Response, key: str, version: Optional[models.DataVersion]):
+    """
+    Requête conditionnelle sur une liste : pose ETag / Last-Modified sur la réponse
+    et renvoie une réponse 304 si le client a déjà la version courante (None sinon).
+    À appeler avant de lire les lignes : c'est ce qui évite la requête et la sérialisation.
+    """
+    etag = utils.weak_etag(key, version.version if version else 0, request.url.query)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if version is not None:
+        headers["Last-Modified"] = format_datetime(version.updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, etag)
+    else:
+        # If-Modified-Since n'est consulté qu'en l'absence de If-None-Match
+        fresh = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and version is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).astimezone(timezone.utc).replace(tzinfo=None)
+                fresh = version.updated_at.replace(microsecond=0) <= since
+            except (TypeError, ValueError):
+                fresh = False
+    if fresh:
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,47 @@
+import numpy as np
+
+# SOUS-ÉCHANTILLONNAGE POUR LES GRAPHIQUES (LTTB)
+# Largest-Triangle-Three-Buckets (S. Steinarsson, 2013) : réduit une série à n points
+# en gardant sa forme visuelle (pics et creux), contrairement à une simple moyenne par tranche.
+# Les points sont répartis en n - 2 tranches ; dans chacune on garde le point qui forme
+# le plus grand triangle avec le point retenu précédemment et la moyenne de la tranche suivante.
+# Les calculs d'aire et les moyennes de tranches sont vectorisés avec numpy.
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices des points à conserver (au plus threshold, toujours le premier et le dernier).
+    x doit être croissant (ex: horodatages en secondes epoch).
+    """
+    n = len(x)
+    if threshold >= n or n <= 2:
+        return np.arange(n)
+    if threshold <= 2:
+        return np.array([0, n - 1])
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bornes des threshold - 2 tranches sur les points intérieurs [1, n - 1[ ;
+    # chaque tranche contient au moins un point puisque n - 2 >= threshold - 2
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    # Troisième sommet du triangle : moyenne de la tranche suivante (dernier point pour la dernière)
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Double de l'aire du triangle (a, point candidat, moyenne suivante), pour toute la tranche
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y[i] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
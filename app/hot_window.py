@@ -0,0 +1,426 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+import numpy as np
+from sqlalchemy import and_, event, func, or_, select
+from sqlalchemy.orm import Session
+from . import models, rollups
+
+# FENÊTRE CHAUDE EN MÉMOIRE (relevés récents)
+# Le tableau de bord ne demande presque que les derniers jours (filterPeriod : jour,
+# semaine, mois) de quelques zones. Chaque processus garde donc les relevés des
+# WINDOW_DAYS derniers jours, par (zone, type), dans deux tableaux numpy typés :
+# horodatages (datetime64[us], exacts à la microseconde comme en base) et valeurs (float64).
+# - remplissage : au démarrage (voir main.py), puis à la première lecture après un reset ;
+# - ajout : les relevés insérés par ce processus (crud) sont ajoutés au commit ; ceux des
+#   autres processus (scripts d'ingestion, autres workers) sont rattrapés par id croissant
+#   au plus toutes les SYNC_INTERVAL_SECONDS, comme pour le flux en direct (broker.py) ;
+# - réécriture : une modification, une suppression ou une compaction (rétention) incrémente
+#   REWRITE_VERSION_KEY et le compteur de chaque série touchée (rewrite_keys) : seules ces
+#   séries, ou tout un type après une compaction, sont relues au rattrapage suivant. La
+#   fenêtre n'est rechargée en entier que si aucun compteur de série n'a bougé.
+# crud.get_indicator_series et crud.get_indicator_aggregates répondent depuis la fenêtre
+# (opérations vectorisées, sans requête SQL) quand la période demandée y est entièrement
+# couverte ; sinon, ou sans borne de début, la lecture passe par la base comme avant.
+#
+# Chaque série est un tampon circulaire de MAX_POINTS_PER_SERIES relevés au plus : au-delà,
+# les plus anciens sont oubliés et la série ne couvre plus tout à fait la fenêtre.
+
+WINDOW_DAYS = float(os.getenv("ECOTRACK_HOT_WINDOW_DAYS", "31"))  # 0 : cache désactivé
+MAX_POINTS_PER_SERIES = int(os.getenv("ECOTRACK_HOT_WINDOW_POINTS", "50000"))
+SYNC_INTERVAL_SECONDS = 1.0
+FETCH_BATCH = 5000
+
+# Compteur de version incrémenté par toute écriture qui n'est pas un simple ajout, suivi
+# d'un compteur par série "indicators:rewrite:{zone_id}:{type}" ou par type ("*" pour la zone)
+REWRITE_VERSION_KEY = "indicators:rewrite"
+ALL_ZONES = "*"
+
+# Colonnes lues en base : (id, zone_id, type, timestamp, value, unit)
+COLUMNS = ("id", "zone_id", "type", "timestamp", "value", "unit")
+Inserted = namedtuple("Inserted", COLUMNS)
+
+
+def rewrite_keys(series: Iterable = (), types: Iterable[str] = ()) -> List[str]:
+    """Compteurs d'une réécriture des séries (zone_id, type) données, ou de types entiers."""
+    keys = {f"{REWRITE_VERSION_KEY}:{zone_id}:{type_}" for zone_id, type_ in series}
+    keys.update(f"{REWRITE_VERSION_KEY}:{ALL_ZONES}:{type_}" for type_ in types)
+    return [REWRITE_VERSION_KEY] + sorted(keys)
+
+
+def _rewrite_scope(key: str):
+    """(zone_id, type) d'un compteur de série ; zone_id vaut ALL_ZONES pour un type entier."""
+    zone, _, type_ = key[len(REWRITE_VERSION_KEY) + 1:].partition(":")
+    if zone == ALL_ZONES:
+        return ALL_ZONES, type_
+    return (None if zone == "None" else int(zone)), type_
+
+
+def _us(timestamp: datetime) -> np.datetime64:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(timestamp, "us")
+
+
+class RingSeries:
+    """
+    Relevés d'un (zone, type), triés par horodatage, MAX_POINTS_PER_SERIES au plus.
+    Les données vivantes sont [start, end[ d'un tableau qui grandit avec la série (par doublement,
+    sans dépasser la capacité) : elles restent contiguës (tranches numpy sans copie) et ne sont
+    recopiées en tête qu'une fois le bout du tableau atteint.
+    since : la série contient tous les relevés d'horodatage >= since.
+    """
+
+    INITIAL_SIZE = 64
+
+    def __init__(self, capacity: int, since: np.datetime64):
+        self.capacity = capacity
+        self.since = since
+        self.unit = None
+        self._timestamps = np.empty(0, dtype="datetime64[us]")
+        self._values = np.empty(0, dtype=np.float64)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[self.start:self.end]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[self.start:self.end]
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """Ajoute des relevés triés ; un lot antérieur au dernier relevé est réinséré à sa place."""
+        keep = timestamps >= self.since
+        timestamps, values = timestamps[keep], values[keep]
+        if not len(timestamps):
+            return
+        if len(self) and timestamps[0] < self._timestamps[self.end - 1]:
+            # Relevés en retard (rattrapage d'une source) : fusion triée, rare
+            merged_t = np.concatenate([self.timestamps, timestamps])
+            merged_v = np.concatenate([self.values, values])
+            order = np.argsort(merged_t, kind="stable")
+            self.start = self.end = 0
+            timestamps, values = merged_t[order], merged_v[order]
+        if len(timestamps) > self.capacity:
+            timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+            self.since = max(self.since, timestamps[0])
+        count = len(timestamps)
+        if self.end + count > len(self._timestamps):
+            # Bout du tableau atteint : agrandi si la capacité le permet, les relevés conservés
+            # (les plus récents) sont ramenés en tête
+            kept = min(len(self), self.capacity - count)
+            size = min(self.capacity, max(kept + count, 2 * len(self._timestamps), self.INITIAL_SIZE))
+            if size == len(self._timestamps):
+                new_timestamps, new_values = self._timestamps, self._values
+            else:
+                new_timestamps = np.empty(size, dtype="datetime64[us]")
+                new_values = np.empty(size, dtype=np.float64)
+            new_timestamps[:kept] = self._timestamps[self.end - kept:self.end]
+            new_values[:kept] = self._values[self.end - kept:self.end]
+            if kept < len(self):
+                self.since = max(self.since, new_timestamps[0] if kept else timestamps[0])
+            self._timestamps, self._values = new_timestamps, new_values
+            self.start, self.end = 0, kept
+        self._timestamps[self.end:self.end + count] = timestamps
+        self._values[self.end:self.end + count] = values
+        self.end += count
+
+    def evict_before(self, timestamp: np.datetime64):
+        """Oublie les relevés antérieurs à timestamp (fenêtre glissante)."""
+        self.start += int(np.searchsorted(self.timestamps, timestamp, side="left"))
+        self.since = max(self.since, timestamp)
+
+    def window(self, from_date: datetime, to_date: Optional[datetime]):
+        """Horodatages et valeurs de [from_date, to_date]."""
+        timestamps = self.timestamps
+        lo = np.searchsorted(timestamps, _us(from_date), side="left")
+        hi = len(timestamps) if to_date is None else \
+            np.searchsorted(timestamps, _us(to_date), side="right")
+        return timestamps[lo:hi], self.values[lo:hi]
+
+
+class HotWindowCache:
+    """Fenêtre récente des relevés, en mémoire du processus, par (zone, type)."""
+
+    def __init__(self, window_days: float = WINDOW_DAYS, capacity: int = MAX_POINTS_PER_SERIES,
+                 sync_interval: float = SYNC_INTERVAL_SECONDS):
+        self.window = timedelta(days=window_days)
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self.series = {}
+        self.loaded = False
+        self.window_start = None
+        self.boundaries = {}
+        self.last_id = 0
+        self.rewrite_version = None
+        self.series_versions = {}
+        self.synced_at = 0.0
+        # Relevés ajoutés au commit par ce processus, d'id > last_id (à ne pas rattraper deux
+        # fois) : id -> (zone, type)
+        self._applied_ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.series_reloads = 0
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > timedelta(0)
+
+    # --- Remplissage et synchronisation ---
+
+    def _rewrite_version(self, db: Session):
+        return db.scalar(select(models.DataVersion.version).where(models.DataVersion.key == REWRITE_VERSION_KEY))
+
+    def _series_versions(self, db: Session) -> dict:
+        return dict(db.execute(
+            select(models.DataVersion.key, models.DataVersion.version)
+            .where(models.DataVersion.key.startswith(REWRITE_VERSION_KEY + ":", autoescape=True))
+        ).all())
+
+    def load(self, db: Session, now: Optional[datetime] = None):
+        """(Re)charge toute la fenêtre depuis la base."""
+        with self._lock:
+            self.rewrite_version = self._rewrite_version(db)
+            self.series_versions = self._series_versions(db)
+            self.last_id = db.scalar(select(func.max(models.Indicator.id))) or 0
+            self.window_start = _us((now or datetime.utcnow()) - self.window)
+            self.boundaries = {type_: _us(boundary) for type_, boundary in rollups.compaction_boundaries(db).items()}
+            self.series = {}
+            self._applied_ids = {}
+            stmt = select(*(getattr(models.Indicator, column) for column in COLUMNS))\
+                .where(models.Indicator.timestamp >= self.window_start.astype(datetime),
+                       models.Indicator.id <= self.last_id)\
+                .order_by(models.Indicator.zone_id, models.Indicator.type, models.Indicator.timestamp)
+            rows = db.execute(stmt.execution_options(yield_per=FETCH_BATCH))
+            for partition in rows.partitions():
+                self._append(partition)
+            self.loaded = True
+            self.synced_at = time.monotonic()
+            self.reloads += 1
+
+    def sync(self, db: Session, now: Optional[datetime] = None):
+        """Rattrape les relevés écrits par d'autres processus ; relit les séries réécrites."""
+        with self._lock:
+            if not self.loaded:
+                self.load(db, now)
+                return
+            version = self._rewrite_version(db)
+            if version != self.rewrite_version:
+                versions = self._series_versions(db)
+                changed = [key for key, value in versions.items() if self.series_versions.get(key) != value]
+                if not changed:
+                    self.load(db, now)
+                    return
+                self._reload_series(db, [_rewrite_scope(key) for key in changed])
+                self.rewrite_version, self.series_versions = version, versions
+            while True:
+                stmt = select(*(getattr(models.Indicator, column) for column in COLUMNS))\
+                    .where(models.Indicator.id > self.last_id)\
+                    .order_by(models.Indicator.id).limit(FETCH_BATCH)
+                rows = db.execute(stmt).all()
+                if rows:
+                    self._append([row for row in rows if row.id not in self._applied_ids])
+                    self.last_id = rows[-1].id
+                    self._applied_ids = {id_: key for id_, key in self._applied_ids.items() if id_ > self.last_id}
+                if len(rows) < FETCH_BATCH:
+                    break
+            self.window_start = max(self.window_start, _us((now or datetime.utcnow()) - self.window))
+            for series in self.series.values():
+                series.evict_before(self.window_start)
+            self.synced_at = time.monotonic()
+
+    def _reload_series(self, db: Session, scopes):
+        """Relit depuis la base les séries (zone_id, type) réécrites, ou tous les types compactés."""
+        types = {type_ for zone_id, type_ in scopes if zone_id == ALL_ZONES}
+        pairs = {scope for scope in scopes if scope[0] != ALL_ZONES and scope[1] not in types}
+        if types:
+            self.boundaries = {type_: _us(boundary) for type_, boundary in rollups.compaction_boundaries(db).items()}
+
+        def rewritten(key):
+            return key[1] in types or key in pairs
+        for key in [key for key in self.series if rewritten(key)]:
+            del self.series[key]
+        indicator = models.Indicator
+        # Le dernier id supprimé est réattribué par SQLite : le rattrapage repart du maximum actuel
+        self.last_id = min(self.last_id, db.scalar(select(func.max(indicator.id))) or 0)
+        stmt = select(*(getattr(indicator, column) for column in COLUMNS))\
+            .where(indicator.timestamp >= self.window_start.astype(datetime),
+                   or_(indicator.type.in_(types),
+                       *(and_(indicator.zone_id == zone_id, indicator.type == type_) for zone_id, type_ in pairs)))\
+            .order_by(indicator.zone_id, indicator.type, indicator.timestamp)
+        rows = db.execute(stmt).all()
+        self._append(rows)
+        # Ids appliqués des séries relues : remplacés par ceux des relevés relus d'id > last_id
+        self._applied_ids = {id_: key for id_, key in self._applied_ids.items() if not rewritten(key)}
+        self._applied_ids.update((row.id, (row.zone_id, row.type)) for row in rows if row.id > self.last_id)
+        self.series_reloads += 1
+
+    def ensure_fresh(self, db: Session):
+        if not self.loaded or time.monotonic() - self.synced_at >= self.sync_interval:
+            self.sync(db)
+
+    def _append(self, rows: Iterable):
+        """Ajoute des lignes (COLUMNS), regroupées par (zone, type) et triées par horodatage."""
+        groups = {}
+        for row in rows:
+            if row.timestamp is None:
+                continue
+            groups.setdefault((row.zone_id, row.type), []).append(row)
+        for key, group in groups.items():
+            group.sort(key=lambda row: row.timestamp)
+            series = self.series.get(key)
+            if series is None:
+                since = max(self.window_start, self.boundaries.get(key[1], self.window_start))
+                series = self.series[key] = RingSeries(self.capacity, since)
+            series.extend(
+                np.array([row.timestamp for row in group], dtype="datetime64[us]"),
+                np.fromiter((row.value for row in group), dtype=np.float64, count=len(group))
+            )
+            series.unit = group[-1].unit
+
+    def committed(self, rows: List):
+        """Relevés insérés et validés par ce processus : ajoutés sans relire la base."""
+        with self._lock:
+            if not self.loaded:
+                return
+            rows = [row for row in rows if row.id > self.last_id and row.id not in self._applied_ids]
+            self._applied_ids.update((row.id, (row.zone_id, row.type)) for row in rows)
+            self._append(rows)
+
+    def expire(self):
+        """Rattrapage (et relecture des séries réécrites) dès la prochaine lecture."""
+        with self._lock:
+            self.synced_at = float("-inf")
+
+    def reset(self):
+        with self._lock:
+            self.loaded = False
+            self.series = {}
+
+    # --- Lectures ---
+
+    def _covers(self, keys, types: Optional[Iterable[str]], from_date: Optional[datetime]) -> bool:
+        """Vrai si la fenêtre contient tous les relevés des séries demandées depuis from_date."""
+        if from_date is None or not self.loaded:
+            return False
+        start = _us(from_date)
+        if start < self.window_start:
+            return False
+        if any(start < boundary for type_, boundary in self.boundaries.items() if types is None or type_ in types):
+            return False
+        return all(self.series[key].since <= start for key in keys)
+
+    def _keys(self, zone_ids: Optional[Iterable[int]], types: Optional[Iterable[str]]):
+        return sorted(
+            key for key in self.series
+            if (not zone_ids or key[0] in zone_ids) and (not types or key[1] in types)
+        )
+
+    def get_series(self, db: Session, zone_id: int, type: str, from_date: Optional[datetime],
+                   to_date: Optional[datetime]):
+        """(horodatages, valeurs, unité) d'une série sur la période, ou None si hors fenêtre."""
+        if not self.enabled:
+            return None
+        self.ensure_fresh(db)
+        with self._lock:
+            key = (zone_id, type)
+            if not self._covers([key] if key in self.series else [], [type], from_date):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key not in self.series:
+                return np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=np.float64), None
+            timestamps, values = self.series[key].window(from_date, to_date)
+            return timestamps.copy(), values.copy(), self.series[key].unit
+
+    def get_aggregates(self, db: Session, width: int, zone_ids: Optional[List[int]], types: Optional[List[str]],
+                       from_date: Optional[datetime], to_date: Optional[datetime]):
+        """
+        [(zone_id, type, début de tranche en secondes epoch, nombre, min, max, moyenne)] triés,
+        ou None si la période sort de la fenêtre. Tranches calculées par np.*.reduceat.
+        """
+        if not self.enabled:
+            return None
+        self.ensure_fresh(db)
+        with self._lock:
+            keys = self._keys(zone_ids, types)
+            if not self._covers(keys, types, from_date):
+                self.misses += 1
+                return None
+            self.hits += 1
+            width_us = width * 1_000_000
+            result = []
+            for zone_id, type_ in keys:
+                timestamps, values = self.series[(zone_id, type_)].window(from_date, to_date)
+                if not len(timestamps):
+                    continue
+                buckets = timestamps.astype(np.int64) // width_us
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+                counts = np.diff(np.append(starts, len(values)))
+                sums = np.add.reduceat(values, starts)
+                result.extend(zip(
+                    [zone_id] * len(starts), [type_] * len(starts),
+                    (buckets[starts] * width).tolist(), counts.tolist(),
+                    np.minimum.reduceat(values, starts).tolist(),
+                    np.maximum.reduceat(values, starts).tolist(),
+                    (sums / counts).tolist()
+                ))
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "series": len(self.series),
+                "points": sum(len(series) for series in self.series.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "series_reloads": self.series_reloads,
+            }
+
+
+# Instance partagée par tout le processus
+cache = HotWindowCache()
+
+
+def remember_inserted(db: Session, rows: Iterable):
+    """Retient (jusqu'au commit) les relevés insérés dans la session : lignes COLUMNS ou objets Indicator."""
+    db.info.setdefault("hot_window_rows", []).extend(
+        Inserted(*(getattr(row, column) for column in COLUMNS)) for row in rows
+    )
+
+
+def remember_rewrite(db: Session):
+    """
+    Écriture qui n'est pas un simple ajout (modification, suppression, compaction) : séries
+    touchées relues dès la lecture suivante dans ce processus, au rattrapage suivant dans les
+    autres, d'après les compteurs rewrite_keys (à incrémenter dans la même transaction, voir
+    crud.indicator_version_keys).
+    """
+    db.info["hot_window_rewrite"] = True
+
+
+# Au commit : ajout des relevés insérés par ce processus, ou rattrapage forcé après une réécriture
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    rows = session.info.pop("hot_window_rows", [])
+    if session.info.pop("hot_window_rewrite", False):
+        cache.expire()
+    elif rows:
+        cache.committed(rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("hot_window_rows", None)
+    session.info.pop("hot_window_rewrite", None)
@@ -1,12 +1,52 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from . import models, database
+from fastapi.concurrency import run_in_threadpool
+from . import models, crud, database, rollups, metrics, sql_instrumentation, profiling, hot_window
 # Ajout de users et zones dans les imports
 from .routers import auth, indicators, dashboard, users, zones 
+from .routers import metrics as metrics_router, profiles
 
 # Création des tables dans la BDD au démarrage
 models.Base.metadata.create_all(bind=database.engine)
 
-app = FastAPI(title="EcoTrack API")
+def _backfill_rollups():
+    # Base antérieure aux agrégats : statistiques et agrégations resteraient vides
+    db = database.SessionLocal()
+    try:
+        rollups.backfill_if_empty(db)
+    finally:
+        db.close()
+
+# Avant les index : le dédoublonnage recalcule quelques tranches, la table ne serait plus vide
+_backfill_rollups()
+# Index ajoutés depuis la création d'une base existante (idempotent)
+crud.ensure_indicator_indexes(database.engine)
+
+def _fill_hot_window():
+    db = database.SessionLocal()
+    try:
+        hot_window.cache.load(db)
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fenêtre chaude des relevés récents remplie au démarrage (voir app/hot_window.py)
+    if hot_window.cache.enabled:
+        await run_in_threadpool(_fill_hot_window)
+    yield
+
+app = FastAPI(title="EcoTrack API", lifespan=lifespan)
+
+# Métriques (GET /metrics) : latences par route et compteurs SQL des deux moteurs
+app.add_middleware(metrics.MetricsMiddleware)
+# Journal des requêtes lentes et détecteur N+1 (logger "ecotrack.sql")
+app.add_middleware(sql_instrumentation.SQLInstrumentationMiddleware)
+for name, engine in metrics_router.ENGINES.items():
+    metrics.instrument_engine(engine, name)
+    sql_instrumentation.instrument_engine(engine)
+# Profilage à la demande (X-Profile: 1, administrateurs), profils sur GET /profiles/
+app.add_middleware(profiling.ProfilingMiddleware)
 
 # Inclusion des routeurs
 app.include_router(auth.router)
@@ -14,6 +54,8 @@ app.include_router(users.router)       # <-- Nouveau routeur
 app.include_router(zones.router)       # <-- Nouveau routeur
 app.include_router(indicators.router)
 app.include_router(dashboard.router)
+app.include_router(metrics_router.router)
+app.include_router(profiles.router)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,260 @@
+import contextvars
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+from sqlalchemy import event
+
+# MÉTRIQUES (format texte Prometheus, exposé sur GET /metrics)
+# - HTTP : requêtes, latences et tailles de réponse par route (gabarit de chemin,
+#   ex: /indicators/{indicator_id}), requêtes en cours ;
+# - base : requêtes SQL (nombre, durée, nombre par requête HTTP), emprunts au pool
+#   de connexions et temps d'attente, via les événements SQLAlchemy ;
+# - état du pool, ingestion (table ingestion_watermarks, alimentée par ingest_data.py et
+#   ingest_scheduler.py), cache d'authentification et diffusion : lus au moment de la
+#   collecte (routers/metrics.py).
+# Registre minimal en mémoire, propre au processus (un par worker uvicorn).
+
+# Bornes des histogrammes (secondes / octets)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Compteur ou jauge, éventuellement étiqueté (labels)."""
+
+    def __init__(self, name: str, help: str, kind: str = "counter", labels: Iterable[str] = ()):
+        self.name, self.help, self.kind = name, help, kind
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Histogramme à bornes fixes (buckets cumulés, somme et nombre d'observations)."""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], labels: Iterable[str] = ()):
+        super().__init__(name, help, kind="histogram", labels=labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def count(self, *labels) -> int:
+        state = self._values.get(labels)
+        return state["count"] if state else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, dict(state, counts=list(state["counts"]))) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = _format_labels(self.labels, labels, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            le = _format_labels(self.labels, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {state['count']}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {state['sum']!r}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {state['count']}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, extra: Iterable[Metric] = ()) -> str:
+        lines = [line for metric in list(self.metrics) + list(extra) for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- HTTP ---
+http_requests = registry.register(Metric(
+    "ecotrack_http_requests_total", "Requêtes HTTP traitées", labels=("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "ecotrack_http_request_duration_seconds", "Durée de traitement des requêtes HTTP",
+    LATENCY_BUCKETS, labels=("method", "route")))
+http_response_size = registry.register(Histogram(
+    "ecotrack_http_response_size_bytes", "Taille du corps des réponses HTTP",
+    SIZE_BUCKETS, labels=("method", "route")))
+http_in_flight = registry.register(Metric(
+    "ecotrack_http_requests_in_flight", "Requêtes HTTP en cours de traitement", kind="gauge"))
+
+# --- Base de données ---
+db_queries = registry.register(Metric(
+    "ecotrack_db_queries_total", "Requêtes SQL exécutées", labels=("engine",)))
+db_query_latency = registry.register(Histogram(
+    "ecotrack_db_query_duration_seconds", "Durée des requêtes SQL", QUERY_BUCKETS, labels=("engine",)))
+db_queries_per_request = registry.register(Histogram(
+    "ecotrack_db_queries_per_request", "Requêtes SQL par requête HTTP", COUNT_BUCKETS, labels=("route",)))
+db_checkouts = registry.register(Metric(
+    "ecotrack_db_pool_checkouts_total", "Connexions empruntées au pool", labels=("engine",)))
+db_checkout_wait = registry.register(Histogram(
+    "ecotrack_db_pool_checkout_wait_seconds",
+    "Attente pour obtenir une connexion du pool (hors ouverture d'une nouvelle connexion)",
+    LATENCY_BUCKETS, labels=("engine",)))
+db_checked_out = registry.register(Metric(
+    "ecotrack_db_pool_checked_out", "Connexions actuellement empruntées", kind="gauge", labels=("engine",)))
+db_connect_latency = registry.register(Histogram(
+    "ecotrack_db_connect_duration_seconds", "Ouverture d'une nouvelle connexion à la base",
+    LATENCY_BUCKETS, labels=("engine",)))
+
+# Compteur de requêtes SQL de la requête HTTP en cours (None hors requête HTTP)
+_request_queries = contextvars.ContextVar("ecotrack_request_queries", default=None)
+# Temps d'ouverture de connexion pendant l'emprunt en cours (déduit de l'attente)
+_connect_time = contextvars.ContextVar("ecotrack_connect_time", default=None)
+
+
+def instrument_engine(engine, name: str):
+    """
+    Branche les compteurs SQL et pool sur un moteur (synchrone, ou async_engine.sync_engine).
+    Connexions empruntées et ouvertures : événements du pool (checkout / checkin, do_connect / connect),
+    conservés par SQLAlchemy quand le pool est recréé (engine.dispose()).
+    Le pool n'a pas d'événement avant l'emprunt : l'attente est chronométrée autour de
+    engine.raw_connection() (le moteur, lui, survit à dispose()), moins l'ouverture d'une connexion neuve.
+    """
+    # Début de requête porté par le contexte d'exécution : rien ne reste sur la connexion
+    # quand l'instruction échoue (after_cursor_execute n'est alors pas appelé)
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.ecotrack_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = context.ecotrack_query_start
+        db_queries.inc(1, name)
+        db_query_latency.observe(time.perf_counter() - started, name)
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        db_checkouts.inc(1, name)
+        db_checked_out.inc(1, name)
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        db_checked_out.inc(-1, name)
+
+    @event.listens_for(engine, "do_connect")
+    def do_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info["ecotrack_connect_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        started = connection_record.info.pop("ecotrack_connect_start", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_connect_latency.observe(elapsed, name)
+        spent = _connect_time.get()
+        if spent is not None:
+            spent[0] += elapsed
+
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        spent = [0.0]
+        token = _connect_time.set(spent)
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            db_checkout_wait.observe(max(0.0, time.perf_counter() - started - spent[0]), name)
+            _connect_time.reset(token)
+
+    engine.raw_connection = timed_raw_connection
+    return engine
+
+
+def _route_label(scope) -> str:
+    # Gabarit de la route (faible cardinalité) ; les chemins inconnus sont regroupés
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI : durée, statut, taille de réponse et requêtes SQL de chaque requête HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500, "size": 0}
+        queries = [0]
+        token = _request_queries.set(queries)
+        http_in_flight.inc(1)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                status["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.inc(-1)
+            _request_queries.reset(token)
+            method, route = scope["method"], _route_label(scope)
+            http_requests.inc(1, method, route, str(status["code"]))
+            http_latency.observe(time.perf_counter() - started, method, route)
+            http_response_size.observe(status["size"], method, route)
+            db_queries_per_request.observe(queries[0], route)
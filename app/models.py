@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -19,6 +19,10 @@ class Zone(Base):
     name = Column(String, unique=True, index=True)
     postal_code = Column(String, index=True)
     country = Column(String, default="France")
+    # Coordonnées (source météo) et région administrative (source énergie)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    region = Column(String, nullable=True)  # ex: "Île-de-France"
 
     # Une zone a plusieurs indicateurs
     indicators = relationship("Indicator", back_populates="zone")
@@ -34,4 +38,90 @@ class Indicator(Base):
     
     # Lien vers la zone
     zone_id = Column(Integer, ForeignKey("zones.id"))
-    zone = relationship("Zone", back_populates="indicators")
\ No newline at end of file
+    zone = relationship("Zone", back_populates="indicators")
+
+    __table_args__ = (
+        # Un seul relevé par (zone, type, horodatage).
+        # L'index unique sert aussi d'index composite pour les filtres et le dédoublonnage.
+        Index("ix_indicators_zone_type_timestamp", "zone_id", "type", "timestamp", unique=True),
+        # Tri et pagination par curseur sur (timestamp, id)
+        Index("ix_indicators_timestamp_id", "timestamp", "id"),
+    )
+
+class IngestionWatermark(Base):
+    """Dernier horodatage ingéré par (zone, source, type), bilan de la dernière exécution et cumuls."""
+    __tablename__ = "ingestion_watermarks"
+
+    zone_id = Column(Integer, ForeignKey("zones.id"), primary_key=True)
+    source = Column(String, primary_key=True)   # ex: "open-meteo", "odre"
+    type = Column(String, primary_key=True)     # ex: "temperature"
+    high_water_mark = Column(DateTime, nullable=True)
+
+    last_run_at = Column(DateTime, nullable=True)
+    last_duration_ms = Column(Float, default=0.0)
+    last_rows_fetched = Column(Integer, default=0)
+    last_rows_inserted = Column(Integer, default=0)
+
+    # Cumuls depuis la création de la ligne (exposés par GET /metrics)
+    runs_total = Column(Integer, default=0)
+    rows_fetched_total = Column(Integer, default=0)
+    rows_inserted_total = Column(Integer, default=0)
+    failures_total = Column(Integer, default=0)
+
+
+class DataVersion(Base):
+    """
+    Compteur de version d'un jeu de données ("zones", "indicators", "indicators:zone:<id>"),
+    incrémenté à chaque écriture. Sert à produire les ETag des listes sans relire les lignes.
+    """
+    __tablename__ = "data_versions"
+
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class RollupMixin:
+    """Agrégats incrémentaux d'une tranche de temps pour un couple (zone, type)."""
+    zone_id = Column(Integer, primary_key=True)
+    type = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)  # début de la tranche (UTC)
+    unit = Column(String)
+
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Float, nullable=False, default=0.0)
+    sum_sq = Column(Float, nullable=False, default=0.0)  # somme des carrés (écart-type)
+    min = Column(Float)
+    max = Column(Float)
+
+class IndicatorRollupHourly(RollupMixin, Base):
+    __tablename__ = "indicator_rollups_hourly"
+
+class IndicatorRollupDaily(RollupMixin, Base):
+    __tablename__ = "indicator_rollups_daily"
+
+class RetentionPolicy(Base):
+    """
+    Rétention des relevés bruts d'un type : raw_days jours, puis seuls les agrégats
+    (horaires, journaliers) sont conservés. compacted_before : borne sous laquelle les
+    relevés bruts ont été supprimés (NULL tant que rien n'a été compacté).
+    """
+    __tablename__ = "retention_policies"
+
+    type = Column(String, primary_key=True)
+    raw_days = Column(Integer, nullable=False)
+    compacted_before = Column(DateTime, nullable=True)
+
+class IndicatorLatest(Base):
+    """
+    Dernier relevé connu de chaque (zone, type), tenu à jour avec les agrégats
+    (rollups.apply) : GET /zones/latest le lit sans parcourir l'historique.
+    """
+    __tablename__ = "indicator_latest"
+
+    zone_id = Column(Integer, primary_key=True)
+    type = Column(String, primary_key=True)
+    indicator_id = Column(Integer)
+    value = Column(Float)
+    unit = Column(String)
+    timestamp = Column(DateTime)
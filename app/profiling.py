@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from . import database, deps, sql_instrumentation
+
+# PROFILAGE À LA DEMANDE (administrateurs)
+# Une requête portant l'en-tête "X-Profile: 1" (ou le paramètre ?profile=1) et le token
+# d'un administrateur est exécutée sous un profileur par échantillonnage :
+# - toutes les SAMPLE_INTERVAL_SECONDS, la pile des threads qui servent cette requête est
+#   relevée (sys._current_frames) et pondérée par le temps écoulé ;
+# - le profil est conservé en mémoire (MAX_STORED_PROFILES derniers) et consultable sur
+#   GET /profiles/{id}, au format "folded stacks" (flamegraph.pl, speedscope) ou JSON ;
+# - la réponse porte X-Profile-Id et un en-tête Server-Timing : SQL (mesure exacte, événements
+#   SQLAlchemy), Pydantic et encodage JSON (estimés d'après les échantillons), total.
+# Seuls deux cas sont retenus, pour que les requêtes simultanées n'apparaissent pas dans le profil :
+# - le thread de la boucle d'événements, quand la tâche en cours est celle de la requête ;
+# - un thread du pool (routes et dépendances synchrones) qui exécute un contexte (contextvars)
+#   copié depuis la requête, repéré par la variable _profiled.
+# Le thread aiosqlite, partagé par toutes les requêtes async, n'est pas échantillonné : le temps
+# SQL vient des événements SQLAlchemy.
+
+SAMPLE_INTERVAL_SECONDS = 0.001
+MAX_STACK_DEPTH = 128
+MAX_STORED_PROFILES = 20
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY = "profile"
+
+# Catégories du détail, reconnues sur le module de la frame la plus profonde qui correspond
+CATEGORIES = (
+    ("sql", ("sqlalchemy", "sqlite3", "aiosqlite", "psycopg", "asyncpg")),
+    ("pydantic", ("pydantic", "pydantic_core", "fastapi.encoders")),
+    ("json", ("json", "orjson", "app.utils:json_bytes", "starlette.responses:JSONResponse.render")),
+)
+# Frames les plus externes d'un thread du pool où chercher le contexte copié (context.run)
+CONTEXT_SEARCH_DEPTH = 8
+
+# Profil de la requête en cours, propagé aux threads du pool avec le contexte
+_profiled = contextvars.ContextVar("ecotrack_profiled", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _category(stack) -> str:
+    for label in reversed(stack):
+        for category, prefixes in CATEGORIES:
+            if any(label == p or label.startswith(p + ".") or label.startswith(p + ":") for p in prefixes):
+                return category
+    return "other"
+
+
+class Profile:
+    """Piles échantillonnées d'une requête (temps en secondes par pile) et mesures associées."""
+
+    def __init__(self, method: str, path: str, query: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method, self.path, self.query = method, path, query
+        self.created_at = time.time()
+        self.stacks = Counter()
+        self.samples = 0
+        self.total_ms = 0.0
+        self.sql_ms = 0.0
+        self.sql_queries = 0
+        self.status: Optional[int] = None
+
+    def breakdown(self) -> dict:
+        sampled = Counter()
+        for stack, seconds in self.stacks.items():
+            sampled[_category(stack)] += seconds * 1000
+        return {
+            "total_ms": round(self.total_ms, 3),
+            "sql_ms": round(self.sql_ms, 3),
+            "sql_queries": self.sql_queries,
+            "pydantic_ms": round(sampled["pydantic"], 3),
+            "json_ms": round(sampled["json"], 3),
+            "other_ms": round(sampled["other"], 3),
+            "samples": self.samples,
+        }
+
+    def server_timing(self) -> str:
+        b = self.breakdown()
+        return (f'total;dur={b["total_ms"]}, sql;dur={b["sql_ms"]};desc="{b["sql_queries"]} queries", '
+                f'pydantic;dur={b["pydantic_ms"]}, json;dur={b["json_ms"]}')
+
+    def folded(self) -> str:
+        """Une ligne par pile : "frame;frame;frame poids" (poids en microsecondes)."""
+        return "".join(
+            f"{';'.join(stack)} {max(1, round(seconds * 1_000_000))}\n"
+            for stack, seconds in self.stacks.most_common()
+        )
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id, "method": self.method, "path": self.path, "query": self.query,
+            "status": self.status, "created_at": self.created_at, **self.breakdown(),
+        }
+
+
+def _runs_context(frames, profile: Profile) -> bool:
+    """Vrai si l'une des frames externes détient un contexte copié depuis la requête profilée."""
+    for frame in reversed(frames[-CONTEXT_SEARCH_DEPTH:]):
+        for value in frame.f_locals.values():
+            if isinstance(value, contextvars.Context) and value.get(_profiled) is profile:
+                return True
+    return False
+
+
+class Sampler:
+    """Thread qui relève périodiquement la pile des threads servant la requête dans un Profile."""
+
+    def __init__(self, profile: Profile, task: asyncio.Task, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.profile = profile
+        self.task = task
+        self.loop = task.get_loop()
+        self.loop_thread = threading.get_ident()
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ecotrack-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id == self.loop_thread and asyncio.current_task(self.loop) is not self.task:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame)
+                    frame = frame.f_back
+                if thread_id != self.loop_thread and not _runs_context(frames, self.profile):
+                    continue
+                stack = [_frame_label(f) for f in frames[:MAX_STACK_DEPTH]]
+                self.profile.stacks[tuple(reversed(stack))] += weight
+                self.profile.samples += 1
+
+
+class ProfileStore:
+    """Derniers profils, en mémoire du processus (les plus anciens sont oubliés)."""
+
+    def __init__(self, max_profiles: int = MAX_STORED_PROFILES):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._profiles.values()))
+
+
+# Instance partagée par tout le processus
+store = ProfileStore()
+
+
+def _requested(scope) -> bool:
+    headers = dict(scope.get("headers") or [])
+    if headers.get(PROFILE_HEADER.encode(), b"").strip() in (b"1", b"true"):
+        return True
+    query = scope.get("query_string", b"").decode("latin-1")
+    return any(part in (f"{PROFILE_QUERY}=1", f"{PROFILE_QUERY}=true") for part in query.split("&"))
+
+
+async def _check_admin(scope):
+    """
+    Applique deps.get_current_user_async puis deps.get_admin_user au token de la requête :
+    cache d'authentification d'abord, sinon session async (aucune E/S bloquante dans la boucle).
+    La session passe par app.dependency_overrides, comme pour une route (tests compris).
+    """
+    authorization = dict(scope.get("headers") or []).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise deps._credentials_exception()
+    app = scope.get("app")
+    overrides = getattr(app, "dependency_overrides", {})
+    sessions = overrides.get(database.get_async_db, database.get_async_db)()
+    db = await sessions.__anext__()
+    try:
+        user = await deps.get_current_user_async(token=token, db=db)
+        return await deps.get_admin_user(current_user=user)
+    finally:
+        await sessions.aclose()
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI : profile les requêtes marquées X-Profile / ?profile=1 (administrateurs seulement)."""
+
+    def __init__(self, app, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await _check_admin(scope)
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        sampler = Sampler(profile, asyncio.current_task(), self.interval)
+        pending_start = None
+        finished = False
+        started = time.perf_counter()
+
+        def finish(log):
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            sampler.stop()
+            profile.total_ms = (time.perf_counter() - started) * 1000
+            profile.sql_ms, profile.sql_queries = log.total_ms, log.count
+            store.add(profile)
+
+        with sql_instrumentation.track_queries() as log:
+            async def send_wrapper(message):
+                nonlocal pending_start
+                if message["type"] == "http.response.start":
+                    # En-têtes retenus jusqu'au dernier fragment du corps, pour y joindre Server-Timing
+                    profile.status = message["status"]
+                    pending_start = message
+                    return
+                if message["type"] == "http.response.body" and pending_start is not None:
+                    headers = list(pending_start.get("headers", []))
+                    headers.append((b"x-profile-id", profile.id.encode()))
+                    if not message.get("more_body", False):
+                        finish(log)
+                        headers.append((b"server-timing", profile.server_timing().encode()))
+                    await send({**pending_start, "headers": headers})
+                    pending_start = None
+                await send(message)
+
+            marker = _profiled.set(profile)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finish(log)
+                _profiled.reset(marker)
@@ -0,0 +1,130 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from . import models, database, crud, rollups, hot_window
+
+# RÉTENTION DES RELEVÉS BRUTS
+# Politique par type (table retention_policies) : les relevés bruts de plus de raw_days jours
+# sont supprimés, seuls les agrégats horaires et journaliers (maintenus à chaque insertion,
+# voir rollups.py) sont conservés. La compaction :
+# 1. vérifie que les agrégats couvrent les relevés bruts à supprimer (sinon les recalcule),
+#    avance la borne compacted_before du type (début de jour UTC) et la valide : dès ce moment
+#    les lectures utilisent les agrégats horaires avant la borne (crud : séries, agrégations,
+#    statistiques) et les relevés bruts après ;
+# 2. supprime les relevés bruts antérieurs par lots de BATCH_SIZE, une transaction courte
+#    par lot, avec une pause entre les lots pour laisser passer les écritures (SQLite).
+#
+#   python -m app.retention set temperature 90     (90 jours de relevés bruts)
+#   python -m app.retention run                    (à lancer périodiquement, ex: cron)
+#   python -m app.retention show
+
+BATCH_SIZE = 5000
+BATCH_PAUSE_SECONDS = 0.05
+
+DAY_SECONDS = 86400
+
+
+def set_policy(db: Session, type: str, raw_days: int):
+    """Crée ou modifie la politique d'un type. Valide la transaction."""
+    if raw_days < 1:
+        raise ValueError("raw_days doit être au moins 1")
+    policy = db.get(models.RetentionPolicy, type)
+    if policy is None:
+        policy = models.RetentionPolicy(type=type, raw_days=raw_days)
+        db.add(policy)
+    policy.raw_days = raw_days
+    db.commit()
+    return policy
+
+
+def get_policies(db: Session):
+    return db.query(models.RetentionPolicy).order_by(models.RetentionPolicy.type).all()
+
+
+def cutoff(raw_days: int, now: Optional[datetime] = None) -> datetime:
+    """Borne de compaction : début du jour (UTC) situé raw_days jours avant now."""
+    return rollups.truncate((now or datetime.utcnow()) - timedelta(days=raw_days), DAY_SECONDS)
+
+
+def compact(db: Session, type: str, now: Optional[datetime] = None,
+            batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE_SECONDS):
+    """Applique la politique d'un type ; renvoie le nombre de relevés bruts supprimés."""
+    policy = db.get(models.RetentionPolicy, type)
+    if policy is None:
+        return 0
+    boundary = cutoff(policy.raw_days, now)
+    # La borne n'avance jamais à reculons (un raw_days allongé ne ressuscite pas les relevés)
+    if policy.compacted_before is None or boundary > policy.compacted_before:
+        # Les agrégats doivent couvrir les relevés à supprimer (import direct, base antérieure
+        # aux agrégats) : sinon ils sont recalculés avant que la borne ne soit validée
+        rollups.cover_range(db, type, policy.compacted_before, boundary)
+        policy.compacted_before = boundary
+        # Les lectures changent de source avant la borne : séries du type à relire (fenêtres chaudes)
+        crud.bump_versions(db, hot_window.rewrite_keys(types=[type]))
+        hot_window.remember_rewrite(db)
+    boundary = policy.compacted_before
+    db.commit()
+
+    deleted = 0
+    indicator = models.Indicator
+    while True:
+        batch = db.execute(
+            select(indicator.id, indicator.zone_id)
+            .where(indicator.type == type, indicator.timestamp < boundary)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        db.execute(delete(indicator).where(indicator.id.in_([row.id for row in batch])))
+        crud.bump_versions(db, crud.indicator_version_keys(row.zone_id for row in batch))
+        db.commit()
+        deleted += len(batch)
+        if len(batch) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+
+def run(db: Session, now: Optional[datetime] = None, batch_size: int = BATCH_SIZE,
+        pause: float = BATCH_PAUSE_SECONDS):
+    """Compacte tous les types ayant une politique : {type: relevés supprimés}."""
+    return {
+        policy.type: compact(db, policy.type, now, batch_size, pause)
+        for policy in get_policies(db)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rétention des relevés bruts (compaction en agrégats)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    set_parser = commands.add_parser("set", help="Définit la durée de conservation des relevés bruts d'un type")
+    set_parser.add_argument("type")
+    set_parser.add_argument("raw_days", type=int)
+    run_parser = commands.add_parser("run", help="Supprime les relevés bruts au-delà de la durée de conservation")
+    run_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    run_parser.add_argument("--pause", type=float, default=BATCH_PAUSE_SECONDS,
+                            help="Secondes de pause entre deux lots")
+    commands.add_parser("show", help="Affiche les politiques et leurs bornes de compaction")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        if args.command == "set":
+            policy = set_policy(db, args.type, args.raw_days)
+            print(f"{policy.type} : relevés bruts conservés {policy.raw_days} jours.")
+        elif args.command == "run":
+            for type_, deleted in run(db, batch_size=args.batch_size, pause=args.pause).items():
+                print(f"{type_} : {deleted} relevés bruts compactés.")
+        else:
+            for policy in get_policies(db):
+                print(f"{policy.type} : {policy.raw_days} jours, compacté avant {policy.compacted_before or '-'}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
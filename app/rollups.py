@@ -0,0 +1,348 @@
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+from sqlalchemy import and_, false, func, cast, or_, true, Integer
+from sqlalchemy.orm import Session
+from . import models, database
+
+# AGRÉGATS PAR TRANCHE (ROLLUPS)
+# Pour chaque (zone, type) et chaque heure / jour, on maintient nombre, somme,
+# somme des carrés, min et max des relevés. Ces tables sont mises à jour dans la
+# même transaction que les insertions (crud.create_indicator, bulk_insert_indicators),
+# ce qui permet aux statistiques et agrégations de ne plus parcourir l'historique brut.
+# La table indicator_latest (dernier relevé de chaque zone et type, GET /zones/latest)
+# est tenue à jour par les mêmes fonctions.
+#
+# Reconstruction complète (après un import direct en base, par exemple) :
+#   python -m app.rollups rebuild
+# Une base antérieure aux agrégats (tables vides, relevés présents) est reconstruite
+# automatiquement au démarrage de l'API (backfill_if_empty).
+#
+# Après compaction (app/retention.py), les tranches antérieures à la borne compacted_before
+# d'un type n'ont plus de relevés bruts : elles ne sont plus jamais recalculées ni supprimées,
+# et les lectures y utilisent les agrégats horaires (voir raw_condition / compacted_condition).
+
+EPOCH = datetime(1970, 1, 1)
+
+logger = logging.getLogger("ecotrack.rollups")
+
+# Granularité -> (table, largeur de tranche en secondes)
+GRANULARITIES = {
+    "hour": (models.IndicatorRollupHourly, 3600),
+    "day": (models.IndicatorRollupDaily, 86400),
+}
+
+
+def epoch_bucket(db: Session, width: int, column=None):
+    """Début de tranche (en secondes epoch) d'un horodatage, selon le dialecte SQL."""
+    column = models.Indicator.timestamp if column is None else column
+    if db.bind.dialect.name == "postgresql":
+        epoch = func.extract("epoch", column)
+        return cast(func.floor(epoch / width) * width, Integer)
+    # SQLite : strftime('%s') renvoie le timestamp epoch sous forme de texte
+    epoch = cast(func.strftime("%s", column), Integer)
+    return (epoch // width) * width
+
+
+def from_epoch(seconds) -> datetime:
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def naive_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Ramène un horodatage avec fuseau en UTC naïf (convention de la base)."""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def truncate(timestamp: datetime, width: int) -> datetime:
+    """Début de la tranche de largeur width (secondes) contenant timestamp."""
+    seconds = int((naive_utc(timestamp) - EPOCH).total_seconds())
+    return from_epoch(seconds - seconds % width)
+
+
+def is_aligned(timestamp: Optional[datetime], width: int) -> bool:
+    """Vrai si la borne est absente ou tombe exactement sur un début de tranche."""
+    return timestamp is None or truncate(timestamp, width) == naive_utc(timestamp)
+
+
+def covering_rollup(from_date: Optional[datetime], to_date: Optional[datetime]):
+    """
+    Table d'agrégats la plus grossière dont les tranches couvrent exactement [from_date, to_date[,
+    ou None si les bornes ne tombent pas sur des débuts d'heure.
+    """
+    for model, width in sorted(GRANULARITIES.values(), key=lambda entry: -entry[1]):
+        if is_aligned(from_date, width) and is_aligned(to_date, width):
+            return model
+    return None
+
+
+def compaction_boundaries(db: Session, types: Optional[Iterable[str]] = None) -> dict:
+    """Borne de compaction de chaque type compacté : {type: compacted_before}."""
+    policy = models.RetentionPolicy
+    query = db.query(policy.type, policy.compacted_before).filter(policy.compacted_before.isnot(None))
+    if types:
+        query = query.filter(policy.type.in_(list(types)))
+    return dict(query.all())
+
+
+def raw_condition(boundaries: dict, type_column, time_column):
+    """Lignes postérieures à la compaction de leur type (tout est vrai sans compaction)."""
+    if not boundaries:
+        return true()
+    return and_(*(or_(type_column != type_, time_column >= boundary) for type_, boundary in boundaries.items()))
+
+
+def compacted_condition(boundaries: dict, type_column, time_column):
+    """Lignes antérieures à la compaction de leur type (rien sans compaction)."""
+    if not boundaries:
+        return false()
+    return or_(*(and_(type_column == type_, time_column < boundary) for type_, boundary in boundaries.items()))
+
+
+def _upsert(db: Session, model, partials: list):
+    """Ajoute des agrégats partiels aux tranches existantes (INSERT ... ON CONFLICT DO UPDATE)."""
+    table = model.__table__
+    stmt = database.dialect_insert(db)(table)
+    if db.bind.dialect.name == "postgresql":
+        least, greatest = func.least, func.greatest
+    else:
+        # SQLite : min() / max() à plusieurs arguments sont des fonctions scalaires
+        least, greatest = func.min, func.max
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["zone_id", "type", "bucket"],
+        set_={
+            "count": table.c.count + stmt.excluded["count"],
+            "sum": table.c.sum + stmt.excluded["sum"],
+            "sum_sq": table.c.sum_sq + stmt.excluded["sum_sq"],
+            "min": least(table.c.min, stmt.excluded["min"]),
+            "max": greatest(table.c.max, stmt.excluded["max"]),
+            "unit": stmt.excluded["unit"],
+        }
+    )
+    db.execute(stmt, partials)
+
+
+def apply(db: Session, rows: Iterable):
+    """
+    Intègre de nouveaux relevés (objets ou lignes avec zone_id, type, timestamp, value, unit)
+    dans les agrégats horaires et journaliers. Ne fait pas de commit.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    for model, width in GRANULARITIES.values():
+        partials = {}
+        for row in rows:
+            key = (row.zone_id, row.type, truncate(row.timestamp, width))
+            partial = partials.get(key)
+            if partial is None:
+                partials[key] = {
+                    "zone_id": key[0], "type": key[1], "bucket": key[2], "unit": row.unit,
+                    "count": 1, "sum": row.value, "sum_sq": row.value * row.value,
+                    "min": row.value, "max": row.value,
+                }
+            else:
+                partial["count"] += 1
+                partial["sum"] += row.value
+                partial["sum_sq"] += row.value * row.value
+                partial["min"] = min(partial["min"], row.value)
+                partial["max"] = max(partial["max"], row.value)
+                partial["unit"] = row.unit
+        _upsert(db, model, list(partials.values()))
+    _upsert_latest(db, rows)
+
+
+def _latest_values(row) -> dict:
+    return {
+        "zone_id": row.zone_id, "type": row.type, "indicator_id": row.id,
+        "value": row.value, "unit": row.unit, "timestamp": row.timestamp,
+    }
+
+
+def _upsert_latest(db: Session, rows: list, only_newer: bool = True):
+    """
+    Remplace le dernier relevé de chaque (zone, type) par le plus récent des lignes données
+    (INSERT ... ON CONFLICT DO UPDATE). only_newer : un relevé antérieur (rattrapage) ne remplace rien.
+    """
+    newest = {}
+    for row in rows:
+        current = newest.get((row.zone_id, row.type))
+        if current is None or row.timestamp >= current.timestamp:
+            newest[(row.zone_id, row.type)] = row
+    if not newest:
+        return
+    table = models.IndicatorLatest.__table__
+    stmt = database.dialect_insert(db)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["zone_id", "type"],
+        set_={column: stmt.excluded[column] for column in ("indicator_id", "value", "unit", "timestamp")},
+        where=(stmt.excluded["timestamp"] >= table.c.timestamp) if only_newer else None
+    )
+    db.execute(stmt, [_latest_values(row) for row in newest.values()])
+
+
+def _newest_raw(db: Session):
+    """Relevé le plus récent de chaque (zone, type) dans les relevés bruts (fonction de fenêtre)."""
+    ranked = db.query(
+        models.Indicator,
+        func.row_number().over(
+            partition_by=(models.Indicator.zone_id, models.Indicator.type),
+            order_by=(models.Indicator.timestamp.desc(), models.Indicator.id.desc())
+        ).label("rank")
+    ).subquery()
+    return db.query(ranked).filter(ranked.c.rank == 1)
+
+
+def refresh_latest(db: Session, pairs: Iterable):
+    """Recalcule le dernier relevé des (zone_id, type) touchés par une modification ou une suppression."""
+    for zone_id, type_ in set(pairs):
+        db.query(models.IndicatorLatest).filter(
+            models.IndicatorLatest.zone_id == zone_id, models.IndicatorLatest.type == type_
+        ).delete(synchronize_session=False)
+        newest = db.query(models.Indicator).filter(
+            models.Indicator.zone_id == zone_id, models.Indicator.type == type_
+        ).order_by(models.Indicator.timestamp.desc(), models.Indicator.id.desc()).first()
+        if newest is not None:
+            db.execute(models.IndicatorLatest.__table__.insert(), [_latest_values(newest)])
+
+
+def _raw_aggregates(db: Session, width: int):
+    """Requête GROUP BY (zone, type, tranche) sur les relevés bruts."""
+    bucket = epoch_bucket(db, width).label("bucket")
+    value = models.Indicator.value
+    return db.query(
+        models.Indicator.zone_id,
+        models.Indicator.type,
+        bucket,
+        func.max(models.Indicator.unit),
+        func.count(models.Indicator.id),
+        func.sum(value),
+        func.sum(value * value),
+        func.min(value),
+        func.max(value),
+    ).group_by(models.Indicator.zone_id, models.Indicator.type, bucket)
+
+
+def _as_rollup_rows(result):
+    return [
+        {
+            "zone_id": zone_id, "type": type_, "bucket": from_epoch(start), "unit": unit,
+            "count": count, "sum": total, "sum_sq": total_sq, "min": min_value, "max": max_value,
+        }
+        for zone_id, type_, start, unit, count, total, total_sq, min_value, max_value in result
+    ]
+
+
+def refresh_buckets(db: Session, keys: Iterable):
+    """
+    Recalcule depuis les relevés bruts les tranches touchées par une modification
+    ou une suppression (keys : tuples (zone_id, type, timestamp)). Ne fait pas de commit.
+    """
+    keys = set(keys)
+    boundaries = compaction_boundaries(db, {type_ for _, type_, _ in keys})
+    for model, width in GRANULARITIES.values():
+        buckets = {(zone_id, type_, truncate(timestamp, width)) for zone_id, type_, timestamp in keys}
+        for zone_id, type_, start in buckets:
+            if type_ in boundaries and start < boundaries[type_]:
+                continue  # tranche compactée : les relevés bruts n'y sont plus
+            db.query(model).filter(
+                model.zone_id == zone_id, model.type == type_, model.bucket == start
+            ).delete(synchronize_session=False)
+            result = _raw_aggregates(db, width).filter(
+                models.Indicator.zone_id == zone_id,
+                models.Indicator.type == type_,
+                models.Indicator.timestamp >= start,
+                models.Indicator.timestamp < start + timedelta(seconds=width),
+            ).all()
+            rows = _as_rollup_rows(result)
+            if rows:
+                db.execute(model.__table__.insert(), rows)
+    refresh_latest(db, {(zone_id, type_) for zone_id, type_, _ in keys})
+
+
+def cover_range(db: Session, type_: str, start: Optional[datetime], end: datetime) -> bool:
+    """
+    Vérifie que les agrégats horaires de type_ sur [start, end[ (bornes alignées sur le jour,
+    start None = sans limite) comptent autant de relevés que la table brute ; sinon recalcule
+    depuis les relevés bruts les tranches horaires et journalières de cet intervalle (relevés
+    importés directement en base, base antérieure aux agrégats). Ne fait pas de commit ;
+    renvoie True si un recalcul a eu lieu.
+    """
+    def in_range(column):
+        condition = column < end
+        return condition if start is None else and_(condition, column >= start)
+
+    hourly = models.IndicatorRollupHourly
+    raw_count = db.query(func.count(models.Indicator.id)).filter(
+        models.Indicator.type == type_, in_range(models.Indicator.timestamp)).scalar()
+    rolled_count = db.query(func.coalesce(func.sum(hourly.count), 0)).filter(
+        hourly.type == type_, in_range(hourly.bucket)).scalar()
+    if raw_count == rolled_count:
+        return False
+    for model, width in GRANULARITIES.values():
+        db.query(model).filter(model.type == type_, in_range(model.bucket)).delete(synchronize_session=False)
+        result = _raw_aggregates(db, width).filter(
+            models.Indicator.type == type_, in_range(models.Indicator.timestamp)).all()
+        rows = _as_rollup_rows(result)
+        if rows:
+            db.execute(model.__table__.insert(), rows)
+    return True
+
+
+def rebuild(db: Session):
+    """
+    Reconstruit les agrégats depuis la table indicators (backfill). Valide la transaction.
+    Les tranches compactées (relevés bruts supprimés) sont conservées telles quelles.
+    """
+    boundaries = compaction_boundaries(db)
+    counts = {}
+    for name, (model, width) in GRANULARITIES.items():
+        db.query(model).filter(raw_condition(boundaries, model.type, model.bucket))\
+            .delete(synchronize_session=False)
+        raw = raw_condition(boundaries, models.Indicator.type, models.Indicator.timestamp)
+        rows = _as_rollup_rows(_raw_aggregates(db, width).filter(raw).all())
+        if rows:
+            db.execute(model.__table__.insert(), rows)
+        counts[name] = len(rows)
+    # Derniers relevés : les (zone, type) entièrement compactés gardent le leur
+    newest = _newest_raw(db).all()
+    _upsert_latest(db, newest, only_newer=False)
+    counts["latest"] = len(newest)
+    db.commit()
+    return counts
+
+
+def backfill_if_empty(db: Session) -> Optional[dict]:
+    """
+    Reconstruit les agrégats si leurs tables sont vides alors que des relevés existent
+    (base créée avant les agrégats). Renvoie les compteurs de rebuild, ou None si rien à faire.
+    """
+    if db.query(models.IndicatorRollupHourly.bucket).first() is not None:
+        return None
+    if db.query(models.Indicator.id).first() is None:
+        return None
+    counts = rebuild(db)
+    logger.warning("Agrégats vides : reconstruits depuis les relevés bruts (%d tranches horaires, "
+                   "%d tranches journalières)", counts["hour"], counts["day"])
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance des agrégats horaires / journaliers")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild : recalcule tout depuis les relevés bruts")
+    parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        counts = rebuild(db)
+        print(f"Agrégats reconstruits : {counts['hour']} tranches horaires, {counts['day']} tranches journalières, "
+              f"{counts['latest']} derniers relevés.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from .. import database, schemas, utils, crud
+from .. import database, schemas, utils, crud, deps, auth_cache
 
 router = APIRouter(
     prefix="/auth",
@@ -28,4 +28,9 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     
     access_token = utils.create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/cache-stats")
+def read_auth_cache_stats(current_user: auth_cache.Principal = Depends(deps.get_admin_user)):
+    """Compteurs du cache d'authentification : taille, hits / misses, évictions (Admin seulement)."""
+    return auth_cache.cache.stats()
@@ -115,7 +115,7 @@ html_content = """
                             </div>
                             <div>
                                 <label class="block text-sm font-medium text-slate-600">Type</label>
-                                <select id="filterType" class="w-full border rounded p-2 mt-1 bg-slate-50" onchange="applyClientFilters()">
+                                <select id="filterType" class="w-full border rounded p-2 mt-1 bg-slate-50" onchange="applyClientFilters(); subscribeLive()">
                                     <option value="">Tous les types</option>
                                     <option value="temperature">Température</option>
                                     <option value="electricity_consumption">Électricité</option>
@@ -322,9 +322,26 @@ html_content = """
                 if(res.status === 401) { logout(); return; }
                 rawApiData = await res.json();
                 applyClientFilters();
+                subscribeLive();
             } catch(e){}
         }
 
+        // --- EN DIRECT (Server-Sent Events) : les nouveaux relevés arrivent sans recharger ---
+        let liveSource = null;
+        function subscribeLive() {
+            const z = document.getElementById("filterZone").value;
+            const type = document.getElementById("filterType").value;
+            const params = new URLSearchParams();
+            if (z) params.append("zone_id", z);
+            if (type) params.append("type", type);
+            if (liveSource) liveSource.close();
+            liveSource = new EventSource(`${API_URL}/indicators/stream${params.toString() ? '?'+params : ''}`);
+            liveSource.addEventListener("indicator", e => {
+                rawApiData.push(JSON.parse(e.data));
+                applyClientFilters();
+            });
+        }
+
         function applyClientFilters() {
             const period = document.getElementById("filterPeriod").value;
             const type = document.getElementById("filterType").value;
@@ -355,16 +372,31 @@ html_content = """
 
         let chartEvo, chartDist;
         function renderCharts() {
-            const ctxEvo = document.getElementById('evolutionChart').getContext('2d');
-            const chrono = [...filteredData].reverse();
-            if(chartEvo) chartEvo.destroy();
-            chartEvo = new Chart(ctxEvo, { type:'line', data:{labels:chrono.map(d=>new Date(d.timestamp).toLocaleTimeString()), datasets:[{label:'Valeur', data:chrono.map(d=>d.value), borderColor:'#2563eb', backgroundColor:'rgba(37,99,235,0.1)', fill:true}]}, options:{maintainAspectRatio:false}});
+            renderEvolution();
 
             const ctxDist = document.getElementById('distributionChart').getContext('2d');
             const counts={}; statsData.forEach(d=>{const t=d.indicator_type||d.type; counts[t]=(counts[t]||0)+1;});
             if(chartDist) chartDist.destroy();
             chartDist = new Chart(ctxDist, {type:'doughnut', data:{labels:Object.keys(counts), datasets:[{data:Object.values(counts), backgroundColor:['#3b82f6','#10b981','#f59e0b','#ef4444','#8b5cf6']}]}, options:{maintainAspectRatio:false, plugins:{legend:{position:'bottom'}}}});
         }
+
+        // Zone et type choisis : série réduite côté serveur (LTTB, 500 points au plus)
+        async function renderEvolution() {
+            const z = document.getElementById("filterZone").value;
+            const type = document.getElementById("filterType").value;
+            let times = [...filteredData].reverse().map(d=>d.timestamp), values = [...filteredData].reverse().map(d=>d.value);
+            if (z && type) {
+                const days = {day: 1, week: 7, month: 30}[document.getElementById("filterPeriod").value];
+                const from = days ? `&from_date=${new Date(Date.now() - days*86400000).toISOString().slice(0, 19)}` : '';
+                try {
+                    const res = await fetch(`${API_URL}/indicators/series?zone_id=${z}&type=${type}&points=500${from}`);
+                    if (res.ok) { const series = await res.json(); times = series.timestamp; values = series.value; }
+                } catch(e){}
+            }
+            const ctxEvo = document.getElementById('evolutionChart').getContext('2d');
+            if(chartEvo) chartEvo.destroy();
+            chartEvo = new Chart(ctxEvo, { type:'line', data:{labels:times.map(t=>new Date(t).toLocaleTimeString()), datasets:[{label:'Valeur', data:values, borderColor:'#2563eb', backgroundColor:'rgba(37,99,235,0.1)', fill:true}]}, options:{maintainAspectRatio:false}});
+        }
     </script>
 </body>
 </html>
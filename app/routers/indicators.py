@@ -1,40 +1,298 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from .. import database, models, schemas, crud, deps
+from typing import List, Optional, Union
+from datetime import datetime
+import asyncio
+import csv
+import io
+from .. import database, models, schemas, crud, async_crud, deps, utils, broker
 
 router = APIRouter(
     prefix="/indicators",
     tags=["Indicators"]
 )
 
+# Mise en forme des tuples (crud.INDICATOR_COLUMNS) renvoyés par la liste
+def _as_records(rows):
+    return [dict(zip(crud.INDICATOR_COLUMNS, row)) for row in rows]
+
+def _as_columns(rows):
+    columns = list(zip(*rows)) or [()] * len(crud.INDICATOR_COLUMNS)
+    return {name: list(values) for name, values in zip(crud.INDICATOR_COLUMNS, columns)}
+
+LIST_FORMATS = {"rows": _as_records, "columnar": _as_columns}
+
 # --- Lecture (Tout le monde connecté) ---
-@router.get("/", response_model=List[schemas.Indicator]) # CORRECTION : Indicator au lieu de IndicatorOut
-def read_indicators(
+# Réponse déjà sérialisée (octets) : les deux formes sont décrites pour l'OpenAPI
+@router.get("/", response_class=Response, responses={200: {
+    "model": Union[List[schemas.Indicator], schemas.IndicatorColumns],
+    "description": "Liste de relevés (format=rows) ou une liste par champ (format=columnar)",
+}})
+async def read_indicators(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     zone_id: Optional[int] = None,
     type: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    format: str = "rows",
+    after: Optional[list] = Depends(deps.get_cursor),
+    db: AsyncSession = Depends(database.get_async_db),
     # Optionnel : décommente si tu veux que seuls les connectés puissent lire
-    # current_user: models.User = Depends(deps.get_current_user)
+    # current_user: models.User = Depends(deps.get_current_user_async)
 ):
     """
-    Récupère la liste des indicateurs.
-    Permet de filtrer par zone ou par type.
+    Récupère la liste des indicateurs, triés par date.
+    Permet de filtrer par zone, par type ou par période.
+    Pagination : passer la valeur de l'en-tête X-Next-Cursor dans ?cursor= pour la page suivante.
+    Requête conditionnelle : If-None-Match avec l'ETag reçu renvoie 304 si rien n'a changé.
+    format=columnar renvoie une colonne par champ ({"timestamp": [...], "value": [...], ...}),
+    plus compact pour les graphiques.
     """
-    return crud.get_indicators(db, skip=skip, limit=limit, zone_id=zone_id, type=type)
+    if format not in LIST_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format, expected 'rows' or 'columnar'")
+    after = deps.cursor_timestamp_id(after)
+
+    # Compteur de la zone demandée (ou global) : une écriture ailleurs n'invalide pas la page
+    key = f"indicators:zone:{zone_id}" if zone_id is not None else "indicators"
+    unchanged = deps.not_modified(request, response, key, await async_crud.get_data_version(db, key))
+    if unchanged is not None:
+        return unchanged
+
+    # Chemin rapide : tuples bruts sérialisés directement en octets,
+    # sans objet ORM ni validation Pydantic ligne par ligne
+    rows = await async_crud.get_indicator_rows(
+        db, skip=skip, limit=limit, zone_id=zone_id, type=type,
+        from_date=from_date, to_date=to_date, after=after
+    )
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = utils.encode_cursor(last.timestamp.isoformat(), last.id)
+    return Response(
+        content=utils.json_bytes(LIST_FORMATS[format](rows)),
+        media_type="application/json",
+        headers=dict(response.headers)
+    )
+
+# --- Agrégation par tranches de temps (côté serveur) ---
+@router.get("/aggregate", response_model=List[schemas.IndicatorAggregate])
+def aggregate_indicators(
+    bucket: str = "1h",
+    zone_id: Optional[List[int]] = Query(None),
+    type: Optional[List[str]] = Query(None),
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Renvoie min / max / moyenne / nombre de relevés par tranche de temps.
+    Plusieurs zones et types peuvent être passés (ex: ?zone_id=1&zone_id=2&type=temperature).
+    Tranches disponibles : 5m, 15m, 1h, 1d.
+    """
+    if bucket not in crud.BUCKET_WIDTHS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid bucket, expected one of: {', '.join(crud.BUCKET_WIDTHS)}"
+        )
+    return crud.get_indicator_aggregates(
+        db, bucket=bucket, zone_ids=zone_id, types=type,
+        from_date=from_date, to_date=to_date
+    )
+
+# --- Série réduite pour les graphiques (LTTB) ---
+MAX_SERIES_POINTS = 5000
+
+@router.get("/series", response_model=schemas.IndicatorSeries)
+def read_indicator_series(
+    zone_id: int,
+    type: str,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    points: int = Query(500, ge=3, le=MAX_SERIES_POINTS),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Série d'une zone et d'un type prête pour un graphique : au plus `points` relevés,
+    choisis par Largest-Triangle-Three-Buckets pour conserver pics et creux.
+    """
+    return crud.get_indicator_series(
+        db, zone_id=zone_id, type=type, from_date=from_date, to_date=to_date, points=points
+    )
+
+# --- Statistiques groupées (zones x types) ---
+@router.get("/stats", response_model=List[schemas.IndicatorStats])
+def read_indicator_stats(
+    zone_id: Optional[List[int]] = Query(None),
+    type: Optional[List[str]] = Query(None),
+    percentile: Optional[List[float]] = Query(None),
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Nombre, min, max, moyenne et écart-type pour chaque couple (zone, type) demandé,
+    en un seul appel (ex: ?zone_id=1&zone_id=2&type=temperature&percentile=50&percentile=95).
+    """
+    if percentile and any(not 0 < p <= 100 for p in percentile):
+        raise HTTPException(status_code=400, detail="Percentiles must be in ]0, 100]")
+    return crud.get_indicator_stats_grouped(
+        db, zone_ids=zone_id, types=type, from_date=from_date, to_date=to_date,
+        percentiles=percentile
+    )
+
+# --- Export en flux (NDJSON / CSV) ---
+EXPORT_CHUNK_ROWS = 1000
+
+def _ndjson_lines(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(utils.json_bytes(dict(zip(crud.INDICATOR_COLUMNS, row))))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
 
-# --- Création (Utilisateur connecté) ---
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(crud.INDICATOR_COLUMNS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row[:-1] + (row[-1].isoformat() if row[-1] else "",))
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@router.get("/export")
+def export_indicators(
+    format: str = "ndjson",
+    zone_id: Optional[List[int]] = Query(None),
+    type: Optional[List[str]] = Query(None),
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Exporte les relevés filtrés en flux continu (NDJSON ou CSV), triés par date.
+    Les lignes sont lues par lots depuis un curseur : la mémoire reste stable quel que soit le volume.
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Invalid format, expected 'ndjson' or 'csv'")
+
+    rows = crud.iter_indicators(db, zone_ids=zone_id, types=type, from_date=from_date, to_date=to_date)
+    if format == "csv":
+        return StreamingResponse(
+            _csv_lines(rows),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="indicators.csv"'}
+        )
+    return StreamingResponse(_ndjson_lines(rows), media_type="application/x-ndjson")
+
+# --- Flux en direct (Server-Sent Events) ---
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_BACKFILL_LIMIT = 1000
+
+def _sse(record: dict) -> bytes:
+    return b"id: %d\nevent: indicator\ndata: " % record["id"] + utils.json_bytes(record) + b"\n\n"
+
+async def _sse_events(subscription: broker.Subscription, backlog, keepalive: float = STREAM_KEEPALIVE_SECONDS):
+    last_id = 0
+    try:
+        yield b"retry: 3000\n\n"
+        for row in backlog:
+            last_id = row.id
+            yield _sse(dict(zip(crud.INDICATOR_COLUMNS, row)))
+        while True:
+            try:
+                record = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if record is None:
+                # Client trop lent : il se reconnecte et reprend grâce à Last-Event-ID
+                yield b"event: dropped\ndata: {}\n\n"
+                return
+            if record["id"] > last_id:  # déjà envoyé par le rattrapage
+                yield _sse(record)
+    finally:
+        broker.broker.unsubscribe(subscription)
+
+@router.get("/stream")
+async def stream_indicators(
+    zone_id: Optional[List[int]] = Query(None),
+    type: Optional[List[str]] = Query(None),
+    last_event_id: Optional[int] = Header(None)
+):
+    """
+    Pousse les nouveaux relevés au fil de leur insertion (text/event-stream, un événement "indicator" par relevé).
+    Filtrable par zones et types. À la reconnexion, l'en-tête Last-Event-ID (envoyé par EventSource)
+    permet de rattraper les relevés manqués (au plus STREAM_BACKFILL_LIMIT).
+    """
+    # Abonnement avant le rattrapage : aucun relevé ne peut tomber entre les deux.
+    # Si le rattrapage échoue, le flux n'est jamais ouvert : l'abonnement est rendu ici.
+    subscription = await broker.broker.subscribe(zone_ids=zone_id, types=type)
+    backlog = []
+    try:
+        if last_event_id is not None:
+            # Session courte, rendue avant le flux : une dépendance get_async_db garderait
+            # une connexion du pool pendant toute la durée (infinie) de la réponse
+            async with database.AsyncSessionLocal() as db:
+                backlog = await async_crud.get_indicator_rows_since(
+                    db, last_event_id, zone_ids=zone_id, types=type, limit=STREAM_BACKFILL_LIMIT
+                )
+    except BaseException:
+        broker.broker.unsubscribe(subscription)
+        raise
+    return StreamingResponse(
+        _sse_events(subscription, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Création (Admin seulement) ---
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Indicator)
 def create_indicator(
     indicator: schemas.IndicatorCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(deps.get_current_user)
+    current_user: models.User = Depends(deps.get_admin_user)
 ):
-    """Crée un nouveau relevé (Nécessite d'être connecté)."""
+    """Crée un nouveau relevé (Admin seulement)."""
     # Vérification basique que la zone existe (optionnel, géré par FK)
-    return crud.create_indicator(db=db, indicator=indicator)
+    try:
+        return crud.create_indicator(db=db, indicator=indicator)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Indicator already exists for this zone, type and timestamp"
+        )
+
+# --- Création en lot (Admin seulement) ---
+@router.post("/batch", response_model=schemas.IndicatorBatchResult)
+def create_indicators_batch(
+    indicators: List[schemas.IndicatorCreate],
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(deps.get_admin_user)
+):
+    """
+    Crée plusieurs relevés en une seule transaction (Admin seulement).
+    Renvoie le statut et l'id de chaque élément, dans l'ordre d'envoi.
+    """
+    if not indicators:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(indicators) > crud.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large (max {crud.MAX_BATCH_SIZE} items)"
+        )
+    return crud.create_indicators_batch(db, indicators)
 
 # --- Suppression (Admin seulement) ---
 @router.delete("/{indicator_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,64 @@
+from datetime import timezone
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+from .. import database, crud, metrics, auth_cache, broker, hot_window
+
+router = APIRouter(tags=["Monitoring"])
+
+# Moteurs instrumentés (étiquette engine des métriques base de données)
+ENGINES = {"sync": database.engine, "async": database.async_engine.sync_engine}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _gauge(name: str, help: str, values: dict, labels=(), kind: str = "gauge"):
+    """Métrique ponctuelle ; values associe chaque tuple d'étiquettes à sa valeur."""
+    metric = metrics.Metric(name, help, kind=kind, labels=labels)
+    for key, value in values.items():
+        metric.set(value, *key)
+    return metric
+
+
+def _snapshot(db: Session):
+    """Métriques calculées au moment de la collecte (état courant plutôt qu'événements)."""
+    pools = {name: engine.pool for name, engine in ENGINES.items()}
+    yield _gauge("ecotrack_db_pool_size", "Taille configurée du pool de connexions",
+                 {(name,): pool.size() for name, pool in pools.items() if hasattr(pool, "size")},
+                 labels=("engine",))
+
+    # Ingestion : cumuls enregistrés par les scripts d'ingestion (autres processus)
+    totals = crud.get_ingestion_totals(db)
+    for suffix, help, column in (
+        ("runs_total", "Exécutions d'ingestion (par zone)", 1),
+        ("rows_fetched_total", "Relevés récupérés auprès des sources", 2),
+        ("rows_inserted_total", "Relevés réellement insérés (hors doublons)", 3),
+        ("failures_total", "Exécutions d'ingestion en échec (par zone)", 4),
+    ):
+        yield _gauge(f"ecotrack_ingestion_{suffix}", help,
+                     {(row[0],): row[column] for row in totals}, labels=("source",), kind="counter")
+    yield _gauge("ecotrack_ingestion_last_run_timestamp_seconds", "Dernière exécution d'ingestion (epoch)",
+                 {(row[0],): row[5].replace(tzinfo=timezone.utc).timestamp()
+                  for row in totals if row[5] is not None}, labels=("source",))
+
+    cache = auth_cache.cache.stats()
+    yield _gauge("ecotrack_auth_cache_hits_total", "Succès du cache d'authentification", {(): cache["hits"]}, kind="counter")
+    yield _gauge("ecotrack_auth_cache_misses_total", "Échecs du cache d'authentification", {(): cache["misses"]}, kind="counter")
+    yield _gauge("ecotrack_auth_cache_entries", "Jetons en cache", {(): cache["size"]})
+
+    window = hot_window.cache.stats()
+    yield _gauge("ecotrack_hot_window_hits_total", "Lectures servies par la fenêtre chaude", {(): window["hits"]}, kind="counter")
+    yield _gauge("ecotrack_hot_window_misses_total", "Lectures hors fenêtre chaude (base)", {(): window["misses"]}, kind="counter")
+    yield _gauge("ecotrack_hot_window_points", "Relevés en mémoire dans la fenêtre chaude", {(): window["points"]})
+
+    yield _gauge("ecotrack_stream_subscribers", "Abonnés au flux de relevés", {(): len(broker.broker.subscribers)})
+    yield _gauge("ecotrack_stream_dropped_total", "Abonnés déconnectés pour lenteur", {(): broker.broker.dropped}, kind="counter")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def read_metrics(db: Session = Depends(database.get_db)):
+    """
+    Métriques au format texte Prometheus (à collecter par un scraper).
+    Les compteurs HTTP et SQL sont propres à chaque processus (worker).
+    """
+    return PlainTextResponse(metrics.registry.render(_snapshot(db)), media_type=CONTENT_TYPE)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from .. import deps, profiling
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["Monitoring"]
+)
+
+# Profils enregistrés par profiling.ProfilingMiddleware (requêtes envoyées avec X-Profile: 1)
+
+@router.get("/")
+async def read_profiles(admin=Depends(deps.get_admin_user)):
+    """Derniers profils de requêtes (du plus récent au plus ancien), avec leur détail de temps."""
+    return [profile.summary() for profile in profiling.store.list()]
+
+@router.get("/{profile_id}")
+async def read_profile(profile_id: str, format: str = "json", admin=Depends(deps.get_admin_user)):
+    """
+    Un profil : ?format=folded renvoie les piles au format "folded stacks"
+    (flamegraph.pl, speedscope), sinon le détail JSON avec ces mêmes piles.
+    """
+    profile = profiling.store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Unknown format (json, folded)")
+    return {**profile.summary(), "folded": profile.folded()}
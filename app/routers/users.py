@@ -1,10 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 
 # Imports internes
-from .. import database, models, schemas, crud, deps
+from .. import database, models, schemas, crud, deps, utils
 
 router = APIRouter(
     prefix="/users",
@@ -18,8 +18,8 @@ class RoleChangeRequest(BaseModel):
 # --- 1. ROUTES UTILISATEUR CONNECTÉ (Nouveau) ---
 
 @router.get("/me", response_model=schemas.UserOut)
-def read_user_me(
-    current_user: models.User = Depends(deps.get_current_user)
+async def read_user_me(
+    current_user: models.User = Depends(deps.get_current_user_async)
 ):
     """Renvoie les infos de l'utilisateur connecté (dont son rôle)."""
     return current_user
@@ -46,18 +46,15 @@ def switch_role(
             detail="Action non autorisée. Vous n'êtes pas administrateur."
         )
 
-    # --- CORRECTION DU BUG ---
-    # On récupère l'utilisateur dans la session actuelle (db) via son ID
-    # pour éviter l'erreur "not persistent within this Session"
-    user_in_db = db.query(models.User).filter(models.User.id == current_user.id).first()
+    # L'authentification partage la session de la requête : si elle vient de charger
+    # l'utilisateur, crud.get_user le retrouve sans nouvelle requête
+    user_in_db = crud.get_user(db, user_id=current_user.id)
     
     if not user_in_db:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable.")
 
-    # Mise à jour du rôle sur l'objet attaché à la session
-    user_in_db.role = request.target_role
-    db.commit()
-    db.refresh(user_in_db)
+    # Mise à jour du rôle (invalide aussi le cache d'authentification)
+    user_in_db = crud.update_user(db, user_in_db, schemas.UserUpdate(role=request.target_role))
     
     return {
         "message": f"Rôle changé en {request.target_role}", 
@@ -77,13 +74,21 @@ def request_admin_access(
 
 @router.get("/", response_model=List[schemas.UserOut])
 def read_users(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    after: Optional[list] = Depends(deps.get_cursor),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(deps.get_admin_user)
 ):
-    """Récupère la liste de tous les utilisateurs (Admin seulement)."""
-    return crud.get_users(db, skip=skip, limit=limit)
+    """
+    Récupère la liste de tous les utilisateurs (Admin seulement).
+    Pagination : passer la valeur de l'en-tête X-Next-Cursor dans ?cursor= pour la page suivante.
+    """
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=deps.cursor_id(after))
+    if limit and len(users) == limit:
+        response.headers["X-Next-Cursor"] = utils.encode_cursor(users[-1].id)
+    return users
 
 @router.put("/{user_id}", response_model=schemas.UserOut)
 def update_user(
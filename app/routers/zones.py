@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from .. import database, models, schemas, crud, deps
+from typing import List, Optional
+from .. import database, models, schemas, crud, async_crud, deps, utils
 
 router = APIRouter(
     prefix="/zones",
@@ -11,13 +12,44 @@ router = APIRouter(
 # --- Lecture (Accessible à tous) ---
 # CORRECTION ICI : schemas.Zone au lieu de schemas.ZoneOut
 @router.get("/", response_model=List[schemas.Zone])
-def read_zones(
+async def read_zones(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(database.get_db)
+    after: Optional[list] = Depends(deps.get_cursor),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    """Récupère la liste des zones géographiques."""
-    return crud.get_zones(db, skip=skip, limit=limit)
+    """
+    Récupère la liste des zones géographiques.
+    Pagination : passer la valeur de l'en-tête X-Next-Cursor dans ?cursor= pour la page suivante.
+    Requête conditionnelle : If-None-Match avec l'ETag reçu renvoie 304 si rien n'a changé.
+    """
+    unchanged = deps.not_modified(request, response, "zones", await async_crud.get_data_version(db, "zones"))
+    if unchanged is not None:
+        return unchanged
+    zones = await async_crud.get_zones(db, skip=skip, limit=limit, after_id=deps.cursor_id(after))
+    if limit and len(zones) == limit:
+        response.headers["X-Next-Cursor"] = utils.encode_cursor(zones[-1].id)
+    return zones
+
+# --- Dernier relevé de chaque zone et type (Accessible à tous) ---
+@router.get("/latest", response_model=List[schemas.IndicatorLatest])
+async def read_latest_indicators(
+    request: Request,
+    response: Response,
+    type: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Conditions actuelles : valeur, unité et horodatage du relevé le plus récent de chaque
+    couple (zone, type), filtrable par type (ex: ?type=temperature&type=pm25).
+    Lu dans une table tenue à jour à chaque insertion : la réponse ne parcourt pas l'historique.
+    """
+    unchanged = deps.not_modified(request, response, "indicators", await async_crud.get_data_version(db, "indicators"))
+    if unchanged is not None:
+        return unchanged
+    return await async_crud.get_latest_indicators(db, types=type)
 
 # --- Création (Admin seulement) ---
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Zone)
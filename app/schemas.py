@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # --- TOKENS ---
@@ -44,6 +44,9 @@ class ZoneBase(BaseModel):
     name: str
     postal_code: str
     country: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    region: Optional[str] = None
 
 class ZoneCreate(ZoneBase):
     pass
@@ -52,6 +55,9 @@ class ZoneUpdate(BaseModel):
     name: Optional[str] = None
     postal_code: Optional[str] = None
     country: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    region: Optional[str] = None
 
 class Zone(ZoneBase):
     id: int
@@ -83,6 +89,66 @@ class Indicator(IndicatorBase):
     class Config:
         from_attributes = True
 
+class IndicatorColumns(BaseModel):
+    """GET /indicators/?format=columnar : une liste par champ, dans l'ordre des relevés."""
+    id: List[int]
+    zone_id: List[Optional[int]]
+    type: List[str]
+    value: List[float]
+    unit: List[str]
+    timestamp: List[Optional[datetime]]
+
+class IndicatorBatchItem(BaseModel):
+    index: int                    # position dans le lot envoyé
+    status: str                   # "created", "duplicate" ou "error"
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class IndicatorBatchResult(BaseModel):
+    created: int
+    duplicates: int
+    errors: int
+    items: List[IndicatorBatchItem]
+
+class IndicatorAggregate(BaseModel):
+    zone_id: int
+    type: str
+    bucket: datetime  # début de la tranche (UTC)
+    count: int
+    min: float
+    max: float
+    avg: float
+
+class IndicatorStats(BaseModel):
+    zone_id: int
+    zone: str
+    type: str
+    unit: str
+    count: int
+    min: float
+    max: float
+    mean: float
+    stddev: float                                  # écart-type d'échantillon
+    percentiles: Dict[str, float] = {}             # ex: {"p50": 12.3, "p95": 18.0}
+
+class IndicatorSeries(BaseModel):
+    zone_id: int
+    type: str
+    unit: Optional[str] = None
+    count: int                                     # nombre de relevés bruts sur la période
+    timestamp: List[datetime]                      # au plus "points" valeurs (LTTB)
+    value: List[float]
+
+class IndicatorLatest(BaseModel):
+    zone_id: int
+    type: str
+    value: float
+    unit: Optional[str] = None
+    timestamp: datetime
+
+    class Config:
+        from_attributes = True
+
 class StatResult(BaseModel):
     zone: str
     type: str
@@ -0,0 +1,181 @@
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# INSTRUMENTATION SQL (journal des requêtes lentes, détecteur N+1)
+# Branché sur les événements before_cursor_execute / after_cursor_execute des moteurs :
+# - toute requête plus lente que SLOW_QUERY_MS est journalisée (logger "ecotrack.sql")
+#   avec ses paramètres et son plan d'exécution (EXPLAIN QUERY PLAN sous SQLite) ;
+# - pendant une requête HTTP, les requêtes SQL sont regroupées par forme (texte SQL,
+#   listes IN réduites) : une même forme SELECT répétée N_PLUS_ONE_THRESHOLD fois ou
+#   plus signale un motif N+1 (chargement paresseux ou requête dans une boucle) ;
+# - assert_max_queries() sert aux tests à borner le nombre de requêtes d'un appel.
+
+SLOW_QUERY_MS = float(os.getenv("ECOTRACK_SLOW_QUERY_MS", "100"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("ECOTRACK_N_PLUS_ONE_THRESHOLD", "10"))
+# Longueur maximale des paramètres recopiés dans le journal
+MAX_PARAMS_LENGTH = 500
+
+logger = logging.getLogger("ecotrack.sql")
+
+# Liste de paramètres "(?, ?, ?)" (qmark, format, numeric ou named) ramenée à "(?...)"
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN "}
+
+
+def query_shape(statement: str) -> str:
+    """Forme d'une requête : espaces normalisés, listes IN de longueur variable réduites."""
+    return _IN_LIST.sub("(?...)", _SPACES.sub(" ", statement).strip())
+
+
+class QueryLog:
+    """
+    Requêtes SQL observées sur une période (une requête HTTP, un bloc de test).
+    Un journal ouvert dans un autre (ex: profilage autour de la requête HTTP) lui transmet ses requêtes.
+    """
+
+    def __init__(self, parent: "QueryLog" = None):
+        self.parent = parent
+        self.count = 0
+        self.total_ms = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.shapes[query_shape(statement)] += 1
+        if self.parent is not None:
+            self.parent.record(statement, duration_ms)
+
+    def repeated(self, threshold: int = None):
+        """Formes SELECT répétées au moins threshold fois : [(forme, nombre)]."""
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return [
+            (shape, count) for shape, count in self.shapes.most_common()
+            if count >= threshold and shape.upper().startswith("SELECT")
+        ]
+
+
+# Journal de la requête HTTP en cours (None hors requête)
+_current = contextvars.ContextVar("ecotrack_query_log", default=None)
+
+
+@contextmanager
+def track_queries():
+    """Collecte les requêtes SQL exécutées dans ce contexte (threads du pool FastAPI compris)."""
+    log = QueryLog(parent=_current.get())
+    token = _current.set(log)
+    try:
+        yield log
+    finally:
+        _current.reset(token)
+
+
+def report_n_plus_one(log: QueryLog, label: str, threshold: int = None):
+    for shape, count in log.repeated(threshold):
+        logger.warning("N+1 probable sur %s : %d requêtes identiques : %s", label, count, shape)
+
+
+def explain(conn, statement: str, parameters):
+    """
+    Plan d'exécution d'une requête SELECT, lu par un curseur DBAPI séparé
+    (sans repasser par les événements SQLAlchemy). Liste vide si indisponible.
+    """
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+        return []
+    explain_cursor = conn.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        # SQLite : (id, parent, notused, detail) ; PostgreSQL : (ligne du plan,)
+        return [str(row[-1]) for row in explain_cursor.fetchall()]
+    except Exception as e:
+        return [f"plan indisponible : {e}"]
+    finally:
+        explain_cursor.close()
+
+
+def _format_params(parameters) -> str:
+    text = repr(parameters)
+    if len(text) > MAX_PARAMS_LENGTH:
+        text = text[:MAX_PARAMS_LENGTH] + "..."
+    return text
+
+
+def instrument_engine(engine, slow_query_ms: float = None):
+    """Branche le journal des requêtes lentes et le comptage par forme sur un moteur synchrone."""
+    threshold = SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+
+    # Début porté par le contexte d'exécution : une instruction en échec ne laisse rien sur la connexion
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.ecotrack_sql_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context.ecotrack_sql_start) * 1000
+        log = _current.get()
+        if log is not None:
+            log.record(statement, duration_ms)
+        if duration_ms < threshold:
+            return
+        plan = [] if executemany else explain(conn, statement, parameters)
+        logger.warning(
+            "Requête lente (%.1f ms) : %s | paramètres : %s%s",
+            duration_ms, _SPACES.sub(" ", statement).strip(), _format_params(parameters),
+            "".join(f"\n    plan : {line}" for line in plan),
+        )
+
+    return engine
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, *engines):
+    """
+    Aide aux tests : échoue si plus de max_queries requêtes SQL sont exécutées dans le bloc
+    sur les moteurs donnés (ex: ceux des dépendances surchargées). Le message liste les formes répétées.
+
+        with assert_max_queries(3, engine, async_engine.sync_engine):
+            client.get("/zones/")
+    """
+    log = QueryLog()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        log.record(statement, 0.0)
+
+    for engine in engines:
+        event.listen(engine, "after_cursor_execute", count)
+    try:
+        yield log
+    finally:
+        for engine in engines:
+            event.remove(engine, "after_cursor_execute", count)
+    if log.count > max_queries:
+        detail = "\n".join(f"  {n} x {shape}" for shape, n in log.shapes.most_common())
+        raise AssertionError(f"{log.count} requêtes SQL exécutées (maximum {max_queries}) :\n{detail}")
+
+
+class SQLInstrumentationMiddleware:
+    """Middleware ASGI : compte les requêtes SQL de chaque requête HTTP et signale les motifs N+1."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries() as log:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = getattr(scope.get("route"), "path", None) or scope["path"]
+                report_n_plus_one(log, f"{scope['method']} {route}")
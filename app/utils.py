@@ -2,8 +2,16 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import jwt
 from typing import Optional
+import base64
+import hashlib
+import json
 import os
 
+try:
+    import orjson
+except ImportError:  # orjson est optionnel : repli sur le module json (plus lent)
+    orjson = None
+
 # CONFIGURATION
 # Dans un vrai projet, charge ces valeurs depuis .env avec os.getenv()
 SECRET_KEY = "supersecretkey_change_me_in_prod" 
@@ -30,4 +38,28 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+def encode_cursor(*values) -> str:
+    """Encode la position d'une pagination par curseur en une chaîne opaque (base64 url-safe)."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """Décode un curseur produit par encode_cursor. Lève ValueError s'il est invalide."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def weak_etag(key: str, version: int, variant: str = "") -> str:
+    """ETag faible d'une liste : version du jeu de données + empreinte des paramètres de la requête."""
+    digest = hashlib.sha1(f"{key}?{variant}".encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+def json_bytes(data) -> bytes:
+    """Sérialise en JSON (octets UTF-8), avec orjson si disponible ; les datetime sont en ISO 8601."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=datetime.isoformat).encode()
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+import httpx
+from fastapi import Depends, Request, Response
+from sqlalchemy.orm import Session, sessionmaker
+from app import database, models, crud, schemas, deps, utils
+from app.main import app
+
+# BENCHMARK ROUTE SYNCHRONE / ROUTE ASYNC
+# Même requête (GET /indicators/?zone_id=...&limit=...) servie par :
+# - une route "def" classique : session synchrone, exécutée dans le pool de threads de FastAPI ;
+# - la route async de l'API : session AsyncSession, sans thread bloqué pendant l'attente de la base.
+# Les deux font le même travail (compteur de version pour l'ETag, tuples bruts, JSON orjson) :
+# seul le mode d'accès à la base diffère, la sérialisation ne fausse pas la comparaison.
+# Des clients concurrents enchaînent les requêtes pendant une durée fixe (ASGI en mémoire, sans réseau).
+#
+#   python -m benchmarks.bench_async
+#   python -m benchmarks.bench_async --concurrency 200 --duration 10
+
+
+@app.get("/bench/indicators-sync", response_model=List[schemas.Indicator], include_in_schema=False)
+def read_indicators_sync(request: Request, response: Response, zone_id: int, limit: int = 100,
+                         db: Session = Depends(database.get_db)):
+    """Version synchrone de GET /indicators/ (même chemin rapide), utilisée uniquement pour la comparaison."""
+    key = f"indicators:zone:{zone_id}"
+    unchanged = deps.not_modified(request, response, key, db.get(models.DataVersion, key))
+    if unchanged is not None:
+        return unchanged
+    rows = db.execute(crud.indicators_statement(limit=limit, zone_id=zone_id, columns=crud.INDICATOR_COLUMNS)).all()
+    if limit and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = utils.encode_cursor(rows[-1].timestamp.isoformat(), rows[-1].id)
+    return Response(
+        content=utils.json_bytes([dict(zip(crud.INDICATOR_COLUMNS, row)) for row in rows]),
+        media_type="application/json",
+        headers=dict(response.headers)
+    )
+
+
+def setup(path: str, rows: int):
+    """Base temporaire remplie de rows relevés, branchée sur les deux dépendances de session."""
+    url = f"sqlite:///{path}"
+    engine = database.make_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    zone = models.Zone(name="Bench", postal_code="00000", country="France")
+    db.add(zone)
+    db.commit()
+    start = datetime(2024, 1, 1)
+    crud.bulk_insert_indicators(db, [
+        {"type": "bench", "value": float(i), "unit": "u", "zone_id": zone.id,
+         "timestamp": start + timedelta(minutes=i)}
+        for i in range(rows)
+    ])
+    db.commit()
+    zone_id = zone.id
+    db.close()
+
+    async_engine = database.make_async_engine(database.async_url(url))
+    AsyncSession = database.async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    app.dependency_overrides[database.get_db] = get_db
+    app.dependency_overrides[database.get_async_db] = get_async_db
+    return engine, async_engine, zone_id
+
+
+async def load(path: str, params: dict, concurrency: int, duration: float):
+    """Lance concurrency clients pendant duration secondes ; renvoie latences et erreurs."""
+    latencies, errors = [], 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get(path, params=params)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def report(label: str, latencies: list, errors: int, duration: float):
+    latencies = sorted(latencies)
+    if not latencies:
+        print(f"  {label:6s}: aucune requête réussie ({errors} erreurs)")
+        return
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f"  {label:6s}: {len(latencies) / duration:8.1f} req/s | "
+          f"médiane {statistics.median(latencies) * 1000:7.2f} ms | p95 {p95 * 1000:7.2f} ms | "
+          f"{errors} erreurs")
+
+
+async def compare(async_engine, params: dict, concurrency: int, duration: float):
+    # Une seule boucle d'événements : le pool du moteur async lui est lié
+    try:
+        for label, path in (("sync", "/bench/indicators-sync"), ("async", "/indicators/")):
+            latencies, errors = await load(path, params, concurrency, duration)
+            report(label, latencies, errors, duration)
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare une route synchrone et la route async de lecture")
+    parser.add_argument("--rows", type=int, default=10000, help="Relevés insérés dans la base de test")
+    parser.add_argument("--limit", type=int, default=100, help="Taille de page demandée")
+    parser.add_argument("--concurrency", type=int, default=100, help="Clients simultanés")
+    parser.add_argument("--duration", type=float, default=5.0, help="Durée de chaque mesure (secondes)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, async_engine, zone_id = setup(os.path.join(tmp, "bench.db"), args.rows)
+        print(f"\n== {args.concurrency} clients, {args.limit} relevés par réponse ==")
+        try:
+            asyncio.run(compare(async_engine, {"zone_id": zone_id, "limit": args.limit},
+                                args.concurrency, args.duration))
+        finally:
+            app.dependency_overrides.clear()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+from pydantic import TypeAdapter
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+from app import database, models, crud, schemas, utils, rollups
+
+# SUITE DE MICRO-BENCHMARKS (lectures crud, statistiques, écritures, ingestion, sérialisation)
+# Chaque cas est mesuré sur un jeu de données synthétique reproductible (graine fixe),
+# généré une fois puis réutilisé (benchmarks/data/). Les résultats de chaque exécution
+# sont enregistrés en JSON ; --baseline compare à une exécution précédente et
+# renvoie un code de sortie non nul en cas de régression.
+#
+#   python -m benchmarks.suite --dataset 10k
+#   python -m benchmarks.suite --dataset 1m --baseline benchmarks/results/1m-20240101-120000.json
+#   python -m benchmarks.suite --dataset 10k --only get_indicators
+
+DATASETS = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+SEED = 42
+ZONES = 20
+TYPES = [("temperature", "°C"), ("electricity_consumption", "MW"), ("air_quality_pm25", "µg/m³")]
+START = datetime(2020, 1, 1)
+STEP = timedelta(minutes=15)
+SEED_CHUNK = 50_000
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, "data")
+RESULTS_DIR = os.path.join(HERE, "results")
+
+
+# --- Jeux de données ---
+
+def synthetic_rows(count: int, seed: int = SEED):
+    """Relevés (zone, type, horodatage) uniques : chaque couple zone x type reçoit un relevé par quart d'heure."""
+    rng = random.Random(seed)
+    series = [(zone_id, type_, unit) for zone_id in range(1, ZONES + 1) for type_, unit in TYPES]
+    for i in range(count):
+        zone_id, type_, unit = series[i % len(series)]
+        step = i // len(series)
+        yield {
+            "zone_id": zone_id, "type": type_, "unit": unit,
+            "timestamp": START + step * STEP,
+            "value": round(rng.gauss(20 + zone_id, 5), 2),
+        }
+
+
+def dataset_engine(name: str, data_dir: str = DATA_DIR):
+    """Moteur sur la base du jeu de données, générée (avec ses agrégats) si absente ou incomplète."""
+    os.makedirs(data_dir, exist_ok=True)
+    engine = database.make_engine(f"sqlite:///{os.path.join(data_dir, f'{name}.db')}")
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    expected = DATASETS[name]
+    db = Session()
+    try:
+        if db.query(func.count(models.Indicator.id)).scalar() != expected:
+            seed_dataset(db, expected)
+    finally:
+        db.close()
+    return engine, Session
+
+
+def seed_dataset(db, count: int):
+    print(f"Génération de {count} relevés synthétiques (une seule fois)...")
+    started = time.perf_counter()
+    for model in (models.Indicator, models.Zone, models.IndicatorRollupHourly, models.IndicatorRollupDaily):
+        db.query(model).delete()
+    db.add_all(models.Zone(id=zone_id, name=f"Zone {zone_id}", postal_code=f"{zone_id:05d}", country="France")
+               for zone_id in range(1, ZONES + 1))
+    db.flush()
+    table = models.Indicator.__table__
+    rows = synthetic_rows(count)
+    while True:
+        chunk = list(itertools.islice(rows, SEED_CHUNK))
+        if not chunk:
+            break
+        db.execute(table.insert(), chunk)
+    db.commit()
+    rollups.rebuild(db)
+    print(f"Jeu de données prêt en {time.perf_counter() - started:.1f} s")
+
+
+# --- Cas mesurés ---
+
+class Context:
+    """Paramètres des cas, dérivés de la taille du jeu de données."""
+
+    def __init__(self, db, rows: int):
+        self.rows = rows
+        self.zone_id, self.type = 1, TYPES[0][0]
+        self.deep_offset = min(10_000, rows // 2)
+        deep = crud.get_indicators(db, skip=self.deep_offset, limit=1)[0]
+        self.deep_cursor = (deep.timestamp, deep.id)
+        last = db.query(func.max(models.Indicator.timestamp)).scalar()
+        self.range = (last - timedelta(days=7), last)
+        self.objects = crud.get_indicators(db, limit=1000)
+        self.existing = [
+            {"zone_id": r.zone_id, "type": r.type, "unit": r.unit, "timestamp": r.timestamp, "value": r.value}
+            for r in self.objects
+        ]
+        self.writes = itertools.count()
+        self.records = [
+            dict(zip(crud.INDICATOR_COLUMNS, row))
+            for row in db.execute(crud.indicators_statement(limit=1000, columns=crud.INDICATOR_COLUMNS)).all()
+        ]
+
+
+INDICATOR_LIST = TypeAdapter(List[schemas.Indicator])
+
+
+def _create_indicator(db, ctx: Context):
+    i = next(ctx.writes)
+    crud.create_indicator(db, schemas.IndicatorCreate(
+        type="bench_write", value=float(i), unit="u", zone_id=ctx.zone_id,
+        timestamp=datetime(2100, 1, 1) + timedelta(seconds=i)
+    ))
+
+
+def _ingest(db, rows):
+    # Chemin d'ingestion (INSERT ... ON CONFLICT DO NOTHING + agrégats), annulé pour garder le jeu intact
+    crud.bulk_insert_indicators(db, [dict(row) for row in rows])
+    db.rollback()
+
+
+def _new_rows(ctx: Context):
+    return [dict(row, type="bench_ingest") for row in ctx.existing]
+
+
+CASES = {
+    "get_indicators.first_page": lambda db, ctx: crud.get_indicators(db, limit=100),
+    "get_indicators.offset_deep": lambda db, ctx: crud.get_indicators(db, skip=ctx.deep_offset, limit=100),
+    "get_indicators.cursor_deep": lambda db, ctx: crud.get_indicators(db, limit=100, after=ctx.deep_cursor),
+    "get_indicators.zone": lambda db, ctx: crud.get_indicators(db, limit=100, zone_id=ctx.zone_id),
+    "get_indicators.zone_type": lambda db, ctx: crud.get_indicators(
+        db, limit=100, zone_id=ctx.zone_id, type=ctx.type),
+    "get_indicators.zone_type_week": lambda db, ctx: crud.get_indicators(
+        db, limit=1000, zone_id=ctx.zone_id, type=ctx.type, from_date=ctx.range[0], to_date=ctx.range[1]),
+    "get_indicator_stats": lambda db, ctx: crud.get_indicator_stats(db, zone_id=ctx.zone_id, type=ctx.type),
+    "create_indicator": _create_indicator,
+    "ingest.duplicates_1000": lambda db, ctx: _ingest(db, ctx.existing),
+    "ingest.new_1000": lambda db, ctx: _ingest(db, _new_rows(ctx)),
+    # Ce que fait FastAPI avec response_model : validation des objets ORM puis sérialisation
+    "serialize.pydantic_1000": lambda db, ctx: INDICATOR_LIST.dump_json(
+        INDICATOR_LIST.validate_python(ctx.objects, from_attributes=True)),
+    "serialize.fast_1000": lambda db, ctx: utils.json_bytes(ctx.records),
+}
+
+
+def cleanup(db):
+    """Retire les relevés écrits par create_indicator (avec leurs agrégats et leur ligne indicator_latest)."""
+    for model in (models.Indicator, models.IndicatorRollupHourly, models.IndicatorRollupDaily,
+                  models.IndicatorLatest):
+        db.query(model).filter(model.type == "bench_write").delete(synchronize_session=False)
+    db.commit()
+
+
+def measure(case, Session, ctx: Context, repeat: int, warmup: int = 1):
+    timings = []
+    db = Session()
+    try:
+        for run in range(warmup + repeat):
+            db.expire_all()
+            started = time.perf_counter()
+            case(db, ctx)
+            if run >= warmup:
+                timings.append(time.perf_counter() - started)
+    finally:
+        db.close()
+    timings.sort()
+    return {
+        "runs": len(timings),
+        "min_ms": timings[0] * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[int(0.95 * (len(timings) - 1))] * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+    }
+
+
+# --- Exécution, enregistrement, comparaison ---
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=HERE).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def run_suite(name: str, repeat: int, only: str = None, data_dir: str = DATA_DIR):
+    engine, Session = dataset_engine(name, data_dir)
+    db = Session()
+    ctx = Context(db, DATASETS[name])
+    db.close()
+
+    results = {}
+    try:
+        for case_name, case in CASES.items():
+            if only and only not in case_name:
+                continue
+            results[case_name] = measure(case, Session, ctx, repeat)
+            print(f"  {case_name:32s} médiane {results[case_name]['median_ms']:9.3f} ms | "
+                  f"p95 {results[case_name]['p95_ms']:9.3f} ms")
+    finally:
+        db = Session()
+        cleanup(db)
+        db.close()
+        engine.dispose()
+    return {
+        "dataset": name,
+        "rows": DATASETS[name],
+        "seed": SEED,
+        "repeat": repeat,
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def save(run: dict, output_dir: str = RESULTS_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = run["started_at"].replace("-", "").replace(":", "").replace("T", "-")
+    path = os.path.join(output_dir, f"{run['dataset']}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    return path
+
+
+def compare(run: dict, baseline: dict, threshold: float):
+    """Affiche l'évolution des médianes ; renvoie la liste des cas plus lents que baseline * (1 + threshold)."""
+    if baseline.get("dataset") != run["dataset"]:
+        print(f"Attention : référence sur le jeu {baseline.get('dataset')}, exécution sur {run['dataset']}")
+    regressions = []
+    print(f"\nComparaison avec la référence ({baseline.get('environment', {}).get('git_commit')}, "
+          f"{baseline.get('started_at')}) :")
+    for case_name, result in run["results"].items():
+        reference = baseline.get("results", {}).get(case_name)
+        if reference is None:
+            print(f"  {case_name:32s} (nouveau cas)")
+            continue
+        ratio = result["median_ms"] / reference["median_ms"] if reference["median_ms"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- RÉGRESSION"
+            regressions.append(case_name)
+        print(f"  {case_name:32s} {reference['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms "
+              f"(x{ratio:.2f}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks des chemins critiques (crud, ingestion, JSON)")
+    parser.add_argument("--dataset", action="append", choices=list(DATASETS),
+                        help="Jeu(x) de données (défaut : 10k)")
+    parser.add_argument("--repeat", type=int, default=20, help="Mesures par cas")
+    parser.add_argument("--only", help="Ne lance que les cas dont le nom contient cette chaîne")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Dossier des bases générées")
+    parser.add_argument("--output-dir", default=RESULTS_DIR, help="Dossier des résultats JSON")
+    parser.add_argument("--baseline", help="Résultats JSON d'une exécution de référence")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Ralentissement toléré avant de signaler une régression (0.10 = +10 %%)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    for name in args.dataset or ["10k"]:
+        print(f"\n== Jeu de données {name} ({DATASETS[name]} relevés) ==")
+        run = run_suite(name, args.repeat, only=args.only, data_dir=args.data_dir)
+        print(f"Résultats enregistrés dans {save(run, args.output_dir)}")
+        if baseline is not None:
+            regressions += compare(run, baseline, args.threshold)
+
+    if regressions:
+        print(f"\n{len(regressions)} régression(s) : {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
+import argparse
+import asyncio
+import httpx
 import requests
+import time
+from collections import defaultdict
 from datetime import datetime
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, engine
-from app import models
+from app import models, crud
 
 # Initialisation de la BDD (crée les tables si elles n'existent pas encore)
 models.Base.metadata.create_all(bind=engine)
+# Index unique (zone_id, type, timestamp) requis par ON CONFLICT, ajouté si la base est antérieure
+crud.ensure_indicator_indexes(engine)
 
 # DOCUMENTATION DES SOURCES (Livrable PDF)
 
@@ -24,149 +31,290 @@ models.Base.metadata.create_all(bind=engine)
 # - Fréquence : Temps réel (toutes les 15-30 min)
 # - Limitation : API publique, nécessite un filtrage précis par région.
 
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+ODRE_URL = "https://odre.opendatasoft.com/api/records/1.0/search/"
 
-def get_or_create_zone(db: Session, name: str):
+# Zone par défaut (mode historique, sans --all-zones)
+PARIS = {"name": "Paris", "latitude": 48.8566, "longitude": 2.3522, "region": "Île-de-France"}
+
+# Mode multi-zones : requêtes simultanées maximum par source, et nouvelles tentatives
+SOURCE_CONCURRENCY = {"open-meteo": 8, "odre": 4}
+SOURCE_TYPES = {"open-meteo": "temperature", "odre": "electricity_consumption"}
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1.0
+
+def get_or_create_zone(db: Session, name: str, latitude: float = None, longitude: float = None, region: str = None):
     """Récupère une zone par son nom ou la crée si elle n'existe pas."""
     zone = db.query(models.Zone).filter(models.Zone.name == name).first()
     if not zone:
         print(f"ℹ️ Création de la zone : {name}")
         # Code postal fixe pour l'exemple
-        zone = models.Zone(name=name, postal_code="75000", country="France")
+        zone = models.Zone(
+            name=name, postal_code="75000", country="France",
+            latitude=latitude, longitude=longitude, region=region
+        )
         db.add(zone)
         db.commit()
         db.refresh(zone)
     return zone
 
+# --- PARAMÈTRES ET PARSING (partagés entre mode simple et mode multi-zones) ---
+
+def weather_params(lat: float, lon: float):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "hourly": "temperature_2m",
+        "past_days": 7
+    }
+
+def parse_weather_rows(data: dict, zone_id: int):
+    """Transforme une réponse Open-Meteo en lignes prêtes pour l'insertion."""
+    hourly = data.get("hourly", {})
+    times = hourly.get("time", [])
+    values = hourly.get("temperature_2m", [])
+
+    rows = []
+    for t_str, val in zip(times, values):
+        if val is None: continue
+
+        # Format OpenMeteo : "2023-11-21T00:00"
+        t_obj = datetime.fromisoformat(t_str)
+        rows.append({
+            "type": "temperature",
+            "value": val,
+            "unit": "°C",
+            "timestamp": t_obj,
+            "zone_id": zone_id
+        })
+    return rows
+
+def energy_params(region: str):
+    return {
+        "dataset": "eco2mix-regional-tr",
+        "q": "",
+        "rows": 50,  # On récupère les 50 derniers points
+        "sort": "-date_heure",
+        "refine.libelle_region": region
+    }
+
+def parse_energy_rows(data: dict, zone_id: int):
+    """Transforme une réponse ODRÉ en lignes prêtes pour l'insertion."""
+    rows = []
+    for record in data.get("records", []):
+        fields = record.get("fields", {})
+        consommation = fields.get("consommation") # En MW
+        date_str = fields.get("date_heure") # Format ISO 8601
+
+        if consommation is None or date_str is None:
+            continue
+
+        # Conversion date (Gère le format ISO complet avec timezone)
+        try:
+            t_obj = datetime.fromisoformat(date_str)
+        except ValueError:
+            continue
+
+        rows.append({
+            "type": "electricity_consumption",
+            "value": consommation,
+            "unit": "MW",
+            "timestamp": t_obj,
+            "zone_id": zone_id
+        })
+    return rows
+
+# --- BILAN D'EXÉCUTION (compteurs exposés par GET /metrics) ---
+
+def record_run(db: Session, source: str, zone_ids: list, rows: list, inserted: list, started: float):
+    """Ajoute le bilan d'une exécution réussie aux compteurs de chaque zone (même transaction que l'insertion)."""
+    duration_ms = (time.perf_counter() - started) * 1000
+    fetched, added = defaultdict(int), defaultdict(int)
+    for row in rows:
+        fetched[row["zone_id"]] += 1
+    for row in inserted:
+        added[row.zone_id] += 1
+    for zone_id in zone_ids:
+        crud.record_ingestion_run(db, zone_id, source, SOURCE_TYPES[source],
+                                  fetched[zone_id], added[zone_id], duration_ms)
+
+def record_failure(db: Session, source: str, zone_ids: list, started: float):
+    """Compte un échec pour chaque zone concernée (transaction séparée, après le rollback)."""
+    duration_ms = (time.perf_counter() - started) * 1000
+    try:
+        for zone_id in zone_ids:
+            crud.record_ingestion_run(db, zone_id, source, SOURCE_TYPES[source], duration_ms=duration_ms, failed=True)
+        db.commit()
+    except Exception:
+        db.rollback()
+
+# --- MODE SIMPLE (une zone, appels bloquants) ---
+
 def ingest_weather_data(db: Session, zone_id: int, lat: float, lon: float):
     """
     SOURCE 1: Open-Meteo
     Récupère l'historique température sur 7 jours.
     """
     print("☁️ Récupération Météo (Source: Open-Meteo)...")
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "hourly": "temperature_2m",
-        "past_days": 7
-    }
+    started = time.perf_counter()
     
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(OPEN_METEO_URL, params=weather_params(lat, lon))
         response.raise_for_status()
-        data = response.json()
-        
-        hourly = data.get("hourly", {})
-        times = hourly.get("time", [])
-        values = hourly.get("temperature_2m", [])
-        
-        count = 0
-        for t_str, val in zip(times, values):
-            if val is None: continue
-            
-            # Format OpenMeteo : "2023-11-21T00:00"
-            t_obj = datetime.fromisoformat(t_str)
-            
-            # Vérification doublon pour ne pas insérer deux fois la même donnée
-            exists = db.query(models.Indicator).filter(
-                models.Indicator.zone_id == zone_id,
-                models.Indicator.type == "temperature",
-                models.Indicator.timestamp == t_obj
-            ).first()
-            
-            if not exists:
-                indicator = models.Indicator(
-                    type="temperature",
-                    value=val,
-                    unit="°C",
-                    timestamp=t_obj,
-                    zone_id=zone_id
-                )
-                db.add(indicator)
-                count += 1
+        rows = parse_weather_rows(response.json(), zone_id)
         
+        # Une seule instruction pour tout le lot : les doublons sont ignorés par la base
+        inserted = crud.bulk_insert_indicators(db, rows)
+        record_run(db, "open-meteo", [zone_id], rows, inserted, started)
+        count = len(inserted)
         db.commit()
         print(f"Succès Météo : {count} relevés ajoutés.")
         
     except Exception as e:
+        db.rollback()
+        record_failure(db, "open-meteo", [zone_id], started)
         print(f"Erreur Météo : {e}")
 
-def ingest_energy_data(db: Session, zone_id: int):
+def ingest_energy_data(db: Session, zone_id: int, region: str = PARIS["region"]):
     """
     SOURCE 2: ODRÉ (Eco2Mix Régional)
-    Récupère la consommation électrique en temps réel pour l'Île-de-France.
+    Récupère la consommation électrique en temps réel pour une région (Île-de-France par défaut).
     """
     print("⚡ Récupération Énergie (Source: ODRÉ / RTE)...")
-    url = "https://odre.opendatasoft.com/api/records/1.0/search/"
-    
-    # On filtre sur "Île-de-France" pour correspondre à notre zone Paris
-    params = {
-        "dataset": "eco2mix-regional-tr",
-        "q": "",
-        "rows": 50,  # On récupère les 50 derniers points
-        "sort": "-date_heure",
-        "refine.libelle_region": "Île-de-France"
-    }
+    started = time.perf_counter()
     
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(ODRE_URL, params=energy_params(region))
         response.raise_for_status()
-        data = response.json()
-        records = data.get("records", [])
-        
-        count = 0
-        for record in records:
-            fields = record.get("fields", {})
-            consommation = fields.get("consommation") # En MW
-            date_str = fields.get("date_heure") # Format ISO 8601
-            
-            if consommation is None or date_str is None:
-                continue
-                
-            # Conversion date (Gère le format ISO complet avec timezone)
-            try:
-                t_obj = datetime.fromisoformat(date_str)
-            except ValueError:
-                continue
-
-            # Vérification doublon
-            exists = db.query(models.Indicator).filter(
-                models.Indicator.zone_id == zone_id,
-                models.Indicator.type == "electricity_consumption",
-                models.Indicator.timestamp == t_obj
-            ).first()
-
-            if not exists:
-                indicator = models.Indicator(
-                    type="electricity_consumption",
-                    value=consommation,
-                    unit="MW",
-                    timestamp=t_obj,
-                    zone_id=zone_id
-                )
-                db.add(indicator)
-                count += 1
+        rows = parse_energy_rows(response.json(), zone_id)
         
+        # Dédoublonnage ensembliste (ON CONFLICT DO NOTHING) au lieu d'une requête par relevé
+        inserted = crud.bulk_insert_indicators(db, rows)
+        record_run(db, "odre", [zone_id], rows, inserted, started)
+        count = len(inserted)
         db.commit()
         print(f"Succès Énergie : {count} relevés ajoutés.")
 
     except Exception as e:
+        db.rollback()
+        record_failure(db, "odre", [zone_id], started)
         print(f"Erreur Énergie : {e}")
 
+# --- MODE MULTI-ZONES (asynchrone, connexions HTTP mutualisées) ---
+
+class RetryableError(Exception):
+    """Réponse HTTP temporaire (429 / 5xx) qui mérite une nouvelle tentative."""
+
+async def fetch_json(client: httpx.AsyncClient, url: str, params: dict, semaphore: asyncio.Semaphore,
+                     retries: int = MAX_RETRIES, backoff: float = RETRY_BACKOFF_SECONDS):
+    """GET JSON avec limite de concurrence et nouvelles tentatives (backoff exponentiel)."""
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                response = await client.get(url, params=params)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableError(f"HTTP {response.status_code} sur {url}")
+            response.raise_for_status()
+            return response.json()
+        except (httpx.TransportError, RetryableError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+async def ingest_all_zones(db: Session, client: httpx.AsyncClient = None,
+                           backoff: float = RETRY_BACKOFF_SECONDS):
+    """
+    Ingestion de toutes les zones de la table zones, les deux sources en parallèle.
+    - Open-Meteo : une requête par zone ayant des coordonnées.
+    - ODRÉ : une requête par région, partagée entre les zones de cette région.
+    Les écritures restent séquentielles (une transaction par réponse reçue).
+    """
+    zones = db.query(models.Zone).all()
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=sum(SOURCE_CONCURRENCY.values()), max_keepalive_connections=20)
+        )
+    semaphores = {source: asyncio.Semaphore(limit) for source, limit in SOURCE_CONCURRENCY.items()}
+
+    # Chaque tâche renvoie (source, zones concernées, relevés, erreur, début) pour que les
+    # échecs de récupération soient aussi comptés par zone, avec la durée propre à la tâche
+    async def weather(zone):
+        started = time.perf_counter()
+        params = weather_params(zone.latitude, zone.longitude)
+        try:
+            data = await fetch_json(client, OPEN_METEO_URL, params, semaphores["open-meteo"], backoff=backoff)
+            return "open-meteo", [zone.id], parse_weather_rows(data, zone.id), None, started
+        except Exception as e:
+            return "open-meteo", [zone.id], [], e, started
+
+    async def energy(region, zone_ids):
+        started = time.perf_counter()
+        try:
+            data = await fetch_json(client, ODRE_URL, energy_params(region), semaphores["odre"], backoff=backoff)
+            rows = [row for zone_id in zone_ids for row in parse_energy_rows(data, zone_id)]
+            return "odre", zone_ids, rows, None, started
+        except Exception as e:
+            return "odre", zone_ids, [], e, started
+
+    zones_by_region = defaultdict(list)
+    tasks = []
+    for zone in zones:
+        if zone.latitude is not None and zone.longitude is not None:
+            tasks.append(weather(zone))
+        if zone.region:
+            zones_by_region[zone.region].append(zone.id)
+    tasks += [energy(region, zone_ids) for region, zone_ids in zones_by_region.items()]
+
+    summary = {"weather": 0, "energy": 0, "errors": 0}
+    summary_keys = {"open-meteo": "weather", "odre": "energy"}
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            source, zone_ids, rows, error, started = await next_result
+            try:
+                if error is not None:
+                    raise error
+                inserted = crud.bulk_insert_indicators(db, rows)
+                record_run(db, source, zone_ids, rows, inserted, started)
+                db.commit()
+                summary[summary_keys[source]] += len(inserted)
+            except Exception as e:
+                db.rollback()
+                record_failure(db, source, zone_ids, started)
+                summary["errors"] += 1
+                print(f"Erreur ingestion : {e}")
+    finally:
+        if own_client:
+            await client.aclose()
+
+    print(f"Succès multi-zones ({len(zones)} zones) : {summary['weather']} relevés météo, "
+          f"{summary['energy']} relevés énergie, {summary['errors']} erreurs.")
+    return summary
+
 def main():
+    parser = argparse.ArgumentParser(description="Ingestion des données Open-Meteo et ODRÉ")
+    parser.add_argument("--all-zones", action="store_true",
+                        help="Ingère toutes les zones de la base en parallèle (au lieu de Paris seul)")
+    args = parser.parse_args()
+
     db = SessionLocal()
     try:
+        if args.all_zones:
+            asyncio.run(ingest_all_zones(db))
+            return
+
         # 1. On définit Paris (Latitude: 48.8566, Longitude: 2.3522)
-        paris = get_or_create_zone(db, "Paris")
+        paris = get_or_create_zone(db, PARIS["name"], PARIS["latitude"], PARIS["longitude"], PARIS["region"])
         
         # 2. Source 1 : Météo (Nécessite Lat/Lon)
-        ingest_weather_data(db, paris.id, 48.8566, 2.3522)
+        ingest_weather_data(db, paris.id, PARIS["latitude"], PARIS["longitude"])
         
         # 3. Source 2 : Énergie (Nécessite juste l'ID de la zone pour lier les données)
-        ingest_energy_data(db, paris.id)
+        ingest_energy_data(db, paris.id, PARIS["region"])
         
     finally:
         db.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from collections import defaultdict
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app import models, crud
+import ingest_data
+
+# ORDONNANCEUR D'INGESTION INCRÉMENTALE
+# Processus long qui interroge chaque source à son propre rythme et ne demande
+# que les données postérieures au dernier relevé déjà ingéré (high-water mark),
+# mémorisé par (zone, source, type) dans la table ingestion_watermarks.
+#
+# Lancement : python ingest_scheduler.py            (boucle infinie)
+#             python ingest_scheduler.py --once     (une seule passe, ex: cron)
+
+# Intervalles par défaut entre deux passes (secondes)
+DEFAULT_INTERVALS = {"open-meteo": 3600, "odre": 900}
+
+# Historique récupéré lors de la toute première passe d'une zone
+INITIAL_LOOKBACK = timedelta(days=7)
+
+# ODRÉ : taille de page et nombre maximum de pages par région et par passe
+ODRE_PAGE_SIZE = 100
+ODRE_MAX_PAGES = 20
+
+SOURCE_TYPES = ingest_data.SOURCE_TYPES
+
+
+@dataclass
+class RunStats:
+    """Bilan de la dernière passe d'une source."""
+    source: str
+    started_at: Optional[str] = None
+    duration_ms: float = 0.0
+    rows_fetched: int = 0
+    rows_inserted: int = 0
+    errors: int = 0
+    runs: int = 0
+
+
+@dataclass
+class ZoneResult:
+    zone_id: int
+    rows: list = field(default_factory=list)
+
+
+def get_watermark(db: Session, zone_id: int, source: str):
+    """Renvoie (en la créant si besoin) la ligne de watermark d'une zone pour une source."""
+    return crud.get_ingestion_watermark(db, zone_id, source, SOURCE_TYPES[source])
+
+
+def since(watermark: models.IngestionWatermark, now: datetime):
+    """Début de la fenêtre à demander : juste après le dernier relevé connu."""
+    return watermark.high_water_mark or (now - INITIAL_LOOKBACK)
+
+
+def weather_params_since(lat: float, lon: float, start: datetime, end: datetime):
+    """Paramètres Open-Meteo limités à [start, end] (heures, UTC), sans prévisions futures."""
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "hourly": "temperature_2m",
+        "start_hour": start.strftime("%Y-%m-%dT%H:%M"),
+        "end_hour": end.strftime("%Y-%m-%dT%H:%M"),
+    }
+
+
+def energy_params_since(region: str, start: datetime, offset: int = 0):
+    """Paramètres ODRÉ filtrés sur les relevés postérieurs à start, page par page."""
+    params = ingest_data.energy_params(region)
+    params.update({
+        "q": f"date_heure > \"{start.strftime('%Y-%m-%dT%H:%M:%S')}Z\"",
+        "rows": ODRE_PAGE_SIZE,
+        "start": offset,
+    })
+    return params
+
+
+async def fetch_weather(client, semaphore, zone, start: datetime, end: datetime, backoff: float):
+    """Relevés Open-Meteo d'une zone postérieurs à start (exclu)."""
+    params = weather_params_since(zone.latitude, zone.longitude, start + timedelta(hours=1), end)
+    data = await ingest_data.fetch_json(client, ingest_data.OPEN_METEO_URL, params, semaphore, backoff=backoff)
+    return [row for row in ingest_data.parse_weather_rows(data, zone.id) if row["timestamp"] > start]
+
+
+async def fetch_energy(client, semaphore, region: str, start: datetime, backoff: float):
+    """Enregistrements ODRÉ bruts d'une région postérieurs à start, toutes pages confondues."""
+    records = []
+    for page in range(ODRE_MAX_PAGES):
+        params = energy_params_since(region, start, offset=page * ODRE_PAGE_SIZE)
+        data = await ingest_data.fetch_json(client, ingest_data.ODRE_URL, params, semaphore, backoff=backoff)
+        batch = data.get("records", [])
+        records += batch
+        if len(batch) < ODRE_PAGE_SIZE or len(records) >= data.get("nhits", 0):
+            break
+    return {"records": records}
+
+
+def store(db: Session, source: str, zone_id: int, rows: list, started: float, stats: RunStats):
+    """Insère les relevés d'une zone et avance son watermark dans la même transaction."""
+    watermark = get_watermark(db, zone_id, source)
+    # bulk_insert_indicators normalise les horodatages en UTC naïf (utilisés ensuite pour le watermark)
+    inserted = crud.bulk_insert_indicators(db, rows)
+    if rows:
+        newest = max(row["timestamp"] for row in rows)
+        if watermark.high_water_mark is None or newest > watermark.high_water_mark:
+            watermark.high_water_mark = newest
+    crud.record_ingestion_run(db, zone_id, source, SOURCE_TYPES[source], len(rows), len(inserted),
+                              (time.perf_counter() - started) * 1000)
+    db.commit()
+
+    stats.rows_fetched += len(rows)
+    stats.rows_inserted += len(inserted)
+
+
+async def run_weather(db: Session, client: httpx.AsyncClient, backoff: float = ingest_data.RETRY_BACKOFF_SECONDS):
+    """Une passe Open-Meteo sur toutes les zones ayant des coordonnées."""
+    stats = RunStats(source="open-meteo", started_at=datetime.utcnow().isoformat())
+    started = time.perf_counter()
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    semaphore = asyncio.Semaphore(ingest_data.SOURCE_CONCURRENCY["open-meteo"])
+
+    zones = db.query(models.Zone).filter(
+        models.Zone.latitude.isnot(None), models.Zone.longitude.isnot(None)
+    ).all()
+    marks = {zone.id: since(get_watermark(db, zone.id, "open-meteo"), now) for zone in zones}
+    db.commit()
+
+    async def one_zone(zone):
+        start = marks[zone.id]
+        if start >= now:
+            return ZoneResult(zone.id)
+        return ZoneResult(zone.id, await fetch_weather(client, semaphore, zone, start, now, backoff))
+
+    for next_result in asyncio.as_completed([one_zone(zone) for zone in zones]):
+        try:
+            result = await next_result
+            store(db, "open-meteo", result.zone_id, result.rows, started, stats)
+        except Exception as e:
+            db.rollback()
+            stats.errors += 1
+            print(f"Erreur Météo : {e}")
+
+    stats.duration_ms = (time.perf_counter() - started) * 1000
+    return stats
+
+
+async def run_energy(db: Session, client: httpx.AsyncClient, backoff: float = ingest_data.RETRY_BACKOFF_SECONDS):
+    """Une passe ODRÉ : une requête (paginée) par région, répartie ensuite sur ses zones."""
+    stats = RunStats(source="odre", started_at=datetime.utcnow().isoformat())
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    semaphore = asyncio.Semaphore(ingest_data.SOURCE_CONCURRENCY["odre"])
+
+    marks_by_region = defaultdict(dict)
+    for zone in db.query(models.Zone).filter(models.Zone.region.isnot(None)).all():
+        marks_by_region[zone.region][zone.id] = since(get_watermark(db, zone.id, "odre"), now)
+    db.commit()
+
+    async def one_region(region, marks):
+        # On demande à partir du plus ancien watermark de la région
+        data = await fetch_energy(client, semaphore, region, min(marks.values()), backoff)
+        return [
+            ZoneResult(zone_id, [
+                row for row in ingest_data.parse_energy_rows(data, zone_id)
+                if crud.naive_utc(row["timestamp"]) > mark
+            ])
+            for zone_id, mark in marks.items()
+        ]
+
+    tasks = [one_region(region, marks) for region, marks in marks_by_region.items()]
+    for next_result in asyncio.as_completed(tasks):
+        try:
+            for result in await next_result:
+                store(db, "odre", result.zone_id, result.rows, started, stats)
+        except Exception as e:
+            db.rollback()
+            stats.errors += 1
+            print(f"Erreur Énergie : {e}")
+
+    stats.duration_ms = (time.perf_counter() - started) * 1000
+    return stats
+
+
+SOURCES = {"open-meteo": run_weather, "odre": run_energy}
+
+
+class Scheduler:
+    """Lance chaque source à son propre intervalle et conserve le bilan de la dernière passe."""
+
+    def __init__(self, intervals: dict = None, status_file: str = None, client: httpx.AsyncClient = None,
+                 session_factory=SessionLocal):
+        self.intervals = intervals or dict(DEFAULT_INTERVALS)
+        self.status_file = status_file
+        self.client = client
+        self.session_factory = session_factory
+        self.last_runs = {source: RunStats(source=source) for source in self.intervals}
+
+    async def run_source(self, source: str):
+        db = self.session_factory()
+        try:
+            stats = await SOURCES[source](db, self.client)
+        finally:
+            db.close()
+        stats.runs = self.last_runs[source].runs + 1
+        self.last_runs[source] = stats
+        print(f"[{source}] {stats.rows_fetched} relevés récupérés, {stats.rows_inserted} insérés, "
+              f"{stats.errors} erreurs en {stats.duration_ms:.0f} ms")
+        self.write_status()
+        return stats
+
+    def write_status(self):
+        if self.status_file:
+            with open(self.status_file, "w") as f:
+                json.dump({source: asdict(stats) for source, stats in self.last_runs.items()}, f, indent=2)
+
+    async def loop(self, source: str):
+        while True:
+            try:
+                await self.run_source(source)
+            except Exception as e:
+                print(f"[{source}] Passe interrompue : {e}")
+            await asyncio.sleep(self.intervals[source])
+
+    async def run(self, once: bool = False):
+        own_client = self.client is None
+        if own_client:
+            self.client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=sum(ingest_data.SOURCE_CONCURRENCY.values()))
+            )
+        try:
+            if once:
+                await asyncio.gather(*(self.run_source(source) for source in self.intervals))
+            else:
+                await asyncio.gather(*(self.loop(source) for source in self.intervals))
+        finally:
+            if own_client:
+                await self.client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ordonnanceur d'ingestion incrémentale")
+    parser.add_argument("--weather-interval", type=int, default=DEFAULT_INTERVALS["open-meteo"],
+                        help="Secondes entre deux passes Open-Meteo")
+    parser.add_argument("--energy-interval", type=int, default=DEFAULT_INTERVALS["odre"],
+                        help="Secondes entre deux passes ODRÉ")
+    parser.add_argument("--status-file", help="Fichier JSON où écrire le bilan de la dernière passe")
+    parser.add_argument("--once", action="store_true", help="Une seule passe par source puis arrêt")
+    args = parser.parse_args()
+
+    scheduler = Scheduler(
+        intervals={"open-meteo": args.weather_interval, "odre": args.energy_interval},
+        status_file=args.status_file,
+    )
+    try:
+        asyncio.run(scheduler.run(once=args.once))
+    except KeyboardInterrupt:
+        print("Arrêt de l'ordonnanceur.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,293 @@
-import requests
+import argparse
+import asyncio
+import json
+import math
 import random
 import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import httpx
+
+# --- GÉNÉRATEUR DE CHARGE ---
+# Simule de nombreux utilisateurs sur de nombreuses zones, en boucle ouverte :
+# les requêtes arrivent selon un processus de Poisson au débit demandé (--rate),
+# qu'elles soient servies rapidement ou non. Une API saturée voit donc sa latence
+# grimper, comme en production, au lieu de ralentir le générateur.
+# Les latences sont mesurées depuis l'instant d'arrivée prévu (file d'attente comprise).
+#
+#   python populate_data.py                                   # API sur http://127.0.0.1:8000
+#   python populate_data.py --rate 200 --duration 30 --users 50 --zones 20
+#   python populate_data.py --in-process --rate 100           # application ASGI en mémoire, sans réseau
+#   python populate_data.py --mix list=60,stats=20,batch=15,login=5 --report resultats.json
 
-# --- CONFIGURATION ---
 API_URL = "http://127.0.0.1:8000"
 
-# Utilise ton compte Admin (matisse@test.com / Miam)
+# Compte Admin (matisse@test.com / Miam) : crée les zones et envoie les lots
 EMAIL = "matisse@test.com"
 PASSWORD = "Miam"
 
-def get_token():
-    """Récupère le token JWT"""
-    print(f"🔑 Connexion en tant que {EMAIL}...")
-    try:
-        response = requests.post(
-            f"{API_URL}/auth/login", 
-            data={"username": EMAIL, "password": PASSWORD}
-        )
-        if response.status_code == 200:
-            return response.json()["access_token"]
-        else:
-            print(f"❌ Erreur Auth : {response.status_code} - {response.text}")
-            print("👉 Vérifie que l'utilisateur existe et qu'il est ADMIN.")
-            exit()
-    except Exception as e:
-        print(f"❌ Impossible de joindre l'API ({API_URL}). Vérifie qu'elle tourne !")
-        exit()
-
-def ensure_zones_exist(token):
-    """Vérifie et crée les zones Lyon et Marseille si besoin"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    # Liste des zones à avoir
-    target_zones = [
-        {"name": "Paris", "postal_code": "75000", "country": "France"},
-        {"name": "Lyon", "postal_code": "69000", "country": "France"},
-        {"name": "Marseille", "postal_code": "13000", "country": "France"}
-    ]
-    
-    print("🌍 Vérification des zones...")
-    
-    valid_ids = []
-
-    for z_data in target_zones:
-        # On essaie de créer la zone
-        # Si elle existe déjà (doublon), l'API renverra probablement une erreur ou on peut lister avant.
-        # Pour faire simple : on crée, si erreur on suppose qu'elle existe.
-        
-        # 1. Création
-        resp = requests.post(f"{API_URL}/zones/", json=z_data, headers=headers)
-        
-        if resp.status_code in [200, 201]:
-            created_zone = resp.json()
-            print(f"   ✅ Zone créée : {created_zone['name']} (ID: {created_zone['id']})")
-            valid_ids.append(created_zone['id'])
+USER_PASSWORD = "charge123"
+DEFAULT_MIX = "list=55,stats=20,zones=10,batch=10,login=5"
+
+# Types de données simulés
+INDICATORS = [
+    {"type": "temperature", "unit": "°C", "min": 15, "max": 30},
+    {"type": "electricity_consumption", "unit": "MW", "min": 200, "max": 800},
+    {"type": "air_quality_pm25", "unit": "µg/m³", "min": 5, "max": 60},
+]
+
+
+def parse_mix(mix: str):
+    """"list=55,stats=20" -> {"list": 55.0, "stats": 20.0}"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Opération inconnue : {name} (possibles : {', '.join(OPERATIONS)})")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, p: float):
+    """Percentile par rang le plus proche (valeurs déjà triées)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, users: int, zones: int, batch_size: int, seed: int = None):
+        self.client = client
+        self.user_count = users
+        self.zone_count = zones
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.admin_headers = {}
+        self.users = []        # (email, en-têtes d'authentification)
+        self.zone_ids = []
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.batch_clock = datetime.utcnow().replace(microsecond=0)
+
+    # --- Préparation : admin, utilisateurs simulés, zones ---
+
+    async def login(self, email: str, password: str):
+        response = await self.client.post("/auth/login", data={"username": email, "password": password})
+        if response.status_code != 200:
+            return None
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def setup(self, email: str, password: str):
+        print(f"🔑 Connexion en tant que {email}...")
+        self.admin_headers = await self.login(email, password)
+        if self.admin_headers is None:
+            # Base vierge (ex: --in-process) : on crée le compte admin
+            await self.client.post("/auth/register", json={"email": email, "password": password, "role": "admin"})
+            self.admin_headers = await self.login(email, password)
+        if self.admin_headers is None:
+            raise SystemExit("❌ Authentification admin impossible : vérifie le compte et qu'il est ADMIN.")
+
+        print(f"👥 Préparation de {self.user_count} utilisateurs simulés...")
+        await asyncio.gather(*(
+            self.client.post("/auth/register", json={"email": f"charge{i}@example.com", "password": USER_PASSWORD})
+            for i in range(self.user_count)
+        ))
+        tokens = await asyncio.gather(*(
+            self.login(f"charge{i}@example.com", USER_PASSWORD) for i in range(self.user_count)
+        ))
+        self.users = [(f"charge{i}@example.com", headers) for i, headers in enumerate(tokens) if headers]
+        if not self.users:
+            raise SystemExit("❌ Aucun utilisateur simulé n'a pu se connecter.")
+
+        print(f"🌍 Préparation de {self.zone_count} zones...")
+        existing = {}
+        cursor = None
+        while True:
+            params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+            response = await self.client.get("/zones/", params=params)
+            existing.update({zone["name"]: zone["id"] for zone in response.json()})
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        for i in range(self.zone_count):
+            name = f"Zone de charge {i}"
+            if name not in existing:
+                response = await self.client.post("/zones/", headers=self.admin_headers, json={
+                    "name": name, "postal_code": f"{i:05d}", "country": "France"
+                })
+                existing[name] = response.json()["id"]
+            self.zone_ids.append(existing[name])
+
+    # --- Opérations ---
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    async def op_login(self):
+        email, _ = self.user()
+        return await self.client.post("/auth/login", data={"username": email, "password": USER_PASSWORD})
+
+    async def op_list(self):
+        _, headers = self.user()
+        params = {"zone_id": self.rng.choice(self.zone_ids), "limit": 100}
+        return await self.client.get("/indicators/", params=params, headers=headers)
+
+    async def op_stats(self):
+        _, headers = self.user()
+        params = {"zone_id": self.rng.choice(self.zone_ids), "type": self.rng.choice(INDICATORS)["type"]}
+        return await self.client.get("/indicators/stats", params=params, headers=headers)
+
+    async def op_zones(self):
+        _, headers = self.user()
+        return await self.client.get("/zones/", headers=headers)
+
+    async def op_batch(self):
+        payload = []
+        for _ in range(self.batch_size):
+            ind = self.rng.choice(INDICATORS)
+            # Horodatages distincts d'un lot à l'autre pour éviter les doublons
+            self.batch_clock += timedelta(seconds=1)
+            payload.append({
+                "zone_id": self.rng.choice(self.zone_ids),
+                "type": ind["type"],
+                "value": round(self.rng.uniform(ind["min"], ind["max"]), 2),
+                "unit": ind["unit"],
+                "timestamp": self.batch_clock.isoformat(),
+            })
+        return await self.client.post("/indicators/batch", json=payload, headers=self.admin_headers)
+
+    # --- Boucle ouverte ---
+
+    async def fire(self, name: str, scheduled: float, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                response = await OPERATIONS[name](self)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+        self.statuses[name][status] += 1
+        if isinstance(status, int) and status < 400:
+            self.latencies[name].append(time.perf_counter() - scheduled)
         else:
-            # 2. Si échec, on suppose qu'elle existe et on essaie de récupérer son ID
-            # (Note: idéalement on ferait un GET /zones/ mais on fait simple ici)
-            # On triche un peu : on suppose que Paris=1, Lyon=2, Marseille=3 si l'ordre est respecté
-            pass
-
-    # Si la création échoue car "déjà existant", on récupère la liste complète pour avoir les vrais IDs
-    resp_all = requests.get(f"{API_URL}/zones/", headers=headers)
-    if resp_all.status_code == 200:
-        all_zones = resp_all.json()
-        print(f"   📋 Zones disponibles en base : {[z['name'] + ' (' + str(z['id']) + ')' for z in all_zones]}")
-        return [z['id'] for z in all_zones]
-    
-    return [1, 2, 3] # Fallback
-
-def generate():
-    token = get_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    # 1. S'assurer que les zones existent
-    available_zone_ids = ensure_zones_exist(token)
-    
-    if not available_zone_ids:
-        print("❌ Aucune zone disponible. Impossible de générer des données.")
-        return
-
-    # Types de données à simuler
-    indicators = [
-        {"type": "temperature", "unit": "°C", "min": 15, "max": 30},
-        {"type": "electricity_consumption", "unit": "MW", "min": 200, "max": 800},
-        {"type": "air_quality_pm25", "unit": "µg/m³", "min": 5, "max": 60}
-    ]
-
-    print("\n🚀 Génération des mesures...")
-
-    # On crée 60 mesures réparties sur les zones disponibles
-    for i in range(60):
-        # Choisir une zone existante au hasard
-        zone_id = random.choice(available_zone_ids)
-        ind = random.choice(indicators)
-        
-        valeur = round(random.uniform(ind["min"], ind["max"]), 2)
-        
-        payload = {
-            "zone_id": zone_id,
-            "type": ind["type"],
-            "value": valeur,
-            "unit": ind["unit"]
+            self.errors[name] += 1
+
+    async def run(self, rate: float, duration: float, mix: dict, max_in_flight: int):
+        names, weights = list(mix), list(mix.values())
+        semaphore = asyncio.Semaphore(max_in_flight)
+        tasks = []
+        start = time.perf_counter()
+        next_arrival = start
+        print(f"\n🚀 {rate:.0f} requêtes/s pendant {duration:.0f} s ({', '.join(f'{n}={w:g}' for n, w in mix.items())})")
+        while next_arrival - start < duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = self.rng.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(self.fire(name, next_arrival, semaphore)))
+            next_arrival += self.rng.expovariate(rate)
+        offered = len(tasks) / (time.perf_counter() - start)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start, len(tasks), offered
+
+    def report(self, elapsed: float, sent: int, offered: float, rate: float):
+        rows = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[name])
+            total = len(values) + self.errors[name]
+            rows[name] = {
+                "requests": total,
+                "errors": self.errors[name],
+                "error_rate": self.errors[name] / total if total else 0.0,
+                "throughput_rps": len(values) / elapsed,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": (values[-1] if values else 0.0) * 1000,
+                "statuses": {str(k): v for k, v in self.statuses[name].items()},
+            }
+        everything = sorted(v for values in self.latencies.values() for v in values)
+        errors = sum(self.errors.values())
+        summary = {
+            "target_rate_rps": rate,
+            "offered_rate_rps": offered,
+            "duration_s": elapsed,
+            "requests": sent,
+            "errors": errors,
+            "error_rate": errors / sent if sent else 0.0,
+            "throughput_rps": len(everything) / elapsed,
+            "p50_ms": percentile(everything, 50) * 1000,
+            "p95_ms": percentile(everything, 95) * 1000,
+            "p99_ms": percentile(everything, 99) * 1000,
         }
-        
+
+        print(f"\n{'opération':10s} {'requêtes':>9s} {'erreurs':>8s} {'req/s':>8s} "
+              f"{'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+        for name, row in list(rows.items()) + [("TOTAL", summary)]:
+            print(f"{name:10s} {row['requests']:9d} {row['error_rate']:7.1%} {row['throughput_rps']:8.1f} "
+                  f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}")
+        print(f"\nDébit offert : {summary['offered_rate_rps']:.1f} req/s (cible {rate:.0f}), "
+              f"servi : {summary['throughput_rps']:.1f} req/s")
+        return {"summary": summary, "operations": rows}
+
+
+OPERATIONS = {
+    "login": LoadTest.op_login,
+    "list": LoadTest.op_list,
+    "stats": LoadTest.op_stats,
+    "zones": LoadTest.op_zones,
+    "batch": LoadTest.op_batch,
+}
+
+
+def make_client(url: str, in_process: bool, timeout: float, max_in_flight: int):
+    if in_process:
+        # Import tardif : crée les tables de la base configurée (ECOTRACK_DATABASE_URL)
+        from app.main import app
+        transport = httpx.ASGITransport(app=app)
+        return httpx.AsyncClient(transport=transport, base_url="http://ecotrack.local", timeout=timeout)
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    return httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits)
+
+
+async def main_async(args):
+    async with make_client(args.url, args.in_process, args.timeout, args.max_in_flight) as client:
+        load = LoadTest(client, users=args.users, zones=args.zones, batch_size=args.batch_size, seed=args.seed)
         try:
-            resp = requests.post(f"{API_URL}/indicators/", json=payload, headers=headers)
-            if resp.status_code in [200, 201]:
-                print(f"   ✅ Ajout [Zone {zone_id}] : {valeur} {ind['unit']}")
-            else:
-                print(f"   ⚠️ Erreur API : {resp.status_code} - {resp.text}")
-        except Exception as e:
-            print(f"Erreur requête : {e}")
+            await load.setup(args.email, args.password)
+        except httpx.ConnectError:
+            raise SystemExit(f"❌ Impossible de joindre l'API ({args.url}). Vérifie qu'elle tourne, ou utilise --in-process.")
+        elapsed, sent, offered = await load.run(args.rate, args.duration, args.mix, args.max_in_flight)
+        result = load.report(elapsed, sent, offered, args.rate)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Rapport enregistré dans {args.report}")
 
-    print("\n✨ Terminé ! Retourne sur ton Dashboard et clique sur 'Actualiser les données'.")
 
-if __name__ == "__main__":
-    generate()
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de charge (boucle ouverte) pour l'API EcoTrack")
+    parser.add_argument("--url", default=API_URL, help="URL de l'API")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Cible l'application ASGI en mémoire (sans réseau ni serveur)")
+    parser.add_argument("--rate", type=float, default=50, help="Arrivées par seconde (processus de Poisson)")
+    parser.add_argument("--duration", type=float, default=10, help="Durée de la charge (secondes)")
+    parser.add_argument("--users", type=int, default=20, help="Utilisateurs simulés")
+    parser.add_argument("--zones", type=int, default=10, help="Zones simulées")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Poids des opérations (défaut : {DEFAULT_MIX})")
+    parser.add_argument("--batch-size", type=int, default=60, help="Relevés par POST /indicators/batch")
+    parser.add_argument("--max-in-flight", type=int, default=500,
+                        help="Requêtes simultanées au maximum (au-delà, elles attendent côté client)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout par requête (secondes)")
+    parser.add_argument("--email", default=EMAIL, help="Compte admin")
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--seed", type=int, help="Graine aléatoire (exécutions reproductibles)")
+    parser.add_argument("--report", help="Fichier JSON où écrire les résultats")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import shutil
+import tempfile
+import pytest
+
+# BDD de test partagée par test_main.py et test_ingest.py : un fichier neuf par session,
+# dans un dossier temporaire. Les tests créent des zones et utilisateurs à noms fixes :
+# la suite peut ainsi être relancée sans conflit d'unicité.
+# Exécuté avant l'import des modules de test, qui créent leurs moteurs au chargement.
+TEST_DB_DIR = tempfile.mkdtemp(prefix="ecotrack-tests-")
+os.environ["ECOTRACK_TEST_DB_PATH"] = os.path.join(TEST_DB_DIR, "test.db")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _remove_test_database():
+    yield
+    shutil.rmtree(TEST_DB_DIR, ignore_errors=True)
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import httpx
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app import models, crud, rollups
+import ingest_data
+import ingest_scheduler
+
+# Même BDD de test que test_main.py (fichier temporaire, voir conftest.py)
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.environ.get('ECOTRACK_TEST_DB_PATH', './test.db')}"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+class FakeResponse:
+    """Réponse HTTP minimale pour remplacer requests.get dans les tests."""
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+WEATHER_PAYLOAD = {
+    "hourly": {
+        "time": [f"2024-02-01T{hour:02d}:00" for hour in range(24)],
+        "temperature_2m": [float(hour) for hour in range(23)] + [None],
+    }
+}
+
+ENERGY_PAYLOAD = {
+    "records": [
+        {"fields": {"consommation": 8000 + i, "date_heure": f"2024-02-01T{i:02d}:00:00+01:00"}}
+        for i in range(10)
+    ]
+}
+
+
+def test_ingest_weather_is_idempotent(monkeypatch):
+    """Test: Une ré-ingestion n'insère aucun doublon"""
+    monkeypatch.setattr(ingest_data.requests, "get", lambda url, params: FakeResponse(WEATHER_PAYLOAD))
+    db = TestingSessionLocal()
+    zone = ingest_data.get_or_create_zone(db, "Ingest Weather Zone")
+
+    ingest_data.ingest_weather_data(db, zone.id, 48.85, 2.35)
+    ingest_data.ingest_weather_data(db, zone.id, 48.85, 2.35)
+
+    count = db.query(models.Indicator).filter(
+        models.Indicator.zone_id == zone.id, models.Indicator.type == "temperature"
+    ).count()
+    assert count == 23
+    db.close()
+
+
+def test_ingest_energy_is_idempotent(monkeypatch):
+    """Test: Les horodatages avec fuseau sont stockés en UTC et dédoublonnés"""
+    monkeypatch.setattr(ingest_data.requests, "get", lambda url, params: FakeResponse(ENERGY_PAYLOAD))
+    db = TestingSessionLocal()
+    zone = ingest_data.get_or_create_zone(db, "Ingest Energy Zone")
+
+    ingest_data.ingest_energy_data(db, zone.id)
+    ingest_data.ingest_energy_data(db, zone.id)
+
+    rows = db.query(models.Indicator).filter(
+        models.Indicator.zone_id == zone.id, models.Indicator.type == "electricity_consumption"
+    ).order_by(models.Indicator.timestamp).all()
+    assert len(rows) == 10
+    assert rows[1].timestamp.isoformat() == "2024-02-01T00:00:00"
+    db.close()
+
+
+def test_indexes_added_to_existing_database(tmp_path, caplog):
+    """Test: Une base créée avant l'index unique le reçoit au démarrage, doublons supprimés et agrégats recalculés"""
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=old)
+    insert = text("INSERT INTO indicators (type, value, unit, timestamp, zone_id) VALUES ('old', :value, 'u', :timestamp, 1)")
+    with old.begin() as conn:
+        for index in models.Indicator.__table__.indexes:
+            conn.execute(text(f"DROP INDEX {index.name}"))
+        for value in (1.0, 2.0):
+            conn.execute(insert, {"value": value, "timestamp": "2024-01-01 00:00:00.000000"})
+    db = sessionmaker(bind=old)()
+    rollups.rebuild(db)
+    db.close()
+    with old.begin() as conn:
+        # Horodatage NULL : l'index unique ne les considère pas comme des doublons
+        for value in (3.0, 4.0):
+            conn.execute(insert, {"value": value, "timestamp": None})
+
+    with caplog.at_level("WARNING", logger="ecotrack.crud"):
+        crud.ensure_indicator_indexes(old)
+        crud.ensure_indicator_indexes(old)  # idempotent
+    assert [record.getMessage() for record in caplog.records if "double" in record.getMessage()] == [
+        "Index unique (zone_id, type, timestamp) : 1 relevés en double supprimés (1 clés), agrégats recalculés"
+    ]
+
+    names = {index["name"] for index in inspect(old).get_indexes("indicators")}
+    assert names == {index.name for index in models.Indicator.__table__.indexes}
+    with old.connect() as conn:
+        assert conn.execute(text("SELECT value FROM indicators ORDER BY id")).scalars().all() == [1.0, 3.0, 4.0]
+        assert conn.execute(text("SELECT count, sum FROM indicator_rollups_hourly")).all() == [(1, 1.0)]
+        assert conn.execute(text("SELECT value FROM indicator_latest")).scalars().all() == [1.0]
+    old.dispose()
+
+
+def test_ingest_all_zones_with_stub_server():
+    """Test: Ingestion multi-zones asynchrone contre un serveur factice (Open-Meteo + ODRÉ)"""
+    calls = {"open-meteo": 0, "odre": 0}
+
+    def stub_server(request: httpx.Request):
+        if request.url.host == "api.open-meteo.com":
+            calls["open-meteo"] += 1
+            return httpx.Response(200, json=WEATHER_PAYLOAD)
+        calls["odre"] += 1
+        assert request.url.params["refine.libelle_region"] == "Stub Region"
+        # Première réponse en erreur temporaire : doit être retentée
+        if calls["odre"] == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json=ENERGY_PAYLOAD)
+
+    db = TestingSessionLocal()
+    north = ingest_data.get_or_create_zone(db, "Stub North", 50.6, 3.0, "Stub Region")
+    south = ingest_data.get_or_create_zone(db, "Stub South", None, None, "Stub Region")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(stub_server))
+    summary = asyncio.run(ingest_data.ingest_all_zones(db, client=client, backoff=0))
+    asyncio.run(client.aclose())
+
+    assert summary["errors"] == 0
+    assert calls["odre"] == 2  # une seule région (+ une nouvelle tentative)
+    for zone, expected_types in [(north, {"temperature", "electricity_consumption"}),
+                                 (south, {"electricity_consumption"})]:
+        types = {t for (t,) in db.query(models.Indicator.type).filter(models.Indicator.zone_id == zone.id).distinct()}
+        assert types == expected_types
+    db.close()
+
+
+def test_scheduler_only_requests_new_data():
+    """Test: L'ordonnanceur avance le watermark et ne redemande pas les données déjà ingérées"""
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    requests_seen = {"open-meteo": [], "odre": []}
+
+    def stub_server(request: httpx.Request):
+        params = request.url.params
+        if request.url.host == "api.open-meteo.com":
+            requests_seen["open-meteo"].append(params["start_hour"])
+            start = datetime.fromisoformat(params["start_hour"])
+            end = datetime.fromisoformat(params["end_hour"])
+            hours = [start + timedelta(hours=h) for h in range(int((end - start).total_seconds() // 3600) + 1)]
+            return httpx.Response(200, json={"hourly": {
+                "time": [h.strftime("%Y-%m-%dT%H:%M") for h in hours],
+                "temperature_2m": [12.5] * len(hours),
+            }})
+        requests_seen["odre"].append(params["q"])
+        records = [
+            {"fields": {"consommation": 9000, "date_heure": (now - timedelta(minutes=15 * i)).isoformat() + "+00:00"}}
+            for i in range(4)
+        ]
+        return httpx.Response(200, json={"nhits": len(records), "records": records})
+
+    db = TestingSessionLocal()
+    zone = ingest_data.get_or_create_zone(db, "Scheduler Zone", 45.76, 4.83, "Scheduler Region")
+    zone_id = zone.id
+    db.close()
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(stub_server))
+    scheduler = ingest_scheduler.Scheduler(client=client, session_factory=TestingSessionLocal)
+    asyncio.run(scheduler.run(once=True))
+    first = dict(scheduler.last_runs)
+    weather_calls = len(requests_seen["open-meteo"])
+    asyncio.run(scheduler.run(once=True))
+    asyncio.run(client.aclose())
+
+    assert first["open-meteo"].rows_inserted >= 7 * 24
+    assert first["odre"].rows_inserted >= 4
+    # Deuxième passe : rien de nouveau, la météo n'est même pas redemandée
+    assert scheduler.last_runs["odre"].rows_fetched == 0
+    assert scheduler.last_runs["open-meteo"].runs == 2
+    assert len(requests_seen["open-meteo"]) == weather_calls
+
+    db = TestingSessionLocal()
+    watermark = db.get(models.IngestionWatermark, {"zone_id": zone_id, "source": "odre", "type": "electricity_consumption"})
+    assert watermark.high_water_mark == now
+    assert watermark.last_rows_inserted == 0
+    assert db.query(models.Indicator).filter(
+        models.Indicator.zone_id == zone_id, models.Indicator.type == "electricity_consumption"
+    ).count() == 4
+    db.close()
@@ -1,12 +1,21 @@
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.database import Base, get_db
+from app import models, crud, schemas, auth_cache, rollups, database, utils
 import pytest
+import asyncio
+import json
+import os
+import time
+import threading
+from datetime import datetime, timedelta
 
-# 1. Configuration d'une BDD de test (en mémoire RAM, pour ne pas casser la vraie BDD)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# 1. Configuration d'une BDD de test (fichier temporaire neuf à chaque session, voir conftest.py)
+TEST_DB_PATH = os.environ.get("ECOTRACK_TEST_DB_PATH", "./test.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -23,6 +32,16 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+# Même base pour les routes async (pilote aiosqlite)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DB_PATH}")
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+app.dependency_overrides[database.get_async_db] = override_get_async_db
+
 # Création des tables de test
 Base.metadata.create_all(bind=engine)
 
@@ -90,4 +109,804 @@ def test_read_indicators():
     """Test: Lecture publique des indicateurs"""
     response = client.get("/indicators/")
     assert response.status_code == 200
-    assert isinstance(response.json(), list)
\ No newline at end of file
+    assert isinstance(response.json(), list)
+
+def test_aggregate_indicators():
+    """Test: Agrégation par tranche horaire calculée côté serveur"""
+    db = TestingSessionLocal()
+    for minute, value in [(0, 10.0), (30, 20.0), (65, 5.0)]:
+        crud.create_indicator(db, schemas.IndicatorCreate(
+            type="test_aggregate", value=value, unit="u", zone_id=1,
+            timestamp=datetime(2024, 1, 1, 10, 0) + timedelta(minutes=minute)
+        ))
+    db.close()
+
+    response = client.get("/indicators/aggregate", params={"type": "test_aggregate", "bucket": "1h"})
+    assert response.status_code == 200
+    buckets = response.json()
+    assert len(buckets) == 2
+    assert buckets[0]["bucket"] == "2024-01-01T10:00:00"
+    assert buckets[0]["count"] == 2
+    assert buckets[0]["min"] == 10.0 and buckets[0]["max"] == 20.0 and buckets[0]["avg"] == 15.0
+    assert buckets[1]["count"] == 1
+
+    # Bornes non alignées sur l'heure : calcul direct sur les relevés bruts
+    response = client.get("/indicators/aggregate", params={
+        "type": "test_aggregate", "bucket": "1h", "from_date": "2024-01-01T10:15:00"
+    })
+    assert [(b["count"], b["avg"]) for b in response.json()] == [(1, 20.0), (1, 5.0)]
+
+    # Bornes avec fuseau : ramenées en UTC (alignée -> agrégats, non alignée -> relevés bruts)
+    response = client.get("/indicators/aggregate", params={
+        "type": "test_aggregate", "bucket": "1h", "from_date": "2024-01-01T10:00:00Z", "to_date": "2024-01-01T12:00:00Z"
+    })
+    assert response.status_code == 200
+    assert [b["count"] for b in response.json()] == [2, 1]
+    response = client.get("/indicators/aggregate", params={
+        "type": "test_aggregate", "bucket": "1h", "from_date": "2024-01-01T11:15:00+01:00"
+    })
+    assert [(b["count"], b["avg"]) for b in response.json()] == [(1, 20.0), (1, 5.0)]
+    response = client.get("/indicators/stats", params={"type": "test_aggregate", "from_date": "2024-01-01T00:00:00Z"})
+    assert response.status_code == 200 and response.json()[0]["count"] == 3
+
+    # to_date inclus partout, qu'il tombe ou non sur un début de tranche
+    for to_date in ("2024-01-01T10:30:00", "2024-01-01T10:30:01", "2024-01-01T11:00:00", "2024-01-01T11:05:00"):
+        window = {"type": "test_aggregate", "to_date": to_date}
+        expected = 3 if to_date >= "2024-01-01T11:05:00" else 2
+        assert len(client.get("/indicators/", params=window).json()) == expected
+        assert client.get("/indicators/stats", params=window).json()[0]["count"] == expected
+        buckets = client.get("/indicators/aggregate", params={**window, "bucket": "1h"}).json()
+        assert sum(b["count"] for b in buckets) == expected
+    # Liste : bornes et curseur avec fuseau ramenés en UTC, comme pour les agrégations
+    listed = client.get("/indicators/", params={"type": "test_aggregate", "from_date": "2024-01-01T11:15:00+01:00",
+                                                "to_date": "2024-01-01T13:10:00+02:00"}).json()
+    assert [i["value"] for i in listed] == [20.0, 5.0]
+    cursor = utils.encode_cursor("2024-01-01T11:00:00+01:00", 2**31)
+    assert [i["value"] for i in client.get("/indicators/", params={"type": "test_aggregate", "cursor": cursor}).json()] == [20.0, 5.0]
+    hours = client.get("/indicators/aggregate", params={"type": "test_aggregate", "bucket": "1h",
+                                                        "to_date": "2024-01-01T10:00:00"}).json()
+    assert [(b["bucket"], b["count"]) for b in hours] == [("2024-01-01T10:00:00", 1)]
+
+    response = client.get("/indicators/aggregate", params={"bucket": "3w"})
+    assert response.status_code == 400
+
+def test_create_indicators_batch():
+    """Test: Insertion d'un lot en une transaction, avec statut par élément"""
+    db = TestingSessionLocal()
+    zone = models.Zone(name="Batch Zone", postal_code="00000", country="France")
+    db.add(zone)
+    db.commit()
+
+    items = [
+        schemas.IndicatorCreate(type="test_batch", value=float(i), unit="u", zone_id=zone.id)
+        for i in range(3)
+    ]
+    items.insert(1, schemas.IndicatorCreate(type="test_batch", value=0.0, unit="u", zone_id=999999))
+    for hour, item in enumerate(items):
+        item.timestamp = datetime(2024, 1, 1, hour)
+    items.append(items[0])  # doublon dans le même lot
+
+    result = crud.create_indicators_batch(db, items)
+    assert result.created == 3
+    assert result.duplicates == 1
+    assert result.errors == 1
+    assert [item.status for item in result.items] == ["created", "error", "created", "created", "duplicate"]
+    ids = [item.id for item in result.items if item.id is not None]
+    stored = db.query(models.Indicator).filter(models.Indicator.id.in_(ids)).all()
+    assert sorted(ind.value for ind in stored) == [0.0, 1.0, 2.0]
+    db.close()
+
+def test_export_indicators_stream():
+    """Test: Export NDJSON et CSV en flux, filtré par type"""
+    response = client.get("/indicators/export", params={"type": "test_aggregate"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["value"] for line in lines] == [10.0, 20.0, 5.0]
+    assert lines[0]["timestamp"] == "2024-01-01T10:00:00"
+
+    response = client.get("/indicators/export", params={"type": "test_aggregate", "format": "csv"})
+    assert response.status_code == 200
+    rows = response.text.splitlines()
+    assert rows[0] == "id,zone_id,type,value,unit,timestamp"
+    assert len(rows) == 4
+
+    # Horodatage NULL (colonne nullable) : champ vide, export complet dans les deux formats
+    db = TestingSessionLocal()
+    db.execute(models.Indicator.__table__.insert(), [{"type": "test_export_null", "value": 1.0, "unit": "u", "zone_id": 1, "timestamp": None}])
+    db.commit()
+    db.close()
+    rows = client.get("/indicators/export", params={"type": "test_export_null", "format": "csv"}).text.splitlines()
+    assert len(rows) == 2 and rows[1].endswith(",u,")
+    line = json.loads(client.get("/indicators/export", params={"type": "test_export_null"}).text)
+    assert line["timestamp"] is None
+    db = TestingSessionLocal()
+    db.query(models.Indicator).filter(models.Indicator.type == "test_export_null").delete()
+    db.commit()
+    db.close()
+
+def test_indicators_cursor_pagination():
+    """Test: Pagination par curseur (keyset) sur les indicateurs, sans doublon ni trou"""
+    db = TestingSessionLocal()
+    for hour in range(5):
+        db.add(models.Indicator(
+            type="test_cursor", value=float(hour), unit="u", zone_id=1,
+            timestamp=datetime(2024, 3, 1, hour)
+        ))
+    db.commit()
+    db.close()
+
+    values = []
+    params = {"type": "test_cursor", "limit": 2}
+    while True:
+        response = client.get("/indicators/", params=params)
+        assert response.status_code == 200
+        values += [item["value"] for item in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert values == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    response = client.get("/indicators/", params={"type": "test_cursor", "from_date": "2024-03-01T03:00:00"})
+    assert [item["value"] for item in response.json()] == [3.0, 4.0]
+
+    response = client.get("/indicators/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_zones_cursor_pagination():
+    """Test: Pagination par curseur sur les zones (par id)"""
+    db = TestingSessionLocal()
+    for i in range(2):
+        crud.create_zone(db, schemas.ZoneCreate(name=f"Cursor Zone {i}", postal_code="75000", country="France"))
+    db.close()
+    first = client.get("/zones/", params={"limit": 1})
+    assert first.status_code == 200
+    second = client.get("/zones/", params={"limit": 1, "cursor": first.headers["X-Next-Cursor"]})
+    assert second.status_code == 200
+    assert second.json()[0]["id"] > first.json()[0]["id"]
+
+def test_auth_cache_expiry_and_invalidation():
+    """Test: Cache des tokens vérifiés (hit/miss, expiration, invalidation explicite)"""
+    cache = auth_cache.AuthCache(max_entries=2, ttl=60)
+    alice = auth_cache.Principal(id=1, email="alice@example.com", role="user", is_active=True)
+    bob = auth_cache.Principal(id=2, email="bob@example.com", role="admin", is_active=True)
+
+    assert cache.get("token-a") is None
+    cache.put("token-a", alice, token_expires_at=time.time() + 600)
+    cache.put("token-expired", bob, token_expires_at=time.time() - 1)
+    assert cache.get("token-a") == alice
+    assert cache.get("token-expired") is None
+
+    cache.put("token-b", bob, token_expires_at=time.time() + 600)
+    cache.put("token-c", bob, token_expires_at=time.time() + 600)
+    assert cache.get("token-a") is None  # évincé (LRU, 2 entrées max)
+
+    cache.invalidate_user(bob.id)
+    assert cache.get("token-b") is None and cache.get("token-c") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 5 and stats["size"] == 0
+
+def test_update_user_invalidates_auth_cache():
+    """Test: crud.update_user vide le cache des tokens de l'utilisateur modifié"""
+    db = TestingSessionLocal()
+    user = crud.get_user_by_email(db, "test@example.com")
+    auth_cache.cache.put("cached-token", auth_cache.Principal.from_user(user), time.time() + 600)
+
+    crud.update_user(db, user, schemas.UserUpdate(role="user"))
+    assert auth_cache.cache.get("cached-token") is None
+    db.close()
+
+def test_rollups_follow_writes_and_rebuild():
+    """Test: Les agrégats suivent insertions / suppressions et peuvent être reconstruits"""
+    db = TestingSessionLocal()
+    created = [
+        crud.create_indicator(db, schemas.IndicatorCreate(
+            type="test_rollup", value=value, unit="u", zone_id=1,
+            timestamp=datetime(2024, 4, 1, 8) + timedelta(hours=hour)
+        ))
+        for hour, value in enumerate([2.0, 4.0, 9.0])
+    ]
+    assert crud.get_indicator_stats(db, zone_id=1, type="test_rollup").average == 5.0
+
+    crud.delete_indicator(db, created[2].id)
+    daily = db.query(models.IndicatorRollupDaily).filter_by(type="test_rollup").one()
+    assert (daily.count, daily.sum, daily.min, daily.max, daily.sum_sq) == (2, 6.0, 2.0, 4.0, 20.0)
+
+    # Relevé inséré hors crud (import direct) : visible après reconstruction
+    db.add(models.Indicator(type="test_rollup", value=12.0, unit="u", zone_id=1, timestamp=datetime(2024, 4, 1, 20)))
+    db.commit()
+    rollups.rebuild(db)
+    assert crud.get_indicator_stats(db, zone_id=1, type="test_rollup").average == 6.0
+    hourly = db.query(models.IndicatorRollupHourly).filter_by(type="test_rollup").count()
+    assert hourly == 3
+    db.close()
+
+def test_rollups_backfilled_for_older_database(tmp_path):
+    """Test: Une base antérieure aux agrégats (tables vides) est reconstruite au démarrage, une seule fois"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'older.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    assert rollups.backfill_if_empty(db) is None  # base vide : rien à faire
+    db.execute(models.Indicator.__table__.insert(), [
+        {"type": "older", "value": value, "unit": "u", "zone_id": 1, "timestamp": datetime(2024, 4, 1, hour)}
+        for hour, value in enumerate([1.0, 3.0])
+    ])
+    db.commit()
+    assert crud.get_indicator_stats(db, zone_id=1, type="older") is None
+
+    assert rollups.backfill_if_empty(db)["hour"] == 2
+    assert crud.get_indicator_stats(db, zone_id=1, type="older").average == 2.0
+    assert len(crud.get_indicator_aggregates(db, bucket="1h", zone_ids=[1], types=["older"])) == 2
+    assert rollups.backfill_if_empty(db) is None
+    db.close()
+    engine.dispose()
+
+def test_grouped_stats_endpoint():
+    """Test: Statistiques multi-zones / multi-types en un appel, avec percentiles"""
+    db = TestingSessionLocal()
+    zone = models.Zone(name="Stats Zone", postal_code="00000", country="France")
+    db.add(zone)
+    db.commit()
+    zone_id = zone.id
+    for i, value in enumerate([1.0, 2.0, 3.0, 4.0, 10.0]):
+        crud.create_indicator(db, schemas.IndicatorCreate(
+            type="test_stats", value=value, unit="kg", zone_id=zone_id,
+            timestamp=datetime(2024, 5, 1) + timedelta(minutes=10 * i)
+        ))
+    crud.create_indicator(db, schemas.IndicatorCreate(
+        type="test_stats_other", value=7.0, unit="m", zone_id=zone_id, timestamp=datetime(2024, 5, 1)
+    ))
+    db.close()
+
+    response = client.get("/indicators/stats", params={
+        "zone_id": zone_id, "type": ["test_stats", "test_stats_other"], "percentile": [50, 80]
+    })
+    assert response.status_code == 200
+    stats = {item["type"]: item for item in response.json()}
+    main = stats["test_stats"]
+    assert main["zone"] == "Stats Zone" and main["unit"] == "kg"
+    assert (main["count"], main["min"], main["max"], main["mean"]) == (5, 1.0, 10.0, 4.0)
+    assert round(main["stddev"], 6) == round((sum((v - 4.0) ** 2 for v in [1, 2, 3, 4, 10]) / 4) ** 0.5, 6)
+    assert main["percentiles"] == {"p50": 3.0, "p80": 4.0}
+    assert stats["test_stats_other"]["count"] == 1
+
+    # Période non alignée : calcul sur les relevés bruts, mêmes résultats
+    response = client.get("/indicators/stats", params={
+        "zone_id": zone_id, "type": "test_stats", "from_date": "2024-05-01T00:05:00"
+    })
+    assert response.json()[0]["count"] == 4
+
+def test_sqlite_engine_pragmas(tmp_path):
+    """Test: Le moteur SQLite applique WAL et busy_timeout à chaque connexion"""
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+    engine.dispose()
+
+def test_conditional_get_zones_and_indicators():
+    """Test: ETag / 304 sur les listes, invalidés par les écritures de crud"""
+    db = TestingSessionLocal()
+    zone = crud.create_zone(db, schemas.ZoneCreate(name="Etag", postal_code="75002", country="France"))
+    other = crud.create_zone(db, schemas.ZoneCreate(name="Etag bis", postal_code="75003", country="France"))
+
+    first = client.get("/zones/")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"') and "Last-Modified" in first.headers
+    cached = client.get("/zones/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    # Une autre page a son propre ETag
+    assert client.get("/zones/", params={"limit": 1}).headers["ETag"] != etag
+
+    params = {"zone_id": zone.id, "limit": 1000}
+    etag = client.get("/indicators/", params=params).headers["ETag"]
+    assert client.get("/indicators/", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    # Un relevé dans une autre zone n'invalide pas la liste de cette zone...
+    crud.bulk_insert_indicators(db, [{"type": "etag", "value": 1.0, "unit": "u", "zone_id": other.id,
+                                      "timestamp": datetime(2024, 6, 1)}])
+    db.commit()
+    assert client.get("/indicators/", params=params, headers={"If-None-Match": etag}).status_code == 304
+    # ...mais un relevé dans la zone, si
+    crud.create_indicator(db, schemas.IndicatorCreate(type="etag", value=2.0, unit="u", zone_id=zone.id,
+                                                      timestamp=datetime(2024, 6, 1)))
+    response = client.get("/indicators/", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and len(response.json()) == 1
+
+    zones_etag = client.get("/zones/").headers["ETag"]
+    crud.update_zone(db, zone.id, schemas.ZoneUpdate(name="Etag modifiée"))
+    assert client.get("/zones/", headers={"If-None-Match": zones_etag}).status_code == 200
+    db.close()
+
+def test_indicators_fast_json_and_columnar(monkeypatch):
+    """Test: La liste rapide renvoie le même JSON que le schéma Pydantic, et le format colonnes"""
+    db = TestingSessionLocal()
+    zone = crud.create_zone(db, schemas.ZoneCreate(name="Json", postal_code="75004", country="France"))
+    created = crud.create_indicator(db, schemas.IndicatorCreate(
+        type="json", value=21.5, unit="°C", zone_id=zone.id, timestamp=datetime(2024, 7, 1, 12, 30, 15, 250)
+    ))
+    expected = schemas.Indicator.model_validate(created).model_dump(mode="json")
+    params = {"zone_id": zone.id, "type": "json"}
+    db.close()
+
+    assert client.get("/indicators/", params=params).json() == [expected]
+
+    columnar = client.get("/indicators/", params={**params, "format": "columnar"}).json()
+    assert columnar == {name: [value] for name, value in expected.items()}
+    empty = client.get("/indicators/", params={**params, "type": "absent", "format": "columnar"}).json()
+    assert empty["timestamp"] == [] and empty["value"] == []
+    assert client.get("/indicators/", params={**params, "format": "xml"}).status_code == 400
+    assert schemas.IndicatorColumns.model_validate(columnar).value == [21.5]
+
+    # OpenAPI : les deux formes de réponse sont décrites
+    schema = client.get("/openapi.json").json()["paths"]["/indicators/"]["get"]["responses"]["200"]
+    shapes = schema["content"]["application/json"]["schema"]["anyOf"]
+    assert {"$ref": "#/components/schemas/IndicatorColumns"} in shapes
+    assert {"type": "array", "items": {"$ref": "#/components/schemas/Indicator"}} in shapes
+
+    # Sans orjson, repli sur le module json avec le même résultat
+    monkeypatch.setattr(utils, "orjson", None)
+    assert client.get("/indicators/", params=params).json() == [expected]
+
+def test_broker_pushes_new_indicators(monkeypatch):
+    """Test: Les relevés commités sont poussés aux abonnés concernés ; un abonné lent est déconnecté"""
+    from app import broker
+    from app.routers import indicators as indicators_router
+    db = TestingSessionLocal()
+    zone = crud.create_zone(db, schemas.ZoneCreate(name="Live", postal_code="75005", country="France"))
+    zone_id = zone.id
+    live = broker.Broker(session_factory=TestingAsyncSessionLocal, poll_interval=60)
+    monkeypatch.setattr(broker, "broker", live)
+
+    async def scenario():
+        mine = await live.subscribe(zone_ids=[zone_id], types=["live"])
+        other = await live.subscribe(types=["autre"])
+        # Le commit réveille le lecteur sans attendre poll_interval
+        crud.create_indicator(db, schemas.IndicatorCreate(
+            type="live", value=3.5, unit="u", zone_id=zone_id, timestamp=datetime(2024, 8, 1)
+        ))
+        record = await asyncio.wait_for(mine.get(), timeout=5)
+        assert record["zone_id"] == zone_id and record["value"] == 3.5
+        assert other.queue.empty()
+
+        # Flux SSE : rattrapage puis direct, sans doublon
+        async with TestingAsyncSessionLocal() as session:
+            backlog = (await session.execute(crud.indicators_since_statement(record["id"] - 1))).all()
+        events = indicators_router._sse_events(mine, backlog)
+        assert await events.__anext__() == b"retry: 3000\n\n"
+        assert b"event: indicator" in await events.__anext__()
+        live.publish([record, dict(record, id=record["id"] + 1)])
+        assert b"id: %d" % (record["id"] + 1) in await events.__anext__()
+        await events.aclose()
+        assert mine not in live.subscribers
+
+        # Rattrapage en échec : l'abonnement ouvert par la route est rendu
+        async def failing_since(*args, **kwargs):
+            raise RuntimeError("backlog")
+        monkeypatch.setattr(indicators_router.async_crud, "get_indicator_rows_since", failing_since)
+        before = set(live.subscribers)
+        with pytest.raises(RuntimeError):
+            await indicators_router.stream_indicators(zone_id=[zone_id], type=["live"], last_event_id=1)
+        assert live.subscribers == before
+
+        slow = broker.Subscription(maxsize=2)
+        live.subscribers.add(slow)
+        live.publish([dict(record, id=i) for i in range(3)])
+        assert slow.dropped and slow not in live.subscribers
+        assert await slow.get() is None
+
+        # Sans abonné, le lecteur n'avance pas : un nouvel abonné ne reçoit pas les relevés insérés entre-temps
+        for subscription in list(live.subscribers):
+            live.unsubscribe(subscription)
+        for hour in range(3):
+            crud.create_indicator(db, schemas.IndicatorCreate(
+                type="live", value=float(hour), unit="u", zone_id=zone_id, timestamp=datetime(2024, 8, 2, hour)
+            ))
+        await asyncio.sleep(0)
+        late = await live.subscribe(zone_ids=[zone_id], types=["live"])
+        crud.create_indicator(db, schemas.IndicatorCreate(
+            type="live", value=42.0, unit="u", zone_id=zone_id, timestamp=datetime(2024, 8, 3)
+        ))
+        assert (await asyncio.wait_for(late.get(), timeout=5))["value"] == 42.0
+        assert late.queue.empty()
+
+    asyncio.run(scenario())
+    db.close()
+
+def test_lttb_keeps_shape():
+    """Test: LTTB borne le nombre de points et conserve les extrêmes"""
+    import numpy as np
+    from app import downsampling
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321] = 50.0
+    keep = downsampling.lttb(x, y, 200)
+    assert len(keep) == 200 and keep[0] == 0 and keep[-1] == 9999
+    assert (np.diff(keep) > 0).all()
+    assert 4321 in keep
+    assert list(downsampling.lttb(x[:50], y[:50], 200)) == list(range(50))
+
+def test_series_endpoint_downsamples():
+    """Test: /indicators/series renvoie au plus `points` valeurs"""
+    db = TestingSessionLocal()
+    zone = crud.create_zone(db, schemas.ZoneCreate(name="Series", postal_code="75006", country="France"))
+    start = datetime(2024, 9, 1)
+    crud.bulk_insert_indicators(db, [
+        {"type": "series", "value": float(i % 97), "unit": "u", "zone_id": zone.id,
+         "timestamp": start + timedelta(minutes=15 * i)}
+        for i in range(3000)
+    ])
+    db.commit()
+    params = {"zone_id": zone.id, "type": "series", "points": 100}
+    db.close()
+
+    data = client.get("/indicators/series", params=params).json()
+    assert data["count"] == 3000 and data["unit"] == "u"
+    assert len(data["timestamp"]) == len(data["value"]) == 100
+    assert data["timestamp"][0] == "2024-09-01T00:00:00" and max(data["value"]) == 96.0
+
+    ranged = client.get("/indicators/series", params={**params, "to_date": "2024-09-01T10:00:00"}).json()
+    assert ranged["count"] == 41 and len(ranged["value"]) == 41
+    assert client.get("/indicators/series", params={**params, "points": 1}).status_code == 422
+
+def test_async_database_url():
+    """Test: L'URL async est dérivée de l'URL sync (pilote aiosqlite / asyncpg)"""
+    assert database.async_url("sqlite:///./ecotrack.db") == "sqlite+aiosqlite:///./ecotrack.db"
+    assert database.async_url("postgresql://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+    assert database.async_url("postgresql+psycopg://u:p@h/db") == "postgresql+psycopg://u:p@h/db"
+
+def test_metrics_endpoint():
+    """Test: /metrics expose latences par route, requêtes SQL et compteurs d'ingestion"""
+    from app import metrics
+    metrics.instrument_engine(engine, "test")
+    db = TestingSessionLocal()
+    zone_id = crud.create_zone(db, schemas.ZoneCreate(name="Metrics Zone", postal_code="75000", country="France")).id
+    crud.record_ingestion_run(db, zone_id, "open-meteo", "temperature", fetched=24, inserted=20, duration_ms=12.0)
+    crud.record_ingestion_run(db, zone_id, "open-meteo", "temperature", duration_ms=3.0, failed=True)
+    db.commit()
+    db.close()
+
+    route = "/indicators/stats"
+    before = metrics.http_requests.value("GET", route, "200")
+    queries_before = metrics.db_queries.value("test")
+    assert client.get(route, params={"zone_id": zone_id, "type": "temperature"}).status_code == 200
+    assert metrics.http_requests.value("GET", route, "200") == before + 1
+    assert metrics.db_queries.value("test") > queries_before
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'ecotrack_http_request_duration_seconds_bucket{method="GET",route="/indicators/stats",le="+Inf"}' in body
+    assert 'ecotrack_db_queries_total{engine="test"}' in body
+    assert 'ecotrack_db_queries_per_request_count{route="/indicators/stats"}' in body
+    assert "ecotrack_http_requests_in_flight 1" in body  # la requête /metrics elle-même
+    assert 'ecotrack_ingestion_rows_inserted_total{source="open-meteo"}' in body
+    assert 'ecotrack_ingestion_failures_total{source="open-meteo"}' in body
+
+def test_pool_metrics_survive_dispose():
+    """Test: Emprunts, connexions en cours et ouvertures suivis par les événements du pool, même après dispose()"""
+    from app import metrics
+    pool_engine = metrics.instrument_engine(database.make_engine(f"sqlite:///{TEST_DB_PATH}"), "pool-test")
+    for _ in range(2):
+        checkouts, waits = metrics.db_checkouts.value("pool-test"), metrics.db_checkout_wait.count("pool-test")
+        connects = metrics.db_connect_latency.count("pool-test")
+        with pool_engine.connect():
+            assert metrics.db_checked_out.value("pool-test") == 1
+        assert metrics.db_checked_out.value("pool-test") == 0
+        assert metrics.db_checkouts.value("pool-test") == checkouts + 1
+        assert metrics.db_checkout_wait.count("pool-test") == waits + 1
+        # Pool neuf (recréé par dispose) : nouvelle connexion ouverte, mesurée à part
+        assert metrics.db_connect_latency.count("pool-test") == connects + 1
+        pool_engine.dispose()
+
+def test_failed_statements_leave_no_timer_on_connection():
+    """Test: Une requête SQL en échec ne laisse aucun chronomètre sur la connexion du pool"""
+    from app import metrics, sql_instrumentation
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    timed_engine = metrics.instrument_engine(database.make_engine(f"sqlite:///{TEST_DB_PATH}"), "timer-test")
+    sql_instrumentation.instrument_engine(timed_engine)
+    with timed_engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        queries = metrics.db_queries.value("timer-test")
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert metrics.db_queries.value("timer-test") == queries + 1
+        assert not [key for key in conn.info if key.startswith("ecotrack")]
+    timed_engine.dispose()
+
+def test_query_budget_per_endpoint():
+    """Test: Nombre maximal de requêtes SQL des lectures fréquentes (pas de requête par ligne)"""
+    from app.sql_instrumentation import assert_max_queries
+    engines = (engine, async_engine.sync_engine)
+    db = TestingSessionLocal()
+    zone_ids = [crud.create_zone(db, schemas.ZoneCreate(name=f"Budget Zone {i}", postal_code="75000", country="France")).id
+                for i in range(3)]
+    crud.bulk_insert_indicators(db, [
+        {"type": "test_budget", "value": float(hour), "unit": "u", "zone_id": zone_id, "timestamp": datetime(2024, 6, 1, hour)}
+        for zone_id in zone_ids for hour in range(24)
+    ])
+    db.commit()
+    db.close()
+
+    with assert_max_queries(2, *engines):
+        assert client.get("/zones/").status_code == 200
+    with assert_max_queries(2, *engines):
+        assert len(client.get("/indicators/", params={"type": "test_budget"}).json()) == 72
+    with assert_max_queries(1, *engines):
+        stats = client.get("/indicators/stats", params={"zone_id": zone_ids, "type": "test_budget"}).json()
+        assert len(stats) == 3
+    with assert_max_queries(2, *engines):  # borne de rétention + relevés
+        assert client.get("/indicators/series", params={"zone_id": zone_ids[0], "type": "test_budget"}).status_code == 200
+
+    with pytest.raises(AssertionError, match="requêtes SQL exécutées"):
+        with assert_max_queries(1, *engines):
+            client.get("/zones/")
+
+def test_slow_query_log_and_n_plus_one(caplog):
+    """Test: Requêtes lentes journalisées avec leur plan, requêtes répétées signalées"""
+    from sqlalchemy import text
+    from app import sql_instrumentation
+    probe = create_engine("sqlite://")
+    sql_instrumentation.instrument_engine(probe, slow_query_ms=0)
+    caplog.set_level("WARNING", logger="ecotrack.sql")
+    with probe.connect() as conn:
+        conn.execute(text("CREATE TABLE probe (id INTEGER PRIMARY KEY, zone_id INTEGER)"))
+        with sql_instrumentation.track_queries() as log:
+            for zone_id in range(12):
+                conn.execute(text("SELECT * FROM probe WHERE zone_id = :z"), {"z": zone_id})
+            conn.execute(text("SELECT * FROM probe WHERE zone_id IN (1, 2)"))
+    sql_instrumentation.report_n_plus_one(log, "GET /probe")
+
+    assert log.count == 13
+    assert sql_instrumentation.query_shape("SELECT a FROM t WHERE id IN (?, ?,  ?)") == "SELECT a FROM t WHERE id IN (?...)"
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("Requête lente" in m and "paramètres : (3,)" in m and "plan : SCAN probe" in m for m in messages)
+    assert any(m.startswith("N+1 probable sur GET /probe : 12 requêtes identiques") for m in messages)
+
+def test_request_profiling_for_admins():
+    """Test: X-Profile (admin) renvoie Server-Timing et enregistre un profil au format folded"""
+    from app import sql_instrumentation
+    sql_instrumentation.instrument_engine(async_engine.sync_engine)
+    admin_headers = get_admin_headers()
+
+    # Un thread occupé en parallèle ne sert pas la requête : il ne doit pas apparaître dans le profil
+    stop = threading.Event()
+    def unrelated_busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+    busy = threading.Thread(target=unrelated_busy_loop)
+    busy.start()
+    try:
+        response = client.get("/indicators/", params={"type": "test_aggregate"}, headers={**admin_headers, "X-Profile": "1"})
+    finally:
+        stop.set()
+        busy.join()
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    timing = response.headers["server-timing"]
+    assert timing.startswith("total;dur=") and 'sql;dur=' in timing and "pydantic;dur=" in timing and "json;dur=" in timing
+    profile_id = response.headers["x-profile-id"]
+
+    profile = client.get(f"/profiles/{profile_id}", headers=admin_headers).json()
+    assert profile["path"] == "/indicators/"
+    assert profile["sql_queries"] >= 1 and profile["sql_ms"] > 0
+    folded = client.get(f"/profiles/{profile_id}", params={"format": "folded"}, headers=admin_headers)
+    assert folded.headers["content-type"].startswith("text/plain")
+    for line in folded.text.splitlines():
+        stack, weight = line.rsplit(" ", 1)
+        assert stack and int(weight) > 0
+        assert "unrelated_busy_loop" not in stack
+    assert profile_id in [p["id"] for p in client.get("/profiles/", headers=admin_headers).json()]
+
+    # Réservé aux administrateurs ; sans drapeau, la requête n'est pas profilée
+    token = test_login_user()
+    assert client.get("/indicators/", params={"profile": 1}, headers={"Authorization": f"Bearer {token}"}).status_code == 403
+    assert client.get("/indicators/", params={"profile": 1}).status_code == 401
+    assert "server-timing" not in client.get("/indicators/", headers=admin_headers).headers
+
+def test_retention_compacts_raw_rows():
+    """Test: Rétention par type, suppression par lots, lectures brutes + agrégats transparentes"""
+    from app import retention
+    db = TestingSessionLocal()
+    zone_id = crud.create_zone(db, schemas.ZoneCreate(name="Retention Zone", postal_code="75000", country="France")).id
+    start = datetime(2024, 5, 1)
+    rows = [
+        {"type": "test_retention", "value": float(i % 7), "unit": "u", "zone_id": zone_id,
+         "timestamp": start + timedelta(minutes=30 * i)}
+        for i in range(10 * 48)
+    ]
+    crud.bulk_insert_indicators(db, [dict(row) for row in rows])
+    db.commit()
+
+    # Bornes non alignées : lecture des relevés bruts (complétés des agrégats une fois compactés)
+    window = {"zone_ids": [zone_id], "types": ["test_retention"], "from_date": start,
+              "to_date": start + timedelta(days=9, minutes=50)}
+    before_stats = crud.get_indicator_stats_grouped(db, **window)[0]
+    before_hours = crud.get_indicator_aggregates(db, bucket="1h", **window)
+
+    retention.set_policy(db, "test_retention", raw_days=3)
+    deleted = retention.compact(db, "test_retention", now=datetime(2024, 5, 10, 12), batch_size=50, pause=0)
+    boundary = datetime(2024, 5, 7)
+    assert deleted == 6 * 48
+    assert db.get(models.RetentionPolicy, "test_retention").compacted_before == boundary
+    remaining = db.query(func.min(models.Indicator.timestamp)).filter(models.Indicator.type == "test_retention").scalar()
+    assert remaining == boundary
+
+    after_stats = crud.get_indicator_stats_grouped(db, **window)[0]
+    assert (after_stats.count, after_stats.min, after_stats.max) == (before_stats.count, before_stats.min, before_stats.max)
+    assert after_stats.mean == pytest.approx(before_stats.mean)
+    after_hours = crud.get_indicator_aggregates(db, bucket="1h", **window)
+    assert [(b.bucket, b.count, b.min, b.max) for b in after_hours] == [(b.bucket, b.count, b.min, b.max) for b in before_hours]
+    series = crud.get_indicator_series(db, zone_id, "test_retention", points=5000)
+    assert series.timestamp[0] == start and series.count == 6 * 24 + 4 * 48
+
+    # Réingestion de relevés déjà compactés : ignorés, les agrégats ne sont pas comptés deux fois
+    assert crud.bulk_insert_indicators(db, [dict(row) for row in rows[:48]]) == []
+    db.commit()
+    rollups.rebuild(db)
+    assert crud.get_indicator_stats_grouped(db, zone_ids=[zone_id], types=["test_retention"])[0].count == 10 * 48
+    db.close()
+
+def test_retention_covers_rows_imported_without_rollups():
+    """Test: Des relevés importés directement (sans agrégats) sont agrégés avant d'être compactés"""
+    from app import retention
+    db = TestingSessionLocal()
+    zone_id = crud.create_zone(db, schemas.ZoneCreate(name="Import Zone", postal_code="75000", country="France")).id
+    start = datetime(2024, 6, 1)
+    db.execute(models.Indicator.__table__.insert(), [
+        {"type": "test_import", "value": float(i), "unit": "u", "zone_id": zone_id,
+         "timestamp": start + timedelta(hours=i)}
+        for i in range(5 * 24)
+    ])
+    db.commit()
+    assert crud.get_indicator_stats(db, zone_id=zone_id, type="test_import") is None
+
+    retention.set_policy(db, "test_import", raw_days=1)
+    assert retention.compact(db, "test_import", now=datetime(2024, 6, 5, 12), pause=0) == 3 * 24
+    # Historique compacté [start, borne[ : toujours lisible via les agrégats
+    compacted = {"zone_ids": [zone_id], "types": ["test_import"], "from_date": start, "to_date": datetime(2024, 6, 3, 23, 30)}
+    stats = crud.get_indicator_stats_grouped(db, **compacted)[0]
+    assert stats.count == 3 * 24 and (stats.min, stats.max) == (0.0, 3 * 24 - 1.0)
+    assert [b.count for b in crud.get_indicator_aggregates(db, bucket="1h", **compacted)] == [1] * (3 * 24)
+    db.close()
+
+def test_hot_window_serves_recent_reads(monkeypatch):
+    """Test: Fenêtre chaude en mémoire : mêmes réponses que la base, sans requête SQL, suivie des écritures"""
+    from app import hot_window
+    from app.sql_instrumentation import assert_max_queries
+    db = TestingSessionLocal()
+    zone_id = crud.create_zone(db, schemas.ZoneCreate(name="Hot Zone", postal_code="75000", country="France")).id
+    now = datetime.utcnow().replace(microsecond=0)
+    crud.bulk_insert_indicators(db, [
+        {"type": "test_hot", "value": float(i % 5), "unit": "u", "zone_id": zone_id,
+         "timestamp": now - timedelta(minutes=30 * i + 7)}
+        for i in range(96)
+    ] + [{"type": "test_hot", "value": 99.0, "unit": "u", "zone_id": zone_id, "timestamp": now - timedelta(days=30)}])
+    db.commit()
+
+    day_ago, hour = now - timedelta(days=1), rollups.truncate(now - timedelta(days=1), 3600)
+    def reads():
+        series = crud.get_indicator_series(db, zone_id, "test_hot", from_date=day_ago, points=10)
+        raw = crud.get_indicator_aggregates(db, bucket="15m", zone_ids=[zone_id], types=["test_hot"], from_date=day_ago)
+        aligned = crud.get_indicator_aggregates(db, bucket="1h", types=["test_hot"], from_date=hour,
+                                                to_date=hour + timedelta(hours=6))
+        return series, raw, aligned
+
+    monkeypatch.setattr(hot_window, "cache", hot_window.HotWindowCache(window_days=0))
+    expected = reads()
+    monkeypatch.setattr(hot_window, "cache", hot_window.HotWindowCache(window_days=7, sync_interval=3600))
+    hot_window.cache.load(db)
+    with assert_max_queries(0, engine):
+        assert reads() == expected
+    assert hot_window.cache.stats()["hits"] == 3 and all(expected)
+    # Période plus ancienne que la fenêtre : lecture en base
+    assert crud.get_indicator_series(db, zone_id, "test_hot", from_date=now - timedelta(days=40)).count == 97
+
+    # Insertion par ce processus : ajoutée au commit, sans relecture
+    created = crud.create_indicator(db, schemas.IndicatorCreate(
+        type="test_hot", value=42.0, unit="u", zone_id=zone_id, timestamp=now))
+    with assert_max_queries(0, engine):
+        series = crud.get_indicator_series(db, zone_id, "test_hot", from_date=day_ago, points=5000)
+    assert series.count == expected[0].count + 1 and series.value[-1] == 42.0
+
+    # Modification : seule la série touchée est relue, sans rechargement de la fenêtre
+    other = crud.create_indicator(db, schemas.IndicatorCreate(
+        type="test_hot_other", value=1.0, unit="u", zone_id=zone_id, timestamp=now))
+    untouched = hot_window.cache.series[(zone_id, "test_hot_other")]
+    reloads = hot_window.cache.stats()["reloads"]
+    crud.update_indicator(db, created.id, schemas.IndicatorUpdate(value=43.0))
+    assert crud.get_indicator_series(db, zone_id, "test_hot", from_date=day_ago, points=5000).value[-1] == 43.0
+    stats = hot_window.cache.stats()
+    assert (stats["reloads"], stats["series_reloads"]) == (reloads, 1)
+    assert hot_window.cache.series[(zone_id, "test_hot_other")] is untouched
+    assert all(len(series._timestamps) <= series.capacity for series in hot_window.cache.series.values())
+    crud.delete_indicator(db, other.id)
+    assert crud.get_indicator_series(db, zone_id, "test_hot_other", from_date=day_ago).count == 0
+    assert hot_window.cache.stats()["reloads"] == reloads
+
+    # Écriture d'un autre processus (hors crud) : vue au rattrapage suivant
+    db.add(models.Indicator(type="test_hot", value=44.0, unit="u", zone_id=zone_id, timestamp=now + timedelta(minutes=1)))
+    db.commit()
+    hot_window.cache.sync(db)
+    with assert_max_queries(0, engine):
+        assert crud.get_indicator_series(db, zone_id, "test_hot", from_date=day_ago, points=5000).value[-1] == 44.0
+    db.close()
+
+def test_latest_per_zone_and_type():
+    """Test: Dernier relevé par (zone, type) tenu à jour par les écritures, servi sans parcourir l'historique"""
+    from app.sql_instrumentation import assert_max_queries
+    db = TestingSessionLocal()
+    zone_ids = [crud.create_zone(db, schemas.ZoneCreate(name=f"Latest Zone {i}", postal_code="75000", country="France")).id
+                for i in range(2)]
+    crud.bulk_insert_indicators(db, [
+        {"type": "test_latest", "value": float(10 * i + hour), "unit": "u", "zone_id": zone_id,
+         "timestamp": datetime(2024, 7, 1, hour)}
+        for i, zone_id in enumerate(zone_ids) for hour in range(5)
+    ])
+    db.commit()
+    # Rattrapage d'un relevé plus ancien : le dernier relevé ne change pas
+    crud.bulk_insert_indicators(db, [{"type": "test_latest", "value": -1.0, "unit": "u", "zone_id": zone_ids[0],
+                                      "timestamp": datetime(2024, 6, 30)}])
+    db.commit()
+
+    def latest():
+        response = client.get("/zones/latest", params={"type": "test_latest"})
+        assert response.status_code == 200
+        return [(item["zone_id"], item["value"], item["timestamp"]) for item in response.json()]
+
+    with assert_max_queries(2, engine, async_engine.sync_engine):  # version (ETag) + derniers relevés
+        assert latest() == [(zone_ids[0], 4.0, "2024-07-01T04:00:00"), (zone_ids[1], 14.0, "2024-07-01T04:00:00")]
+
+    newest = crud.create_indicator(db, schemas.IndicatorCreate(
+        type="test_latest", value=5.0, unit="u", zone_id=zone_ids[0], timestamp=datetime(2024, 7, 1, 5)))
+    assert latest()[0] == (zone_ids[0], 5.0, "2024-07-01T05:00:00")
+    crud.delete_indicator(db, newest.id)
+    assert latest()[0] == (zone_ids[0], 4.0, "2024-07-01T04:00:00")
+
+    etag = client.get("/zones/latest").headers["ETag"]
+    assert client.get("/zones/latest", headers={"If-None-Match": etag}).status_code == 304
+
+    # Reconstruction (table vidée, ex: base existante avant la migration)
+    db.query(models.IndicatorLatest).delete()
+    db.commit()
+    rollups.rebuild(db)
+    assert latest() == [(zone_ids[0], 4.0, "2024-07-01T04:00:00"), (zone_ids[1], 14.0, "2024-07-01T04:00:00")]
+    db.close()
+
+def get_admin_headers():
+    """Crée (si besoin) un compte admin de test et renvoie son en-tête d'authentification."""
+    client.post("/auth/register", json={"email": "admin@example.com", "password": "admin123", "role": "admin"})
+    response = client.post("/auth/login", data={"username": "admin@example.com", "password": "admin123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def test_batch_endpoint_as_admin():
+    """Test: POST /indicators/batch authentifié, dans la même session que la route"""
+    headers = get_admin_headers()
+    zone = client.post("/zones/", json={"name": "Batch API Zone", "postal_code": "00000", "country": "France"},
+                       headers=headers).json()
+    payload = [
+        {"type": "test_batch_api", "value": float(i), "unit": "u", "zone_id": zone["id"],
+         "timestamp": f"2024-06-01T{i:02d}:00:00"}
+        for i in range(3)
+    ]
+    response = client.post("/indicators/batch", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["created"] == 3
+
+def test_switch_role_updates_cached_user():
+    """Test: Le changement de rôle est visible immédiatement malgré le cache d'authentification"""
+    headers = get_admin_headers()
+    assert client.get("/users/me", headers=headers).json()["role"] == "admin"
+    response = client.post("/users/me/switch-role", json={"target_role": "user"}, headers=headers)
+    assert response.json()["new_role"] == "user"
+    assert client.get("/users/me", headers=headers).json()["role"] == "user"
+
+    # Remise en admin pour les tests suivants (un "user" ne peut plus changer de rôle)
+    db = TestingSessionLocal()
+    crud.update_user(db, crud.get_user_by_email(db, "admin@example.com"), schemas.UserUpdate(role="admin"))
+    db.close()
+    assert client.get("/users/me", headers=headers).json()["role"] == "admin"